@@ -0,0 +1,152 @@
+"""Load-test species look-ups from concurrent clients: one shared connection vs. a read-only pool.
+
+Every client is a thread calling look_up.look_up() (five queries) for random
+species for ``--seconds``. Compared at each client count:
+    shared:     one connection behind a lock, i.e. what sharing workwork.py's
+                cursor between threads amounts to
+    pool:       predict/db_pool.py's ConnectionPool (mode=ro, WAL, mmap)
+    immutable:  the same pool opened with immutable=1
+
+sqlite3 releases the GIL while a statement runs, so the pooled rows should
+scale with the clients up to about the number of cores; the shared row
+cannot. ``--workload search`` runs search.search() with typo'd names instead
+(builds the search index first).
+
+Example:
+    $ python bench_db_pool.py --size 100000 --clients 1 2 4 8 16
+    $ python bench_db_pool.py --workload search --json db_pool.json
+
+Author: 3dr-zzZ
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]/"predict"))
+import instrument  # noqa: E402
+import look_up  # noqa: E402
+import search  # noqa: E402
+from db_pool import ConnectionPool  # noqa: E402
+from synthetic_db import make_db, species_name  # noqa: E402
+
+
+class SharedConnection:
+    """The baseline: one connection, one caller at a time."""
+
+    def __init__(self, path: Path):
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def call(self, fn, *args):
+        with self._lock:
+            return fn(self._con.cursor(), *args)
+
+    def close(self) -> None:
+        self._con.close()
+
+
+class Pooled:
+    def __init__(self, path: Path, size: int, immutable: bool):
+        self.pool = ConnectionPool(path, size=size, immutable=immutable)
+
+    def call(self, fn, *args):
+        with self.pool.cursor() as cur:
+            return fn(cur, *args)
+
+    def close(self) -> None:
+        self.pool.close()
+
+
+def make_workload(kind: str, size: int):
+    """A function ``(cursor, rng) -> None`` doing one request."""
+    if kind == "lookup":
+        return lambda cur, rng: look_up.look_up(species_name(rng.randint(1, size)), cur)
+
+    def one_search(cur, rng):
+        name = species_name(rng.randint(1, size))
+        i = rng.randrange(len(name))
+        search.search(cur, name[:i] + "x" + name[i + 1:], limit=5)
+    return one_search
+
+
+def load_test(backend, workload, clients: int, seconds: float) -> float:
+    """Requests per second from ``clients`` threads hammering ``backend`` for ``seconds``."""
+    done = [0] * clients
+    start = threading.Barrier(clients + 1)
+    stop = threading.Event()
+
+    def client(i: int) -> None:
+        rng = random.Random(i)
+        start.wait()
+        while not stop.is_set():
+            backend.call(workload, rng)
+            done[i] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    start.wait()
+    t0 = time.perf_counter()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return sum(done) / (time.perf_counter() - t0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=100_000, help="Species in the synthetic database")
+    parser.add_argument("--db", type=Path, help="Use this database instead of a synthetic one")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--seconds", type=float, default=2.0, help="Duration of each run")
+    parser.add_argument("--workload", choices=["lookup", "search"], default="lookup")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    instrument.set_quiet()  # look_up() prints for every miss otherwise
+    instrument.disable()
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.db:
+            path = Path(tmp)/"pests.db"
+            path.write_bytes(args.db.read_bytes())  # the pool switches the file to WAL
+            size = sqlite3.connect(path).execute("SELECT MAX(id) FROM species;").fetchone()[0]
+        else:
+            path, size = make_db(Path(tmp)/"pests.db", args.size), args.size
+        if args.workload == "search":
+            with sqlite3.connect(path) as con:
+                search.build_index(con)
+        workload = make_workload(args.workload, size)
+
+        print(f"{os.cpu_count()} cores, {size} species, workload {args.workload}")
+        print(f"{'clients':>7} {'shared':>10} {'pool':>10} {'immutable':>10}  (requests/s)")
+        results = []
+        for clients in args.clients:
+            row = {"clients": clients}
+            for name, backend in (("shared", lambda: SharedConnection(path)),
+                                  ("pool", lambda: Pooled(path, clients, immutable=False)),
+                                  ("immutable", lambda: Pooled(path, clients, immutable=True))):
+                backend = backend()
+                try:
+                    row[name] = load_test(backend, workload, clients, args.seconds)
+                finally:
+                    backend.close()
+            results.append(row)
+            print(f"{clients:>7} {row['shared']:10.0f} {row['pool']:10.0f} {row['immutable']:10.0f}", flush=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"cores": os.cpu_count(), "species": size, "workload": args.workload,
+                       "seconds": args.seconds, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
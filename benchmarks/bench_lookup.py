@@ -0,0 +1,99 @@
+"""Benchmark species look-up latency as the species table grows.
+
+Compares, at every table size:
+    legacy:   the old look_up() (full species scan + f-string SQL per call)
+    no-index: parameterized queries from predict/queries.py, no extra indexes
+    indexed:  parameterized queries with the indexes from schema.sql
+    cache:    look_up.SpeciesProfileCache (includes build time separately)
+
+Example:
+    $ python bench_lookup.py --sizes 1000 10000 100000 --lookups 200
+
+Author: 3dr-zzZ
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]/"predict"))
+import look_up  # noqa: E402
+from synthetic_db import make_db, species_name  # noqa: E402
+
+
+def legacy_look_up(scientific_name, cur):
+    """The pre-queries.py implementation, kept here as the baseline."""
+    species_list = cur.execute("SELECT scientific_name FROM species;").fetchall()
+    if (scientific_name,) not in species_list:
+        return None
+    basics = cur.execute(f"SELECT chinese_name, other_name, traits FROM species\
+                         WHERE scientific_name = '{scientific_name}';").fetchall()[0]
+    tax = cur.execute(f"SELECT taxonomies.name, taxonomies.chinese_name, taxonomies.type FROM species\
+                      JOIN belongs ON species.id = belongs.species_id\
+                      JOIN taxonomies ON belongs.taxonomy_id = taxonomies.id\
+                      WHERE scientific_name = '{scientific_name}';").fetchall()
+    loc = cur.execute(f"SELECT locations.name, locations.type FROM species\
+                      JOIN distributed ON species.id = distributed.species_id\
+                      JOIN locations ON distributed.location_id = locations.id\
+                      WHERE scientific_name = '{scientific_name}';").fetchall()
+    dis = cur.execute(f"SELECT diseases.name FROM species\
+                      JOIN carries ON species.id = carries.species_id\
+                      JOIN diseases ON carries.disease_id = diseases.id\
+                      WHERE scientific_name = '{scientific_name}';").fetchall()
+    return look_up.build_profile(basics, tax, loc, dis)
+
+
+def time_calls(fn, names) -> list[float]:
+    latencies = []
+    for name in names:
+        t0 = time.perf_counter()
+        fn(name)
+        latencies.append(time.perf_counter() - t0)
+    return latencies
+
+
+def summarize(latencies: list[float]) -> str:
+    ms = sorted(x * 1000 for x in latencies)
+    p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+    return f"median={statistics.median(ms):8.3f}ms  p95={p95:8.3f}ms"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--legacy-lookups", type=int, default=20,
+                        help="the legacy path scans the whole table, so use fewer calls")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            names = [species_name(rng.randint(1, size)) for _ in range(args.lookups)]
+            plain = make_db(Path(tmp)/f"plain_{size}.db", size, with_indexes=False)
+            indexed = make_db(Path(tmp)/f"indexed_{size}.db", size, with_indexes=True)
+            print(f"--- {size} species ---")
+
+            cur = look_up.load_database(plain)
+            lat = time_calls(lambda n: legacy_look_up(n, cur), names[:args.legacy_lookups])
+            print(f"legacy    {summarize(lat)}")
+            lat = time_calls(lambda n: look_up.look_up(n, cur), names)
+            print(f"no-index  {summarize(lat)}")
+
+            cur = look_up.load_database(indexed)
+            lat = time_calls(lambda n: look_up.look_up(n, cur), names)
+            print(f"indexed   {summarize(lat)}")
+
+            t0 = time.perf_counter()
+            cache = look_up.SpeciesProfileCache(indexed)
+            build = time.perf_counter() - t0
+            lat = time_calls(cache.get, names)
+            print(f"cache     {summarize(lat)}  (build {build:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
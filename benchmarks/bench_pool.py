@@ -0,0 +1,124 @@
+"""Sweep worker processes x threads per worker for CPU inference and report images/sec.
+
+Every configuration classifies the same images through predict/pool.py's
+InferencePool (decode + preprocess + forward inside the workers). The
+baseline is one process with torch's default thread count running
+predict.py's batched path (a thread pool decodes, the model runs on all cores).
+Pool start-up and one warm-up round are excluded from the timings.
+
+Example:
+    $ python bench_pool.py --synthetic --images 256
+    $ python bench_pool.py --model ../best_convnext_tiny.pth --classes ../class_mapping.json \\
+          --image-dir ../dataset/split/test --workers 1 2 4 8 --threads 1 2 4
+
+Author: 3dr-zzZ
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]/"predict"))
+import torch  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import pool  # noqa: E402
+import predict  # noqa: E402
+from bench_startup import PROJECT_ROOT, make_synthetic  # noqa: E402
+
+
+def default_grid(cores: int) -> list[tuple[int, int]]:
+    """Every workers x threads layout (powers of two) that fills at most ``cores`` cores."""
+    powers = [p for p in (1, 2, 4, 8, 16, 32, 64) if p <= cores]
+    return [(w, t) for w in powers for t in powers if w * t <= cores]
+
+
+def make_images(tmp: Path, count: int, size: tuple[int, int] = (640, 480)) -> list[Path]:
+    paths = []
+    for i in range(count):
+        path = tmp/f"img_{i:05d}.jpg"
+        Image.effect_noise(size, 32 + i % 64).convert("RGB").save(path)
+        paths.append(path)
+    return paths
+
+
+def bench_baseline(model_path: Path, class_map: dict, paths: list[Path], batch_size: int) -> float:
+    model = predict.load_model(model_path, len(class_map))
+    transform = predict.get_transforms()
+    batches = lambda items: predict.prefetch_batches(items, transform, batch_size)
+    for _, batch in batches(paths[:batch_size]):  # warm-up
+        predict.predict_tensors(batch, model, class_map)
+    t0 = time.perf_counter()
+    for _, batch in batches(paths):
+        predict.predict_tensors(batch, model, class_map)
+    return len(paths) / (time.perf_counter() - t0)
+
+
+def bench_pool(model_path: Path, class_map: dict, paths: list[Path], batch_size: int,
+               workers: int, threads: int) -> float:
+    with pool.InferencePool(model_path, class_map, workers, threads) as workers_pool:
+        list(workers_pool.map(paths[:workers * batch_size], batch_size))  # warm-up, one batch each
+        t0 = time.perf_counter()
+        n = sum(1 for _ in workers_pool.map(paths, batch_size))
+        return n / (time.perf_counter() - t0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", type=Path, default=PROJECT_ROOT/"best_convnext_tiny.pth")
+    parser.add_argument("--classes", type=Path, default=PROJECT_ROOT/"class_mapping.json")
+    parser.add_argument("--image-dir", type=Path, help="Use the images under this folder (recursively)")
+    parser.add_argument("--synthetic", action="store_true",
+                        help="use a random-init model and generated images instead of real files")
+    parser.add_argument("--num-classes", type=int, default=126)
+    parser.add_argument("--images", type=int, default=256, help="Images per configuration")
+    parser.add_argument("--batch-size", "-b", type=int, default=16)
+    parser.add_argument("--workers", type=int, nargs="+", help="Worker counts to sweep")
+    parser.add_argument("--threads", type=int, nargs="+", help="Threads per worker to sweep")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    cores = len(pool.available_cores())
+    if args.workers or args.threads:
+        grid = [(w, t) for w in args.workers or [1] for t in args.threads or [1]]
+    else:
+        grid = default_grid(cores)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        if args.synthetic:
+            args.model, args.classes, _ = make_synthetic(tmp, args.num_classes)
+        if args.image_dir:
+            paths = sorted(p for p in args.image_dir.rglob("*") if p.suffix.lower() in predict.IMG_EXTS)
+            paths = (paths * (args.images // max(len(paths), 1) + 1))[:args.images]
+        else:
+            paths = make_images(tmp, args.images)
+        if not paths:
+            parser.error(f"no images found under {args.image_dir}")
+        with open(args.classes, "r", encoding="utf-8") as f:
+            class_map = json.load(f)
+
+        print(f"{cores} cores, {len(paths)} images, batch size {args.batch_size}")
+        print(f"{'workers':>7} {'threads':>7} {'cores':>6} {'img/s':>8} {'vs base':>8}")
+        base = bench_baseline(args.model, class_map, paths, args.batch_size)
+        print(f"{'base':>7} {torch.get_num_threads():>7} {cores:>6} {base:8.1f} {1.0:7.2f}x", flush=True)
+        results = [{"workers": 1, "threads": torch.get_num_threads(), "baseline": True, "images_per_sec": base}]
+        for workers, threads in grid:
+            rate = bench_pool(args.model, class_map, paths, args.batch_size, workers, threads)
+            results.append({"workers": workers, "threads": threads, "baseline": False, "images_per_sec": rate})
+            print(f"{workers:>7} {threads:>7} {workers * threads:>6} {rate:8.1f} {rate / base:7.2f}x", flush=True)
+
+    best = max(results, key=lambda r: r["images_per_sec"])
+    print(f"\nbest: {best['workers']} worker(s) x {best['threads']} thread(s), "
+          f"{best['images_per_sec']:.1f} img/s")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"cores": cores, "images": len(paths), "batch_size": args.batch_size,
+                       "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
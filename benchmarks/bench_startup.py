@@ -0,0 +1,148 @@
+"""Measure cold start to first prediction, each run in a fresh interpreter.
+
+Scenarios:
+    legacy:      import torch + torchvision + timm, build the timm model, plain
+                 torch.load, torchvision transforms (how predict.py used to start)
+    rebuild:     predict.load_model() without cache (lazy timm, mmap, meta-device build)
+    cache-cold:  predict.load_model(cache=True) with no cache yet (builds it)
+    cache-warm:  predict.load_model(cache=True) with the cache present
+    lookup-only: import look_up and run one query; checks torch is never imported
+
+Example:
+    $ python bench_startup.py --synthetic --repeats 3
+    $ python bench_startup.py --model ../best_convnext_tiny.pth --classes ../class_mapping.json --image pest.jpg
+
+Author: 3dr-zzZ
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+PREDICT_DIR = PROJECT_ROOT/"predict"
+
+CHILD_PRELUDE = f"""
+import json, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, {str(PREDICT_DIR)!r})
+"""
+
+SCENARIOS = {
+    "legacy": """
+import torch, timm
+from PIL import Image
+from torchvision import transforms
+t_import = time.perf_counter()
+class_map = json.load(open(CLASSES, encoding="utf-8"))
+model = timm.create_model("convnext_tiny.in12k", pretrained=False, num_classes=len(class_map))
+model.load_state_dict(torch.load(MODEL, map_location="cpu"))
+model.eval()
+transform = transforms.Compose([transforms.Resize((224, 224)), transforms.ToTensor(),
+                                transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])])
+t_load = time.perf_counter()
+with torch.inference_mode():
+    model(transform(Image.open(IMAGE).convert("RGB")).unsqueeze(0))
+""",
+    "rebuild": """
+import predict
+t_import = time.perf_counter()
+class_map = json.load(open(CLASSES, encoding="utf-8"))
+model = predict.load_model(MODEL, len(class_map))
+transform = predict.get_transforms()
+t_load = time.perf_counter()
+predict.predict_one(IMAGE, model, transform, class_map)
+""",
+    "cache": """
+import predict
+t_import = time.perf_counter()
+class_map = json.load(open(CLASSES, encoding="utf-8"))
+model = predict.load_model(MODEL, len(class_map), cache=True)
+transform = predict.get_transforms()
+t_load = time.perf_counter()
+predict.predict_one(IMAGE, model, transform, class_map)
+""",
+    "lookup-only": """
+import look_up
+t_import = time.perf_counter()
+cur = look_up.load_database(DB)
+t_load = time.perf_counter()
+look_up.look_up("Aedes albopictus", cur)
+assert "torch" not in sys.modules, "look_up imported torch"
+""",
+}
+
+CHILD_EPILOGUE = """
+t_end = time.perf_counter()
+print("__RESULT__" + json.dumps({"import": t_import - t0, "load": t_load - t_import,
+                                 "first_predict": t_end - t_load, "total": t_end - t0}))
+"""
+
+
+def run_child(scenario: str, model: Path, classes: Path, image: Path, db: Path) -> dict:
+    code = (CHILD_PRELUDE
+            + f"MODEL, CLASSES, IMAGE, DB = {str(model)!r}, {str(classes)!r}, {str(image)!r}, {str(db)!r}\n"
+            + SCENARIOS[scenario] + CHILD_EPILOGUE)
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    line = next(l for l in out.stdout.splitlines() if l.startswith("__RESULT__"))
+    return json.loads(line[len("__RESULT__"):])
+
+
+def make_synthetic(tmp: Path, num_classes: int) -> tuple[Path, Path, Path]:
+    """Random-init convnext_tiny checkpoint, class map and one image."""
+    import timm
+    import torch
+    from PIL import Image
+
+    model = timm.create_model("convnext_tiny.in12k", pretrained=False, num_classes=num_classes)
+    torch.save(model.state_dict(), tmp/"model.pth")
+    with open(tmp/"class_mapping.json", "w", encoding="utf-8") as f:
+        json.dump({str(i): f"Genus{i}_species{i}" for i in range(num_classes)}, f)
+    Image.effect_noise((1600, 1200), 64).convert("RGB").save(tmp/"image.jpg")
+    return tmp/"model.pth", tmp/"class_mapping.json", tmp/"image.jpg"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cold-start benchmark")
+    parser.add_argument("--model", type=Path, default=PROJECT_ROOT/"best_convnext_tiny.pth")
+    parser.add_argument("--classes", type=Path, default=PROJECT_ROOT/"class_mapping.json")
+    parser.add_argument("--image", type=Path)
+    parser.add_argument("--db", type=Path, default=PROJECT_ROOT/"database"/"pests.db")
+    parser.add_argument("--synthetic", action="store_true",
+                        help="use a random-init model with --num-classes classes instead of real files")
+    parser.add_argument("--num-classes", type=int, default=126)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        if args.synthetic:
+            args.model, args.classes, args.image = make_synthetic(tmp, args.num_classes)
+        if args.image is None:
+            parser.error("--image is required unless --synthetic is given")
+
+        cache_file = args.model.with_suffix(".cpu.cache.pt")
+        plan = [("legacy", "legacy"), ("rebuild", "rebuild"),
+                ("cache-cold", "cache"), ("cache-warm", "cache"), ("lookup-only", "lookup-only")]
+        results = {}
+        for name, scenario in plan:
+            runs = []
+            for _ in range(args.repeats):
+                if name == "cache-cold":
+                    cache_file.unlink(missing_ok=True)
+                runs.append(run_child(scenario, args.model, args.classes, args.image, args.db))
+            results[name] = {key: statistics.median(r[key] for r in runs) for key in runs[0]}
+
+    base = results["legacy"]["total"]
+    print(f"{'scenario':<12} {'import':>8} {'load':>8} {'1st pred':>9} {'total':>8} {'vs legacy':>10}")
+    for name, r in results.items():
+        print(f"{name:<12} {r['import']:8.2f} {r['load']:8.2f} {r['first_predict']:9.2f} "
+              f"{r['total']:8.2f} {base / r['total']:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
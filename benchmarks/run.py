@@ -0,0 +1,373 @@
+"""Repeatable benchmark suite for the whole identify pipeline, with machine-readable results.
+
+Every benchmark runs on synthetic fixtures built in a temporary folder, so
+it needs no dataset, weights or database:
+    images      noise JPEGs of several sizes (bench_pool.make_images)
+    model       a randomly initialized convnext_tiny with the class count
+                of class_mapping.json (126 if it is missing)
+    pests.db    synthetic_db.make_db() at several sizes, and the same data
+                exported as data_csv-style CSV files for csv_to_db.py
+
+Benchmarks (``--only`` picks some):
+    predict_one   predict.predict_one() on one image, per image size
+    batch         prefetch_batches() + predict_tensors() over mixed-size
+                  images, per batch size
+    look_up       look_up(), look_up_many() on top-3 groups and
+                  SpeciesProfileCache (build and get), per database size
+    csv_to_db     fast bulk load (incl. indexes and search index) into a new
+                  database, and a sync with nothing to change, per size
+    split         split.py in manifest and hardlink mode, per image count
+
+Results go to ``--out`` as JSON: the git commit, the environment, and one
+record per benchmark and parameter set with the median/mean/min/stdev of
+the repeats. Records are keyed by ``id`` (e.g. ``look_up[species=10000]``),
+so two runs can be diffed with ``--compare``, which prints the change of
+every median and exits with status 1 if one regressed by more than
+``--threshold``.
+
+Example:
+    $ python run.py --preset quick --out base.json
+    $ python run.py --preset quick --out new.json --compare base.json
+    $ python run.py --only look_up csv_to_db --repeats 10
+
+Author: 3dr-zzZ
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_ROOT/"predict"))
+import instrument  # noqa: E402
+from synthetic_db import export_csvs, make_db, species_name  # noqa: E402
+
+
+# ------ configuration ------
+PRESETS = {
+    "quick": {
+        "repeats": 3,
+        "image_sizes": [(320, 240), (1600, 1200)],
+        "batch_sizes": [1, 8],
+        "batch_images": 32,
+        "lookups": 200,
+        "db_sizes": [1_000, 10_000],
+        "split_sizes": [1_000],
+    },
+    "full": {
+        "repeats": 5,
+        "image_sizes": [(320, 240), (1024, 768), (1600, 1200), (4000, 3000)],
+        "batch_sizes": [1, 8, 32],
+        "batch_images": 128,
+        "lookups": 1_000,
+        "db_sizes": [1_000, 10_000, 100_000],
+        "split_sizes": [1_000, 10_000, 50_000],
+    },
+}
+SPLIT_CLASSES = 50
+SPLIT_MODES = ("manifest", "hardlink")
+# ---------------------------
+
+
+# ------ measuring ------
+def measure(fn, repeats: int, warmup: int = 1, setup=None) -> list[float]:
+    """Seconds per call of ``fn(*setup())`` over ``repeats`` timed calls; ``setup`` is not timed."""
+    samples = []
+    for i in range(warmup + repeats):
+        args = setup() if setup else ()
+        t0 = time.perf_counter()
+        fn(*args)
+        if i >= warmup:
+            samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def record(name: str, params: dict, samples: list[float], items: int = 1) -> dict:
+    """One result: stats of the samples (seconds per call) and throughput of ``items`` per call."""
+    median = statistics.median(samples)
+    return {
+        "id": f"{name}[{','.join(f'{k}={v}' for k, v in params.items())}]",
+        "name": name,
+        "params": params,
+        "repeats": len(samples),
+        "median": median,
+        "mean": statistics.fmean(samples),
+        "min": min(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "items": items,
+        "items_per_s": items / median if median else None,
+    }
+
+
+@contextlib.contextmanager
+def working_dir(path: Path):
+    old = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(old)
+
+
+# ------ fixtures ------
+class Fixtures:
+    """Synthetic inputs under ``tmp``, each built on first use and reused across benchmarks."""
+
+    def __init__(self, tmp: Path, num_classes: int):
+        self.tmp = tmp
+        self.num_classes = num_classes
+        self._model = None
+        self._images: dict[tuple[int, int], list[Path]] = {}
+        self._dbs: dict[int, Path] = {}
+        self._csvs: dict[int, Path] = {}
+
+    def model(self):
+        """*(model, transform, class_map)* of a random-init convnext_tiny."""
+        if self._model is None:
+            import predict
+            from bench_startup import make_synthetic
+
+            model_path, classes_path, _ = make_synthetic(self.tmp, self.num_classes)
+            with open(classes_path, "r", encoding="utf-8") as f:
+                class_map = json.load(f)
+            self._model = (predict.load_model(model_path, len(class_map)), predict.get_transforms(), class_map)
+        return self._model
+
+    def images(self, size: tuple[int, int], count: int) -> list[Path]:
+        have = self._images.get(size, [])
+        if len(have) < count:
+            from bench_pool import make_images
+
+            folder = self.tmp/f"images_{size[0]}x{size[1]}"
+            folder.mkdir(exist_ok=True)
+            have = self._images[size] = make_images(folder, count, size)
+        return have[:count]
+
+    def db(self, n_species: int) -> Path:
+        if n_species not in self._dbs:
+            self._dbs[n_species] = make_db(self.tmp/f"pests_{n_species}.db", n_species)
+        return self._dbs[n_species]
+
+    def csvs(self, n_species: int) -> Path:
+        if n_species not in self._csvs:
+            self._csvs[n_species] = export_csvs(self.db(n_species), self.tmp/f"data_csv_{n_species}")
+        return self._csvs[n_species]
+
+
+# ------ benchmarks ------
+def bench_predict_one(fx: Fixtures, cfg: dict):
+    import predict
+
+    model, transform, class_map = fx.model()
+    for size in cfg["image_sizes"]:
+        path = fx.images(size, 1)[0]
+        samples = measure(lambda: predict.predict_one(path, model, transform, class_map), cfg["repeats"])
+        yield record("predict_one", {"size": f"{size[0]}x{size[1]}"}, samples)
+
+
+def bench_batch(fx: Fixtures, cfg: dict):
+    import predict
+
+    model, transform, class_map = fx.model()
+    per_size = max(1, cfg["batch_images"] // len(cfg["image_sizes"]))
+    paths = [p for size in cfg["image_sizes"] for p in fx.images(size, per_size)]
+    random.Random(0).shuffle(paths)
+
+    def run(batch_size: int) -> None:
+        for _, batch in predict.prefetch_batches(paths, transform, batch_size):
+            predict.predict_tensors(batch, model, class_map)
+
+    for batch_size in cfg["batch_sizes"]:
+        samples = measure(lambda: run(batch_size), cfg["repeats"])
+        yield record("batch", {"batch_size": batch_size, "images": len(paths)}, samples, items=len(paths))
+
+
+def bench_look_up(fx: Fixtures, cfg: dict):
+    import look_up
+
+    rng = random.Random(0)
+    for size in cfg["db_sizes"]:
+        path = fx.db(size)
+        names = [species_name(rng.randint(1, size)) for _ in range(cfg["lookups"])]
+        groups = [names[i:i + 3] for i in range(0, len(names), 3)]
+        params = {"species": size}
+        cur = look_up.load_database(path)
+
+        samples = measure(lambda: [look_up.look_up(n, cur) for n in names], cfg["repeats"])
+        yield record("look_up", params, samples, items=len(names))
+        samples = measure(lambda: [look_up.look_up_many(g, cur) for g in groups], cfg["repeats"])
+        yield record("look_up_many", params, samples, items=len(groups))
+
+        caches = []
+        samples = measure(lambda: caches.append(look_up.SpeciesProfileCache(path)), cfg["repeats"], warmup=0)
+        yield record("profile_cache_build", params, samples)
+        samples = measure(lambda: [caches[-1].get(n) for n in names], cfg["repeats"])
+        yield record("profile_cache_get", params, samples, items=len(names))
+        cur.connection.close()
+
+
+def bench_csv_to_db(fx: Fixtures, cfg: dict):
+    sys.path.insert(0, str(PROJECT_ROOT/"database"))
+    import csv_to_db
+
+    schema = (PROJECT_ROOT/"database"/"schema.sql").read_text(encoding="utf-8")
+    for size in cfg["db_sizes"]:
+        # csv_to_db.py resolves ../pests.db, ../data_csv and ../schema.sql from its working directory
+        root = fx.tmp/f"csv_to_db_{size}"
+        (root/"work").mkdir(parents=True, exist_ok=True)
+        (root/"schema.sql").write_text(schema, encoding="utf-8")
+        data_csv = root/"data_csv"
+        if not data_csv.exists():
+            data_csv.symlink_to(fx.csvs(size), target_is_directory=True)
+        rows = 0
+        for csv_path in data_csv.glob("*.csv"):
+            with open(csv_path, encoding="utf-8") as f:
+                rows += sum(1 for _ in f) - 1
+        params = {"species": size, "rows": rows}
+
+        def fresh_db() -> tuple:
+            for suffix in ("", "-wal", "-shm"):
+                Path(f"{root/'pests.db'}{suffix}").unlink(missing_ok=True)
+            return ()
+
+        with working_dir(root/"work"), contextlib.redirect_stdout(io.StringIO()):
+            fast = measure(csv_to_db.fast_main, cfg["repeats"], warmup=0, setup=fresh_db)
+            sync = measure(csv_to_db.sync_main, cfg["repeats"], warmup=0)
+        yield record("csv_to_db_fast", params, fast, items=rows)
+        yield record("csv_to_db_sync", params, sync, items=rows)
+
+
+def bench_split(fx: Fixtures, cfg: dict):
+    sys.path.insert(0, str(PROJECT_ROOT/"dataset"))
+    import split
+
+    for count in cfg["split_sizes"]:
+        src = fx.tmp/f"split_in_{count}"
+        if not src.exists():  # split.py never opens the images, empty files are enough
+            for i in range(count):
+                folder = src/f"Genus{i % SPLIT_CLASSES}_species{i % SPLIT_CLASSES}"
+                folder.mkdir(parents=True, exist_ok=True)
+                (folder/f"img_{i:06d}.jpg").touch()
+        for mode in SPLIT_MODES:
+            runs = iter(range(1_000_000))
+
+            def fresh_output() -> tuple:
+                split.OUTPUT_DIR = str(fx.tmp/f"split_out_{count}_{mode}_{next(runs)}")
+                return ()
+
+            split.INPUT_DIR, split.MODE, split.SEED = str(src), mode, 42
+            with contextlib.redirect_stdout(io.StringIO()):
+                samples = measure(split.main, cfg["repeats"], setup=fresh_output)
+            yield record("split", {"images": count, "mode": mode}, samples, items=count)
+
+
+BENCHMARKS = {
+    "predict_one": bench_predict_one,
+    "batch": bench_batch,
+    "look_up": bench_look_up,
+    "csv_to_db": bench_csv_to_db,
+    "split": bench_split,
+}
+
+
+# ------ report ------
+def environment() -> dict:
+    def git(*args: str) -> str | None:
+        try:
+            return subprocess.run(["git", *args], cwd=PROJECT_ROOT, capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    torch = sys.modules.get("torch")
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "torch": torch.__version__ if torch else None,
+        "torch_threads": torch.get_num_threads() if torch else None,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(base: dict, new: dict, threshold: float) -> int:
+    """Print the median change of every shared record; returns the number of regressions."""
+    old = {r["id"]: r for r in base["results"]}
+    regressions = 0
+    print(f"\nvs {base['env'].get('commit') or '?'}:")
+    for r in new["results"]:
+        if r["id"] not in old:
+            print(f"  {r['id']:<52} (new)")
+            continue
+        change = r["median"] / old[r["id"]]["median"] - 1
+        flag = ""
+        if change > threshold:
+            flag, regressions = "  REGRESSION", regressions + 1
+        elif change < -threshold:
+            flag = "  faster"
+        print(f"  {r['id']:<52} {old[r['id']]['median'] * 1000:10.2f}ms -> {r['median'] * 1000:10.2f}ms "
+              f"{change:+7.1%}{flag}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--preset", choices=PRESETS, default="full", help="Sizes to run (default: full)")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, help="Run only these benchmarks")
+    parser.add_argument("--repeats", type=int, help="Timed repeats per measurement (default: from the preset)")
+    parser.add_argument("--num-classes", type=int, help="Classes of the synthetic model "
+                        "(default: from class_mapping.json, else 126)")
+    parser.add_argument("--out", default="bench_results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", type=Path, help="A previous --out file to diff against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative slow-down of a median counted as a regression (default: 0.10)")
+    args = parser.parse_args()
+
+    cfg = dict(PRESETS[args.preset])
+    if args.repeats:
+        cfg["repeats"] = args.repeats
+    num_classes = args.num_classes
+    if num_classes is None:
+        class_map_path = PROJECT_ROOT/"class_mapping.json"
+        num_classes = len(json.loads(class_map_path.read_text(encoding="utf-8"))) if class_map_path.exists() else 126
+    instrument.set_quiet()  # no "running on cpu" / "not in database" per call
+    instrument.disable()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        fx = Fixtures(Path(tmp), num_classes)
+        for name in args.only or BENCHMARKS:
+            for r in BENCHMARKS[name](fx, cfg):
+                results.append(r)
+                print(f"{r['id']:<52} median {r['median'] * 1000:10.2f}ms  "
+                      f"({r['items_per_s']:,.1f} items/s)", flush=True)
+
+    report = {"env": environment(), "preset": args.preset, "config": cfg, "num_classes": num_classes,
+              "results": results}
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            base = json.load(f)
+        if compare(base, report, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
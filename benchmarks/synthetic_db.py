@@ -0,0 +1,103 @@
+"""Build a synthetic pests.db of arbitrary size from database/schema.sql.
+
+Species get the same shape of data as the hand-filled CSVs: 5 taxonomy
+ranks, a handful of locations and diseases each.
+
+Functions:
+    make_db(): create the database at a given path.
+    export_csvs(): dump its tables as database/data_csv-style CSV files.
+
+Example:
+    $ python synthetic_db.py /tmp/pests_100k.db 100000
+
+Author: 3dr-zzZ
+"""
+
+import csv
+import random
+import re
+import sqlite3
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+SCHEMA_PATH = PROJECT_ROOT/"database"/"schema.sql"
+
+N_TAXONOMIES = 500
+N_LOCATIONS = 300
+N_DISEASES = 100
+RANKS = ["phylum", "class", "order", "family", "genus"]
+
+
+def make_db(path: str | Path, n_species: int, with_indexes: bool = True, seed: int = 0) -> Path:
+    """Create a database with ``n_species`` species at ``path`` (overwritten if present)."""
+    path = Path(path)
+    path.unlink(missing_ok=True)
+    rng = random.Random(seed)
+    schema = SCHEMA_PATH.read_text(encoding="utf-8")
+    if not with_indexes:
+        schema = re.sub(r"CREATE INDEX[^;]+;", "", schema)
+
+    con = sqlite3.connect(path)
+    con.executescript(schema)
+    con.executemany(
+        'INSERT INTO taxonomies VALUES (?, ?, ?, ?);',
+        [(i, f"Taxon{i}", f"分类{i}", RANKS[i % 5]) for i in range(1, N_TAXONOMIES + 1)],
+    )
+    con.executemany(
+        'INSERT INTO locations VALUES (?, ?, ?);',
+        [(i, f"地点{i}", ("province", "country", "region")[i % 3]) for i in range(1, N_LOCATIONS + 1)],
+    )
+    con.executemany(
+        'INSERT INTO diseases VALUES (?, ?, ?);',
+        [(i, f"疾病{i}", None) for i in range(1, N_DISEASES + 1)],
+    )
+    con.executemany(
+        'INSERT INTO species VALUES (?, ?, ?, ?, ?);',
+        ((i, species_name(i), f"物种{i}", f"别名{i}", "鉴别特征" * 20) for i in range(1, n_species + 1)),
+    )
+    con.executemany(
+        'INSERT INTO belongs VALUES (?, ?);',
+        ((i, rank + 1 + 5 * rng.randrange(N_TAXONOMIES // 5))
+         for i in range(1, n_species + 1) for rank in range(5)),
+    )
+    con.executemany(
+        'INSERT OR IGNORE INTO distributed VALUES (?, ?);',
+        ((i, rng.randint(1, N_LOCATIONS)) for i in range(1, n_species + 1) for _ in range(8)),
+    )
+    con.executemany(
+        'INSERT OR IGNORE INTO carries VALUES (?, ?);',
+        ((i, rng.randint(1, N_DISEASES)) for i in range(1, n_species + 1) for _ in range(2)),
+    )
+    con.commit()
+    con.close()
+    return path
+
+
+def export_csvs(db_path: str | Path, out_dir: str | Path) -> Path:
+    """Write every non-empty table of ``db_path`` to ``out_dir/<table>.csv``, like database/data_csv."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(db_path)
+    tables = [name for name, in con.execute("SELECT name FROM sqlite_master WHERE type = 'table';")]
+    for table in tables:
+        cur = con.execute(f'SELECT * FROM "{table}";')
+        first = cur.fetchone()
+        if first is None:
+            continue
+        with open(out_dir/f"{table}.csv", "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow([col[0] for col in cur.description])
+            writer.writerow(first)
+            writer.writerows(cur)
+    con.close()
+    return out_dir
+
+
+def species_name(i: int) -> str:
+    """Binomial-looking name of synthetic species ``i``."""
+    return f"Genus{i // 10} species{i}"
+
+
+if __name__ == "__main__":
+    print(make_db(sys.argv[1], int(sys.argv[2])))
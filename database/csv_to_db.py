@@ -1,9 +1,17 @@
+import hashlib
+import re
 import sqlite3
 import pathlib
+import sys
+import time
 import pandas as pd
 
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "predict"))
+import search  # noqa: E402  (builds the full-text / fuzzy search tables)
+
 DB_PATH   = "../pests.db"      # adjust if you keep the DB elsewhere
 CSV_DIR   = pathlib.Path("../data_csv")
+SCHEMA_PATH = pathlib.Path("../schema.sql")  # indexes are read from here
 TABLES_IN_ORDER = [
     # parents first
     "species", "taxonomies", "diseases", "locations", "references", "medias",
@@ -11,28 +19,288 @@ TABLES_IN_ORDER = [
     "belongs", "distributed", "carries",
     "species_reference"
 ]
-MODE = "replace"  # append: append, replace: replace & reload
+MODE = "replace"  # append: append, replace: replace & reload, fast: bulk reload (see fast_load_table),
+                  # sync: apply only inserted/updated/deleted rows (see sync_table)
+CHUNKSIZE = 100_000  # rows per CSV chunk in fast and sync mode
+REPORT_LIMIT = 20    # changed rows listed per table in sync mode
 
 def load_table(csv_file: pathlib.Path, conn: sqlite3.Connection):
     print(f"Loading {csv_file.name} …")
     df = pd.read_csv(csv_file)
     # optional: explicit dtypes to avoid float-converted IDs
-    # detect columns that contain only whole‑number values
-    int_cols = [
-        col for col in df.columns
-        if df[col].dropna()
-                 .apply(lambda v: isinstance(v, (int, float)) and float(v).is_integer())
-                 .all()
-    ]
-    for col in int_cols:
-        df[col] = df[col].astype("Int64")  # nullable integer
+    df = cast_int_columns(df)
     df.to_sql(csv_file.stem, conn,
               if_exists=MODE,
               index=False,
               method="multi",      # bulk executemany
               chunksize=1000)
 
+def cast_int_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Cast columns that contain only whole‑number values to nullable Int64.
+
+    Vectorized: pandas parses numeric columns with gaps as float64, so only
+    those need a ``v == round(v)`` check; text columns are left alone.
+    """
+    for col in df.columns:
+        values = df[col]
+        if pd.api.types.is_float_dtype(values):
+            non_null = values.dropna()
+            if (non_null == non_null.round()).all():
+                df[col] = values.astype("Int64")  # nullable integer
+        elif pd.api.types.is_integer_dtype(values) or values.isna().all():
+            df[col] = values.astype("Int64")
+    return df
+
+def python_rows(df: pd.DataFrame):
+    """Iterate over the rows of ``df`` as tuples of plain Python values (NaN/NA -> None)."""
+    # column-wise conversion is much cheaper than converting row by row
+    values = [df[col].astype(object).where(df[col].notna(), None).tolist()
+              for col in df.columns]
+    return zip(*values)
+
+def ensure_schema(conn: sqlite3.Connection, schema_path: pathlib.Path = SCHEMA_PATH,
+                  rebuild: frozenset[str] = frozenset()):
+    """Create the tables declared in schema.sql that do not exist yet.
+
+    Tables named in ``rebuild`` whose definition differs from schema.sql
+    (e.g. created by ``to_sql`` in replace mode, without any keys) are
+    dropped and recreated; their rows are lost, so the caller reloads them.
+    """
+    schema = schema_path.read_text(encoding="utf-8")
+    existing = dict(conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table';").fetchall())
+    for stmt in re.findall(r"CREATE TABLE[^;]+;", schema):
+        name = re.match(r'CREATE TABLE\s+"(\w+)"', stmt).group(1)
+        if name in existing and name in rebuild and \
+                " ".join(existing[name].split()) != " ".join(stmt.rstrip(";").split()):
+            print(f"Recreating {name} from schema.sql (its definition differs)")
+            conn.execute(f'DROP TABLE "{name}";')
+            del existing[name]
+        if name not in existing:
+            conn.execute(stmt)
+
+def drop_indexes(conn: sqlite3.Connection, schema_path: pathlib.Path = SCHEMA_PATH):
+    """Drop the indexes declared in schema.sql so bulk inserts don't maintain them row by row."""
+    schema = schema_path.read_text(encoding="utf-8")
+    for name in re.findall(r'CREATE INDEX IF NOT EXISTS "(\w+)"', schema):
+        conn.execute(f'DROP INDEX IF EXISTS "{name}";')
+
+def fast_load_table(csv_file: pathlib.Path, conn: sqlite3.Connection,
+                    chunksize: int = CHUNKSIZE) -> int:
+    """Reload a table from a CSV file in chunks with ``executemany``.
+
+    The CSV is streamed ``chunksize`` rows at a time and inserted with one
+    prepared INSERT, inside whatever transaction the caller holds. The table
+    keeps its schema.sql definition (keys, constraints); only its rows are
+    replaced. Returns the number of rows loaded.
+    """
+    table = csv_file.stem
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?;",
+                          (table,)).fetchone()
+    rows = 0
+    t0 = time.perf_counter()
+    for chunk in pd.read_csv(csv_file, chunksize=chunksize):
+        chunk = cast_int_columns(chunk)
+        if not exists:  # table unknown to schema.sql: let pandas derive it
+            conn.execute(pd.io.sql.get_schema(chunk, table, con=conn))
+            exists = True
+        elif rows == 0:
+            conn.execute(f'DELETE FROM "{table}";')
+        columns = ", ".join(f'"{col}"' for col in chunk.columns)
+        placeholders = ", ".join("?" * len(chunk.columns))
+        conn.executemany(f'INSERT INTO "{table}" ({columns}) VALUES ({placeholders});',
+                         python_rows(chunk))
+        rows += len(chunk)
+    elapsed = time.perf_counter() - t0
+    print(f"Loaded {csv_file.name}: {rows} rows in {elapsed:.2f}s "
+          f"({rows / max(elapsed, 1e-9):,.0f} rows/s)")
+    return rows
+
+def fast_main():
+    """Bulk reload every table in one transaction, then rebuild the indexes."""
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)  # manage the transaction ourselves
+    conn.execute("PRAGMA journal_mode = WAL;")  # persistent; lets readers keep going during loads
+    conn.execute("PRAGMA synchronous = OFF;")   # per-connection: only this load runs unsynced
+    conn.execute("PRAGMA cache_size = -262144;")  # 256 MiB
+    conn.execute("PRAGMA foreign_keys = OFF;")
+    t0 = time.perf_counter()
+    total = 0
+    conn.execute("BEGIN;")
+    try:
+        # tables about to be reloaded are safe to recreate, e.g. keyless ones left by replace mode
+        ensure_schema(conn, rebuild=frozenset(t for t in TABLES_IN_ORDER if (CSV_DIR / f"{t}.csv").exists()))
+        drop_indexes(conn)
+        for table in TABLES_IN_ORDER:
+            csv_path = CSV_DIR / f"{table}.csv"
+            if csv_path.exists():
+                total += fast_load_table(csv_path, conn)
+            else:
+                print(f"⚠  {csv_path.name} not found; skipping")
+        create_indexes(conn)
+        build_search_index(conn)
+        conn.execute("COMMIT;")
+    except BaseException:
+        conn.execute("ROLLBACK;")
+        raise
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - t0
+    print(f"✅ All done! {total} rows in {elapsed:.2f}s ({total / max(elapsed, 1e-9):,.0f} rows/s)")
+
+def _affinity_cast(declared_type: str):
+    """Return a function mapping a CSV value to what SQLite stores for ``declared_type``.
+
+    Needed so a CSV row and the stored row hash the same when nothing changed
+    (e.g. 3.0 read from CSV vs 3 stored in an INTEGER column).
+    """
+    t = (declared_type or "").upper()
+    if "INT" in t:
+        return lambda v: int(v) if isinstance(v, float) and v.is_integer() else v
+    if any(k in t for k in ("CHAR", "CLOB", "TEXT")):
+        return lambda v: v if v is None or isinstance(v, str) else str(v)
+    if any(k in t for k in ("REAL", "FLOA", "DOUB")):
+        return lambda v: float(v) if isinstance(v, int) else v
+    return lambda v: v
+
+def primary_key(conn: sqlite3.Connection, table: str) -> list[str]:
+    """Primary-key column names of ``table``, in key order."""
+    info = conn.execute(f'PRAGMA table_info("{table}");').fetchall()  # cid, name, type, notnull, default, pk
+    return [col[1] for col in sorted(info, key=lambda col: col[5]) if col[5] > 0]
+
+def row_hash(row: tuple) -> bytes:
+    """Content hash of one row of plain Python values."""
+    return hashlib.blake2b(repr(row).encode("utf-8"), digest_size=16).digest()
+
+def sync_table(csv_file: pathlib.Path, conn: sqlite3.Connection,
+               chunksize: int = CHUNKSIZE) -> tuple[list[tuple], list[tuple]]:
+    """Diff a CSV against its table by primary key and upsert what changed.
+
+    Every stored row is hashed once, then the CSV is streamed in chunks and
+    only rows that are new or whose content hash differs are written, with
+    ``INSERT ... ON CONFLICT DO UPDATE``. Deletions are *not* applied here,
+    because children must go before parents; the keys of rows missing from
+    the CSV are returned so the caller can delete them in reverse FK order.
+
+    Returns *(upserted_rows, keys_to_delete)*; ``upserted_rows`` carries
+    an ``is_new`` flag as its first item.
+    """
+    table = csv_file.stem
+    info = conn.execute(f'PRAGMA table_info("{table}");').fetchall()  # cid, name, type, notnull, default, pk
+    if not info:
+        raise ValueError(f"table {table} does not exist; run MODE = \"fast\" once to create it")
+    pk_cols = primary_key(conn, table)
+    if not pk_cols:
+        raise ValueError(f"table {table} has no primary key (created by to_sql?); "
+                         f"run MODE = \"fast\" once to recreate it from schema.sql")
+    declared = {col[1]: col[2] for col in info}
+
+    header = pd.read_csv(csv_file, nrows=0).columns.tolist()
+    casts = [_affinity_cast(declared.get(col)) for col in header]
+    pk_pos = [header.index(col) for col in pk_cols]
+    col_list = ", ".join(f'"{col}"' for col in header)
+
+    stored = {}
+    for row in conn.execute(f'SELECT {col_list} FROM "{table}";'):
+        stored[tuple(row[i] for i in pk_pos)] = row_hash(tuple(row))
+
+    changed = []
+    seen = set()
+    for chunk in pd.read_csv(csv_file, chunksize=chunksize):
+        for raw in python_rows(cast_int_columns(chunk)):
+            row = tuple(cast(v) for cast, v in zip(casts, raw))
+            key = tuple(row[i] for i in pk_pos)
+            seen.add(key)
+            old_hash = stored.get(key)
+            if old_hash != row_hash(row):
+                changed.append((old_hash is None, row))
+
+    if changed:
+        placeholders = ", ".join("?" * len(header))
+        conflict = ", ".join(f'"{col}"' for col in pk_cols)
+        updates = ", ".join(f'"{col}" = excluded."{col}"' for col in header if col not in pk_cols)
+        action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+        conn.executemany(
+            f'INSERT INTO "{table}" ({col_list}) VALUES ({placeholders}) ON CONFLICT ({conflict}) {action};',
+            (row for _, row in changed),
+        )
+    to_delete = [key for key in stored if key not in seen]
+    return changed, to_delete
+
+def delete_rows(table: str, pk_cols: list[str], keys: list[tuple], conn: sqlite3.Connection) -> int:
+    """Delete ``keys`` from ``table``; returns how many rows ON DELETE CASCADE removed elsewhere."""
+    where = " AND ".join(f'"{col}" = ?' for col in pk_cols)
+    before = conn.total_changes  # unlike rowcount, includes foreign-key actions
+    deleted = conn.executemany(f'DELETE FROM "{table}" WHERE {where};', keys).rowcount
+    return conn.total_changes - before - deleted
+
+def sync_main():
+    """Bring the database in line with data_csv/ by applying only the differences."""
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = WAL;")  # readers keep going while we write
+    conn.execute("PRAGMA foreign_keys = ON;")
+    t0 = time.perf_counter()
+    pending_deletes = []
+    conn.execute("BEGIN;")
+    try:
+        # inserts/updates parents first ...
+        for table in TABLES_IN_ORDER:
+            csv_path = CSV_DIR / f"{table}.csv"
+            if not csv_path.exists():
+                print(f"⚠  {csv_path.name} not found; skipping")
+                continue
+            changed, to_delete = sync_table(csv_path, conn)
+            inserted = sum(1 for is_new, _ in changed if is_new)
+            print(f"{table}: +{inserted} inserted, ~{len(changed) - inserted} updated, "
+                  f"-{len(to_delete)} deleted")
+            report = [f"+ {row}" if is_new else f"~ {row}" for is_new, row in changed]
+            report += [f"- {key}" for key in to_delete]
+            for line in report[:REPORT_LIMIT]:
+                print(f"    {line}")
+            if len(report) > REPORT_LIMIT:
+                print(f"    … and {len(report) - REPORT_LIMIT} more")
+            pending_deletes.append((table, primary_key(conn, table), to_delete))
+        # ... deletes children first, so a cascade can only hit child rows the CSVs still list
+        for table, pk_cols, keys in reversed(pending_deletes):
+            if keys:
+                cascaded = delete_rows(table, pk_cols, keys, conn)
+                if cascaded:
+                    raise ValueError(f"deleting {len(keys)} {table} row(s) would also delete {cascaded} "
+                                     f"row(s) that other CSVs still list (ON DELETE CASCADE); "
+                                     f"remove those rows from the CSVs too (nothing was changed)")
+        create_indexes(conn)
+        build_search_index(conn)
+        conn.execute("COMMIT;")
+    except BaseException:
+        conn.execute("ROLLBACK;")
+        raise
+    finally:
+        conn.close()
+    print(f"✅ All done! Synced in {time.perf_counter() - t0:.2f}s")
+
+def create_indexes(conn: sqlite3.Connection, schema_path: pathlib.Path = SCHEMA_PATH):
+    """(Re)create the indexes declared in schema.sql.
+
+    ``to_sql(if_exists="replace")`` drops a table together with its indexes,
+    so they are rebuilt here after every load. The statements use
+    ``IF NOT EXISTS``, which also makes this a migration for older DBs.
+    """
+    statements = re.findall(r"CREATE INDEX[^;]+;", schema_path.read_text(encoding="utf-8"))
+    for stmt in statements:
+        conn.execute(stmt)
+    print(f"Created {len(statements)} indexes")
+
+def build_search_index(conn: sqlite3.Connection):
+    """Rebuild predict/search.py's FTS5 and fuzzy-name tables from the species table."""
+    t0 = time.perf_counter()
+    n = search.build_index(conn)
+    print(f"Built search index: {n} names in {time.perf_counter() - t0:.2f}s")
+
 def main():
+    if MODE == "fast":
+        fast_main()
+        return
+    if MODE == "sync":
+        sync_main()
+        return
     conn = sqlite3.connect(DB_PATH)
     # Temporarily disable FK checks if we are going to replace tables
     if MODE == "replace":
@@ -43,6 +311,8 @@ def main():
             load_table(csv_path, conn)
         else:
             print(f"⚠  {csv_path.name} not found; skipping")
+    create_indexes(conn)
+    build_search_index(conn)
     # Re‑enable FK enforcement when we’re done
     if MODE == "replace":
         conn.execute("PRAGMA foreign_keys = ON;")
@@ -81,3 +81,10 @@ CREATE TABLE "species_reference" (
     FOREIGN KEY ("species_id") REFERENCES "species"("id") ON DELETE CASCADE,
     FOREIGN KEY ("reference_id") REFERENCES "references"("id") ON DELETE CASCADE
 );
+
+
+-- Indexes
+CREATE INDEX IF NOT EXISTS "species_scientific_name_index" ON "species"("scientific_name");
+CREATE INDEX IF NOT EXISTS "belongs_taxonomy_index" ON "belongs"("taxonomy_id");
+CREATE INDEX IF NOT EXISTS "distributed_location_index" ON "distributed"("location_id");
+CREATE INDEX IF NOT EXISTS "carries_disease_index" ON "carries"("disease_id");
@@ -1,88 +1,106 @@
 # 2025.06.23, 3dr
-import requests # type: ignore
 import os
-from urllib.parse import quote
-from urllib.request import urlretrieve
-import time
-from tqdm import tqdm  # type: ignore
+
+from downloader import Downloader
+from metadata import MetadataWriter, merge_to_json, recorded_keys
 
 #####配置#####
 IMAGES_PER_SPECIES = 1  # 每个物种下载的观察记录数
 output_dir = "dataset//download"
+API_URL = "https://api.inaturalist.org/v1/observations"  # 可改为本地测试桩
+MAX_WORKERS = 16  # 并发线程数
+PER_HOST = 8      # 每个主机的同时连接数
+RATE = 5          # 每秒最多请求数（令牌桶，取代 time.sleep）
+MANIFEST_PATH = os.path.join(output_dir, "manifest.jsonl")  # 断点续传清单，重启后跳过已下载的图片
+METADATA_PATH = "dataset/metadata_all_species.jsonl"  # 每张图片下载完立即追加一行元数据
+METADATA_JSON = "dataset/metadata_all_species.json"   # 结束时由 JSONL 合并生成；设为 None 则不生成
 #############
 
-os.makedirs(output_dir, exist_ok=True)  # 创建总文件夹
-
-# 输入：抓取的物种学名
-species_list = []
-with open("classes.txt", "r", encoding="utf-8") as f:
-    for line in f:
-        stripped = line.strip()
-        if stripped and not stripped.startswith("#"):
-            species_list.append(stripped)
 
-metadata_list = []
+def load_species_list(path="classes.txt"):
+    # 输入：抓取的物种学名
+    species_list = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            stripped = line.strip()
+            if stripped and not stripped.startswith("#"):
+                # 去掉行首的 "/" 标记，否则 os.path.join 会得到根目录下的绝对路径
+                species_list.append(stripped.lstrip("/"))
+    return species_list
 
-def download_images_for_species(species_name):
-    print(f"\nFetching: {species_name}")
-    encoded_name = quote(species_name)
-    url = f"https://api.inaturalist.org/v1/observations?taxon_name={encoded_name}&per_page={IMAGES_PER_SPECIES}&order=desc&order_by=created_at"
 
+def fetch_observations(downloader, species_name):
+    """请求一个物种的观察记录，返回 [(图片 URL, 保存路径, 元数据), ...]。"""
+    params = {"taxon_name": species_name, "per_page": IMAGES_PER_SPECIES,
+              "order": "desc", "order_by": "created_at"}
     try:
-        response = requests.get(url)
-        if response.status_code != 200:
-            print(f"Failed to fetch data for {species_name}")
-            return
-
-        data = response.json()
-        save_folder = os.path.join(output_dir, species_name.replace(" ", "_"))
-        os.makedirs(save_folder, exist_ok=True)
-
-        count = 0
-        for i, result in enumerate(data.get("results", [])):
-            for j, photo in enumerate(result.get("photos", [])):
-                img_url = photo["url"].replace("square", "large")
-                filename = os.path.join(save_folder, f"{species_name.replace(' ', '_')}_{i}_{j}.jpg")
-                metadata = {
-                    "id": result.get("id"),
-                    "width": None,
-                    "height": None,
-                    "file_name": filename,
-                    "license": result.get("license_code"),
-                    "rights_holder": result.get("user", {}).get("name") or result.get("user", {}).get("login"),
-                    "date": result.get("observed_on"),
-                    "latitude": result.get("geojson", {}).get("coordinates", [None, None])[1],
-                    "longitude": result.get("geojson", {}).get("coordinates", [None, None])[0],
-                    "location_uncertainty": result.get("positional_accuracy")
-                }
-                try:
-                    urlretrieve(img_url, filename)
-                    print(f"Saved: {filename}")
-                    from PIL import Image
-                    try:
-                        with Image.open(filename) as img:
-                            metadata["width"], metadata["height"] = img.size
-                    except Exception as img_err:
-                        print(f"Failed to get image size for {filename}: {img_err}")
-                    count += 1
-                except Exception as e:
-                    print(f"Error downloading {img_url}: {e}")
-                metadata_list.append(metadata)
-            time.sleep(0.1)  # 避免请求过快被限速
-
-        print(f"Done: {count} images saved for {species_name}")
-
+        data = downloader.get_json(API_URL, params=params)
     except Exception as e:
         print(f"Error fetching data for {species_name}: {e}")
+        return []
+
+    save_folder = os.path.join(output_dir, species_name.replace(" ", "_"))
+    jobs = []
+    for i, result in enumerate(data.get("results", [])):
+        for j, photo in enumerate(result.get("photos", [])):
+            img_url = photo["url"].replace("square", "large")
+            filename = os.path.join(save_folder, f"{species_name.replace(' ', '_')}_{i}_{j}.jpg")
+            metadata = {
+                "id": result.get("id"),
+                "width": None,
+                "height": None,
+                "file_name": filename,
+                "license": result.get("license_code"),
+                "rights_holder": result.get("user", {}).get("name") or result.get("user", {}).get("login"),
+                "date": result.get("observed_on"),
+                "latitude": (result.get("geojson") or {}).get("coordinates", [None, None])[1],
+                "longitude": (result.get("geojson") or {}).get("coordinates", [None, None])[0],
+                "location_uncertainty": result.get("positional_accuracy")
+            }
+            jobs.append((img_url, filename, metadata))
+    return jobs
+
+
+def main():
+    os.makedirs(output_dir, exist_ok=True)  # 创建总文件夹
+    species_list = load_species_list()
+    downloader = Downloader(max_workers=MAX_WORKERS, per_host=PER_HOST, rate=RATE,
+                            manifest_path=MANIFEST_PATH)
+
+    # 1. 并发请求所有物种的观察记录
+    print(f"Fetching observations for {len(species_list)} species")
+    jobs_per_species = downloader.map(lambda sp: fetch_observations(downloader, sp), species_list)
+    jobs = [job for species_jobs in jobs_per_species for job in species_jobs]
+
+    # 2. 并发下载所有图片（清单中已完成的会跳过），每完成一张就写一行元数据
+    # 清单由下载线程先写、元数据随后在主线程写，中断在两者之间时图片已完成却没有元数据，
+    # 因此跳过的图片只在 JSONL 里已有记录时才不再写
+    written = recorded_keys(METADATA_PATH)
+
+    def record(i, result):
+        img_url, _, metadata = jobs[i]
+        if result.skipped and metadata["file_name"] in written:
+            return  # 上次运行时已写过
+        if result.ok:
+            metadata["width"], metadata["height"] = result.width, result.height
+        else:
+            print(f"Error downloading {img_url}: {result.error}")
+        sink.write(metadata)
+
+    with MetadataWriter(METADATA_PATH) as sink:
+        results = downloader.download_many([(url, filename) for url, filename, _ in jobs],
+                                           desc="Downloading images", callback=record)
+
+    saved = sum(r.ok for r in results)
+    skipped = sum(r.skipped for r in results)
+    print(f"Done: {saved} images saved ({skipped} already downloaded) for {len(species_list)} species")
+    print(f"Metadata appended to {METADATA_PATH} ({sink.count} new records)")
+
+    # 需要时由 JSONL 重建原来的 JSON 文件（同一图片只保留最后一条）
+    if METADATA_JSON:
+        n = merge_to_json(METADATA_PATH, METADATA_JSON)
+        print(f"All metadata ({n} records) saved to {METADATA_JSON}")
+
 
-# 逐个处理每个物种，带进度条
-for idx, species in enumerate(tqdm(species_list, desc="Fetching species", unit="species")):
-    print(f"Fetching {idx+1} out of {len(species_list)} species: {species}")
-    download_images_for_species(species)
-
-# 最终统一保存所有物种的元数据
-if metadata_list:
-    with open("dataset/metadata_all_species.json", 'w', encoding='utf-8') as meta_file:
-        import json
-        json.dump(metadata_list, meta_file, ensure_ascii=False, indent=2)
-    print("All metadata saved to dataset/metadata_all_species.json")
+if __name__ == "__main__":
+    main()
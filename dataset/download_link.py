@@ -14,45 +14,33 @@ download_inat_images.py
 
 multimedia.txt 行示例
 ... https://inaturalist-open-data.s3.amazonaws.com/photos/508860958/original.jpg ...
+
+下载通过 downloader.Downloader 并发进行（连接池、每主机并发限制、限速、重试），
+已完成的 URL 记录在 MANIFEST_PATH 中，中断后重新运行会跳过它们。
 """
 
 import re
 import sys
 from pathlib import Path
 from urllib.parse import urlparse
-import requests
-from tqdm import tqdm
+
+from downloader import Downloader
 
 # 配置
 ROOT_DIR = "D:\Pest\dataset\download\\root"  # 文件夹根目录
 LIMIT = 60  # 每个物种下载的图片数量
 # 下载图片的输出根目录（与 ROOT_DIR 下的文件夹同名）
 DOWNLOAD_DIR = "D:\Pest\dataset\download"
+MAX_WORKERS = 16  # 并发线程数
+PER_HOST = 8      # 每个主机的同时连接数
+RATE = 20         # 每秒最多请求数
+MANIFEST_PATH = Path(DOWNLOAD_DIR) / "manifest.jsonl"  # 断点续传清单
 
 # 匹配 http/https 开头直到空白结束的简单正则
 URL_RE = re.compile(r"https?://[^\s]+?\.(?:jpg|jpeg|png)", re.IGNORECASE)
 
-def download_file(url: str, dest: Path, timeout: int = 10):
-    """下载单个文件到 dest（完整路径）。若文件已存在则跳过。"""
-    if dest.exists():
-        return
-    try:
-        resp = requests.get(url, stream=True, timeout=timeout)
-        resp.raise_for_status()
-        total = int(resp.headers.get("content-length", 0))
-        with tqdm(
-            total=total, unit="B", unit_scale=True, unit_divisor=1024,
-            desc=f"↓ {dest.name}", leave=False
-        ) as bar, dest.open("wb") as f:
-            for chunk in resp.iter_content(8192):
-                if chunk:
-                    f.write(chunk)
-                    bar.update(len(chunk))
-    except Exception as exc:
-        print(f"[WARN] Failed {url} -> {exc}", file=sys.stderr)
-
-def process_txt(txt_path: Path, limit: int):
-    """读取 multimedia.txt，提取前 limit 条图片链接并下载到同目录。"""
+def process_txt(txt_path: Path, limit: int, downloader: Downloader):
+    """读取 multimedia.txt，提取前 limit 条图片链接，返回 [(url, 保存路径), ...]。"""
     # 计算与 ROOT_DIR 的相对路径，并在 DOWNLOAD_DIR 中创建对应的输出文件夹
     rel_dir = txt_path.parent.relative_to(Path(ROOT_DIR))
     out_dir = Path(DOWNLOAD_DIR) / rel_dir
@@ -69,26 +57,40 @@ def process_txt(txt_path: Path, limit: int):
 
     if not urls:
         print("   No image URLs found.")
-        return
+        return []
 
+    jobs = []
     for idx, url in enumerate(urls, start=1):
+        if downloader.is_done(url):  # 上次已下载，交给 downloader 跳过
+            jobs.append((url, downloader.completed[url]["path"]))
+            continue
         # 以 URL 最后路径段为文件名（保持原扩展名）
         filename = Path(urlparse(url).path).name
         # 若同名文件已存在，改用 idx 前缀
         dest = out_dir / filename
-        if dest.exists():
+        if dest.exists() or any(d == dest for _, d in jobs):
             dest = out_dir / f"{idx}_{filename}"
-        download_file(url, dest)
+        jobs.append((url, dest))
+    return jobs
 
 def main():
     root = Path(ROOT_DIR).expanduser().resolve()
     # 确保 DOWNLOAD_DIR 存在
     Path(DOWNLOAD_DIR).mkdir(parents=True, exist_ok=True)
+    downloader = Downloader(max_workers=MAX_WORKERS, per_host=PER_HOST, rate=RATE,
+                            manifest_path=MANIFEST_PATH)
 
     txt_files = list(root.rglob("multimedia.txt"))
-
+    jobs = []
     for txt in txt_files:
-        process_txt(txt, LIMIT)
+        jobs.extend(process_txt(txt, LIMIT, downloader))
+
+    results = downloader.download_many(jobs)
+    for r in results:
+        if not r.ok:
+            print(f"[WARN] Failed {r.url} -> {r.error}", file=sys.stderr)
+    print(f"Done: {sum(r.ok for r in results)}/{len(results)} files "
+          f"({sum(r.skipped for r in results)} already downloaded)")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
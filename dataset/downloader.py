@@ -0,0 +1,224 @@
+"""
+downloader.py
+~~~~~~~~~~~~~
+download_image.py 与 download_link.py 共用的并发下载器。
+
+- 复用连接池的 requests.Session
+- 线程池并发下载，每个主机限制同时连接数（per_host）
+- 令牌桶限速（rate 次/秒，取代原来的 time.sleep）
+- 失败自动重试，指数退避；遵循 429/503 的 Retry-After
+- 断点续传清单（JSONL）：已完成的 URL 在重启后直接跳过
+- 边下载边解析图片头部得到宽高，无需下载后再用 PIL 重新打开
+
+用法示例
+    dl = Downloader(max_workers=16, per_host=4, rate=10, manifest_path="download/manifest.jsonl")
+    data = dl.get_json("https://api.inaturalist.org/v1/observations", params={...})
+    results = dl.download_many([(url1, path1), (url2, path2)])
+
+所有 URL 都由调用方传入，因此可以直接指向本地的 HTTP 测试桩。
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+from PIL import ImageFile
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """线程安全的令牌桶：平均每秒 rate 个请求，最多突发 burst 个。"""
+
+    def __init__(self, rate: float, burst: int | None = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """取一个令牌，没有时阻塞等待。rate <= 0 表示不限速。"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+@dataclass
+class DownloadResult:
+    url: str
+    path: Path
+    ok: bool
+    skipped: bool = False      # 清单中已有记录，未重新下载
+    bytes: int = 0
+    width: int | None = None
+    height: int | None = None
+    error: str | None = None
+
+
+class Downloader:
+    def __init__(self, max_workers: int = 8, per_host: int = 4, rate: float = 5.0,
+                 retries: int = 3, backoff: float = 0.5, timeout: float = 10,
+                 manifest_path: str | Path | None = None):
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._host_slots: dict[str, threading.Semaphore] = {}
+        self._lock = threading.Lock()
+
+        # 断点续传清单：url -> 记录
+        self.manifest_path = Path(manifest_path) if manifest_path else None
+        self.completed: dict[str, dict] = {}
+        if self.manifest_path and self.manifest_path.exists():
+            with self.manifest_path.open(encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # 上次中断时写了一半的行
+                    self.completed[record["url"]] = record
+
+    # ------ 请求基础设施 ------
+    def _slot(self, url: str) -> threading.Semaphore:
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.Semaphore(self.per_host)
+            return self._host_slots[host]
+
+    def _request(self, url: str, use_slot: bool = True, **kwargs) -> requests.Response:
+        """限速 + 每主机并发限制 + 重试的 GET。stream=True 时调用方负责关闭响应。
+
+        use_slot=False 表示调用方已持有该主机的 _slot（例如 download() 要连同读取响应体一起占用）。
+        """
+        last_exc = None
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            retry_after = None
+            try:
+                with self._slot(url) if use_slot else nullcontext():
+                    resp = self.session.get(url, timeout=self.timeout, **kwargs)
+                if resp.status_code not in RETRY_STATUS:
+                    resp.raise_for_status()
+                    return resp
+                retry_after = resp.headers.get("Retry-After")
+                last_exc = requests.HTTPError(f"{resp.status_code} for {url}", response=resp)
+                resp.close()
+            except requests.HTTPError:
+                raise  # 4xx 等不可恢复的错误
+            except requests.RequestException as exc:
+                last_exc = exc
+            if attempt < self.retries:
+                delay = self.backoff * 2 ** attempt * (1 + random.random() * 0.25)
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, float(retry_after))
+                time.sleep(delay)
+        raise last_exc
+
+    def get_json(self, url: str, params: dict | None = None):
+        resp = self._request(url, params=params)
+        return resp.json()
+
+    # ------ 文件下载 ------
+    def _record(self, record: dict):
+        with self._lock:
+            self.completed[record["url"]] = record
+            if self.manifest_path:
+                self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+                with self.manifest_path.open("a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def is_done(self, url: str) -> bool:
+        record = self.completed.get(url)
+        return record is not None and Path(record["path"]).exists()
+
+    def download(self, url: str, dest: str | Path) -> DownloadResult:
+        """下载单个文件到 dest。先写入 .part 临时文件，完成后再改名，避免留下残缺文件。"""
+        dest = Path(dest)
+        if self.is_done(url):
+            record = self.completed[url]
+            return DownloadResult(url, Path(record["path"]), ok=True, skipped=True,
+                                  bytes=record.get("bytes", 0),
+                                  width=record.get("width"), height=record.get("height"))
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(dest.name + ".part")
+        try:
+            # 主机名额要一直占到响应体读完，否则 per_host 限制不住实际同时进行的传输
+            with self._slot(url):
+                resp = self._request(url, use_slot=False, stream=True)
+                parser = ImageFile.Parser()  # 只喂开头几个分块，拿到宽高就停
+                size = None
+                n_bytes = 0
+                with resp, tmp.open("wb") as f:
+                    for chunk in resp.iter_content(65536):
+                        if not chunk:
+                            continue
+                        f.write(chunk)
+                        n_bytes += len(chunk)
+                        if size is None:
+                            try:
+                                parser.feed(chunk)
+                                if parser.image is not None:
+                                    size = parser.image.size
+                            except Exception:
+                                size = (None, None)  # 不是可识别的图片，放弃解析
+            os.replace(tmp, dest)
+        except Exception as exc:
+            tmp.unlink(missing_ok=True)
+            return DownloadResult(url, dest, ok=False, error=str(exc))
+
+        width, height = size if size else (None, None)
+        self._record({"url": url, "path": str(dest), "bytes": n_bytes,
+                      "width": width, "height": height})
+        return DownloadResult(url, dest, ok=True, bytes=n_bytes, width=width, height=height)
+
+    def download_many(self, items, desc: str = "Downloading", callback=None) -> list[DownloadResult]:
+        """并发下载 [(url, dest), ...]，结果顺序与输入一致。
+
+        callback(index, result) 在每个文件完成时于调用线程中执行（例如逐条写元数据）。
+        """
+        items = list(items)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool, \
+                tqdm(total=len(items), desc=desc, unit="file") as bar:
+            futures = {pool.submit(self.download, url, dest): i for i, (url, dest) in enumerate(items)}
+            results = [None] * len(items)
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i] = future.result()
+                if callback is not None:
+                    callback(i, results[i])
+                bar.update(1)
+        return results
+
+    def map(self, fn, iterable) -> list:
+        """用同一个线程池并发执行 fn（例如并发请求各物种的 API），结果顺序与输入一致。"""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(fn, iterable))
@@ -1,32 +1,165 @@
 # 用于从下载的数据中提取所需要数据的标签
+# 标注文件按流式解析（内存占用与文件大小无关），物种匹配用 file_name 中的目录名查字典，
+# 一遍读取同时写出提取结果和每个类别的数量统计。
 import json
+from collections import Counter
+
+from metadata import iter_metadata, write_json_array
 
 # ====== 文件路径 ======
-INPUT_JSON_PATH = 'dataset/train_mini.json'  # 标签 JSON 文件
+INPUT_JSON_PATH = 'dataset/train_mini.json'  # 标签 JSON 文件（也可以是 metadata_all_species.jsonl）
 SPECIES_TXT_PATH = 'classes.txt'  # 需要提取的物种名列表
 OUTPUT_JSON_PATH = 'dataset/train_extracted.json'
+OUTPUT_COUNTS_PATH = 'dataset/train_extracted_counts.json'  # 每个类别提取到的图片数
+ARRAY_KEY = 'images'  # iNat 标注文件中要提取的顶层数组
+CHUNK_SIZE = 1 << 20  # 每次读取的字符数
 # =======================
 
-# 读取物种列表
-with open(SPECIES_TXT_PATH, 'r', encoding='utf-8') as f:
-    species_raw = f.read().splitlines()
-    species_list = [name.strip().replace(" ", "_") for name in species_raw if name.strip()]
 
-print(f"Loaded {len(species_list)} target classes from {SPECIES_TXT_PATH}")
+def load_species(path=SPECIES_TXT_PATH):
+    """读取物种列表，返回 {("Genus", "species"): "Genus_species"}；跳过注释行和行首的 "/" 标记。"""
+    species = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            name = line.strip().lstrip('/')
+            if name and not name.startswith('#'):
+                species[tuple(name.split())] = '_'.join(name.split())
+    return species
+
+
+def _read_json_array(path, key=ARRAY_KEY, chunk_size=CHUNK_SIZE):
+    """流式产出 JSON 文件中的数组元素，每次只解码一个元素。
+
+    文件本身是数组时直接遍历；是对象时遍历顶层键 key 对应的数组，
+    遇到其他顶层数组（例如 annotations）也逐个元素跳过，不会整体载入。
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buf, pos = '', 0
+
+        def peek():
+            # 跳过空白，返回下一个字符（文件结束时为 ''）
+            nonlocal buf, pos
+            while True:
+                while pos < len(buf) and buf[pos] in ' \t\r\n':
+                    pos += 1
+                if pos < len(buf):
+                    return buf[pos]
+                data = f.read(chunk_size)
+                if not data:
+                    return ''
+                buf, pos = data, 0
+
+        def take(expected):
+            nonlocal pos
+            char = peek()
+            if char not in expected:
+                raise ValueError(f"{path}: expected {expected!r} at offset {f.tell()}, got {char!r}")
+            pos += 1
+            return char
+
+        def value():
+            # 解码一个完整的值；缓冲区不够时续读（值后面必须还有字符，防止数字被截断）
+            nonlocal buf, pos
+            peek()
+            while True:
+                try:
+                    obj, end = decoder.raw_decode(buf, pos)
+                    if end < len(buf):
+                        pos = end
+                        return obj
+                except json.JSONDecodeError:
+                    pass
+                data = f.read(chunk_size)
+                if not data:
+                    obj, pos = decoder.raw_decode(buf, pos)  # 文件结束：要么成功，要么抛出真实的错误
+                    return obj
+                buf, pos = buf[pos:] + data, 0
+
+        def elements():
+            take('[')
+            if peek() == ']':
+                take(']')
+                return
+            while True:
+                yield value()
+                if take(',]') == ']':
+                    return
+
+        if peek() == '[':
+            yield from elements()
+            return
+        take('{')
+        while peek() != '}':
+            name = value()
+            take(':')
+            if name == key:
+                yield from elements()
+                return  # 目标数组读完即可，不再解析后面的内容
+            if peek() == '[':
+                for _ in elements():
+                    pass
+            else:
+                value()
+            if take(',}') == '}':
+                break
+
+
+def iter_images(path):
+    """按输入格式逐条产出图片记录：.jsonl 逐行读取，.json 流式解析。"""
+    if str(path).endswith('.jsonl'):
+        return iter_metadata(path)
+    return _read_json_array(path)
+
+
+def species_of(file_name, species, lengths):
+    """由 file_name 的目录名得到物种，例如
+    train_mini/02956_Animalia_..._Culicidae_Culex_pipiens/xxx.jpg -> Culex_pipiens；不在列表中返回 None。"""
+    parts = file_name.replace('\\', '/').split('/')
+    if len(parts) < 2:
+        return None
+    words = tuple(parts[-2].split('_'))
+    for n in lengths:
+        name = species.get(words[-n:])
+        if name is not None:
+            return name
+    return None
+
+
+def extract(input_path, species, output_path, counts_path):
+    """一遍读取：筛选目标物种的图片写入 output_path，并把每类数量写入 counts_path。"""
+    lengths = sorted({len(key) for key in species}, reverse=True)
+    counts = Counter({name: 0 for name in species.values()})
+    scanned = 0
+
+    def matched():
+        nonlocal scanned
+        for img in iter_images(input_path):
+            scanned += 1
+            name = species_of(img['file_name'], species, lengths)
+            if name is not None:
+                counts[name] += 1
+                yield img
+
+    n = write_json_array(matched(), output_path)
+    with open(counts_path, 'w', encoding='utf-8') as f:
+        json.dump(dict(sorted(counts.items())), f, indent=2, ensure_ascii=False)
+    return n, scanned, counts
+
 
-# 加载 JSON 数据
-with open(INPUT_JSON_PATH, 'r', encoding='utf-8') as f:
-    full_data = json.load(f)
+def main():
+    species = load_species()
+    print(f"Loaded {len(species)} target classes from {SPECIES_TXT_PATH}")
 
-# 筛选匹配物种的图像条目
-matched_entries = [
-    img for img in full_data['images']
-    if any(species in img['file_name'] for species in species_list)
-]
+    n, scanned, counts = extract(INPUT_JSON_PATH, species, OUTPUT_JSON_PATH, OUTPUT_COUNTS_PATH)
+    print(f"Found {n} total matching entries (scanned {scanned}).")
+    missing = [name for name, c in counts.items() if c == 0]
+    if missing:
+        print(f"{len(missing)} classes have no images: {', '.join(missing[:10])}"
+              + (" ..." if len(missing) > 10 else ""))
+    print(f"Saved to: {OUTPUT_JSON_PATH}")
+    print(f"Per-class counts saved to: {OUTPUT_COUNTS_PATH}")
 
-print(f"Found {len(matched_entries)} total matching entries.")
 
-# 保存为缩进美化的 JSON 文件
-with open(OUTPUT_JSON_PATH, 'w', encoding='utf-8') as f_out:
-    json.dump(matched_entries, f_out, indent=2, ensure_ascii=False)
-print(f"Saved to: {OUTPUT_JSON_PATH}")
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""
+metadata.py
+~~~~~~~~~~~
+图片元数据的流式存储（JSON Lines），取代一次性写出的 metadata_all_species.json。
+
+- MetadataWriter：每张图片追加一行并立即 flush，程序崩溃也只丢最后一行
+- iter_metadata：逐行读取，内存占用与数据集大小无关；自动跳过中断时写了一半的行
+- recorded_keys：已写过元数据的 file_name 集合，续传时据此补写缺失的行
+- merge_to_json：按 file_name 去重（保留最后一条），重建原来的 JSON 数组文件
+- write_json_array：把任意记录流边读边写成 JSON 数组
+- export_columnar：导出为紧凑的列式文件（.parquet 需要 pyarrow，否则写 .csv）
+
+用法示例
+    with MetadataWriter("dataset/metadata_all_species.jsonl") as sink:
+        sink.write({"file_name": ..., "width": ..., ...})
+
+    $ python metadata.py merge  dataset/metadata_all_species.jsonl dataset/metadata_all_species.json
+    $ python metadata.py export dataset/metadata_all_species.jsonl dataset/metadata_all_species.parquet
+"""
+
+import csv
+import json
+import os
+import sys
+import threading
+from pathlib import Path
+
+# 与 download_image.py 写出的字段一致，列式导出时按此顺序排列
+FIELDS = ["id", "width", "height", "file_name", "license", "rights_holder",
+          "date", "latitude", "longitude", "location_uncertainty"]
+KEY = "file_name"  # 同一张图片重复下载时以最后一条为准
+BATCH_ROWS = 50_000  # 列式导出每批行数
+
+
+class MetadataWriter:
+    """线程安全的 JSONL 追加写入器。fsync=True 时每行都落盘（更慢，但断电也不丢）。"""
+
+    def __init__(self, path: str | Path, fsync: bool = False):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.fsync = fsync
+        self.count = 0
+        self._lock = threading.Lock()
+        self._file = self.path.open("a", encoding="utf-8")
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self.count += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_metadata(path: str | Path):
+    """逐条产出 JSONL 中的记录；损坏或写了一半的行会被跳过。"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def recorded_keys(path: str | Path) -> set:
+    """JSONL 中已出现的 file_name；文件不存在时为空集合。"""
+    if not Path(path).exists():
+        return set()
+    return {record.get(KEY) for record in iter_metadata(path)}
+
+
+def _latest_lines(path: str | Path) -> set[int]:
+    """第一遍：每个 file_name 最后一次出现的行号（只保存键，不保存记录）。"""
+    last = {}
+    for i, record in enumerate(iter_metadata(path)):
+        last[record.get(KEY, i)] = i
+    return set(last.values())
+
+
+def iter_unique(path: str | Path):
+    """按写入顺序产出去重后的记录，同一 file_name 保留最后一条。"""
+    keep = _latest_lines(path)
+    for i, record in enumerate(iter_metadata(path)):
+        if i in keep:
+            yield record
+
+
+def write_json_array(records, json_path: str | Path, indent: int | None = 2) -> int:
+    """把记录流写成 JSON 数组，格式与 json.dump(list, indent=indent) 相同但不占内存。返回记录数。"""
+    json_path = Path(json_path)
+    tmp = json_path.with_name(json_path.name + ".part")
+    n = 0
+    with tmp.open("w", encoding="utf-8") as f:
+        f.write("[")
+        for record in records:
+            if indent is None:
+                f.write((", " if n else "") + json.dumps(record, ensure_ascii=False))
+            else:
+                body = json.dumps(record, ensure_ascii=False, indent=indent)
+                f.write(("," if n else "") + "\n" + " " * indent + body.replace("\n", "\n" + " " * indent))
+            n += 1
+        f.write("\n]" if n and indent is not None else "]")
+    os.replace(tmp, json_path)
+    return n
+
+
+def merge_to_json(jsonl_path: str | Path, json_path: str | Path, indent: int | None = 2) -> int:
+    """把 JSONL 重建为与原来格式相同的 JSON 数组，边读边写。返回记录数。"""
+    return write_json_array(iter_unique(jsonl_path), json_path, indent)
+
+
+def _batches(records, size: int):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def export_columnar(jsonl_path: str | Path, out_path: str | Path) -> int:
+    """导出去重后的记录为 .parquet（需要 pyarrow）或 .csv，分批写出。返回行数。"""
+    out_path = Path(out_path)
+    records = iter_unique(jsonl_path)
+    n = 0
+
+    if out_path.suffix == ".parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as exc:
+            raise ImportError("Parquet 导出需要 pyarrow（pip install pyarrow），或改用 .csv") from exc
+        schema = pa.schema([
+            ("id", pa.int64()), ("width", pa.int32()), ("height", pa.int32()),
+            ("file_name", pa.string()), ("license", pa.string()), ("rights_holder", pa.string()),
+            ("date", pa.string()), ("latitude", pa.float64()), ("longitude", pa.float64()),
+            ("location_uncertainty", pa.float64()),
+        ])
+        with pq.ParquetWriter(out_path, schema, compression="zstd") as writer:
+            for batch in _batches(records, BATCH_ROWS):
+                columns = {name: [r.get(name) for r in batch] for name in FIELDS}
+                writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+                n += len(batch)
+        return n
+
+    with out_path.open("w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+            n += 1
+    return n
+
+
+def main():
+    if len(sys.argv) != 4 or sys.argv[1] not in ("merge", "export"):
+        print("用法: python metadata.py merge|export <input.jsonl> <output>")
+        sys.exit(1)
+    command, src, dst = sys.argv[1:]
+    if command == "merge":
+        n = merge_to_json(src, dst)
+    else:
+        n = export_columnar(src, dst)
+    print(f"Wrote {n} records to {dst}")
+
+
+if __name__ == "__main__":
+    main()
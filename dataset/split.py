@@ -1,7 +1,7 @@
 """
 split_dataset.py
 ~~~~~~~~~~~~~~~~
-将下载好的物种图像随机拆分为 train / test 目录。
+将下载好的物种图像拆分为 train / test 目录。
 
 目录结构假设
 DOWNLOAD_DIR/
@@ -13,78 +13,153 @@ DOWNLOAD_DIR/
 
 运行后会得到
 OUTPUT_DIR/
+├─ manifest.csv        # path,label,split —— 每张图片一行
 ├─ train/
 │   ├─ Aedes_albopictus/...
 │   └─ Culex_pipiens/...
 └─ test/
     ├─ Aedes_albopictus/...
     └─ Culex_pipiens/...
+
+划分方式
+每张图片按 hash(SEED, 物种名, 文件名) 落在 [0, 1) 上，小于 TRAIN_RATIO 的进入 train。
+同一个 SEED 下结果固定；之后新增图片再运行时，已有图片的划分不会改变，
+只有新图片会被分配（类别很小时各类的比例会略有偏差）。
+
+输出方式（MODE）
+manifest  只写 manifest.csv，不复制任何文件（训练时按清单读取原图）
+hardlink  硬链接，不占额外空间（需与 INPUT_DIR 在同一分区）
+symlink   符号链接（Windows 上可能需要管理员权限）
+reflink   写时复制克隆（Linux 上 Btrfs/XFS 等支持 FICLONE 的文件系统），不支持时退回复制
+copy      复制文件（原来的默认行为）
+move      移动文件（原来的 MOVE_FILES=True）
+除 manifest 外，文件操作都在线程池中并发执行；目标文件已存在时跳过，可重复运行。
 """
 
-import random
+import csv
+import hashlib
+import os
 import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # ============ 用户可修改的配置 ============ #
 INPUT_DIR   = "D:\Pest\dataset\download\downloads"
 OUTPUT_DIR  = "D:\Pest\dataset\download\split"
 TRAIN_RATIO = 0.80          # 训练集比例
-SEED        = 42            # 随机种子（设为 None 则每次不同）
-MOVE_FILES  = False         # True=移动文件；False=复制文件
+SEED        = 42            # 划分种子（设为 None 则每次不同）
+MODE        = "copy"        # manifest / hardlink / symlink / reflink / copy / move，见文件开头说明
+WORKERS     = 8             # 复制/链接文件的线程数
 # ========================================= #
 
 IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tif", ".tiff"}
-
-def split_files(files, train_ratio):
-    random.shuffle(files)
-    k = int(len(files) * train_ratio)
-    return files[:k], files[k:]
-
-def copy_or_move(src: Path, dst: Path, move: bool = False):
+MODES = ("manifest", "hardlink", "symlink", "reflink", "copy", "move")
+FICLONE = 0x40049409  # linux/fs.h: _IOW(0x94, 9, int)
+
+
+def split_of(species_name: str, file_name: str, train_ratio: float, seed) -> str:
+    """由文件自身决定划分，与其他文件无关，因此新增图片不会打乱已有划分。"""
+    key = f"{seed}/{species_name}/{file_name}".encode("utf-8")
+    u = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big") / 2**64
+    return "train" if u < train_ratio else "test"
+
+
+def reflink(src: Path, dst: Path) -> bool:
+    """尝试用 FICLONE 克隆文件；成功返回 True，平台或文件系统不支持时返回 False。"""
+    try:
+        import fcntl
+    except ImportError:  # Windows
+        return False
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            pass
+        else:
+            shutil.copystat(src, dst)
+            return True
+    dst.unlink()
+    return False
+
+
+def materialize(src: Path, dst: Path, mode: str) -> str:
+    """按 mode 把 src 放到 dst，返回实际使用的方式（reflink 不支持时为 copy）。"""
+    if dst.exists() or dst.is_symlink():
+        return "exists"
     dst.parent.mkdir(parents=True, exist_ok=True)
-    if move:
+    if mode == "hardlink":
+        os.link(src, dst)
+    elif mode == "symlink":
+        os.symlink(src, dst)
+    elif mode == "reflink" and reflink(src, dst):
+        pass
+    elif mode == "move":
         shutil.move(src, dst)
     else:
         shutil.copy2(src, dst)
+        return "copy"
+    return mode
+
+
+def scan(in_root: Path, train_ratio: float, seed):
+    """返回 [(图片路径, 物种名, 划分), ...]，按物种名、文件名排序。"""
+    rows = []
+    for species_dir in sorted(d for d in in_root.iterdir() if d.is_dir()):
+        species_name = species_dir.name
+        imgs = sorted(e.name for e in os.scandir(species_dir)
+                      if e.is_file() and os.path.splitext(e.name)[1].lower() in IMG_EXTS)
+        if not imgs:
+            print(f"[WARN] No images in {species_dir}")
+            continue
+        splits = [split_of(species_name, name, train_ratio, seed) for name in imgs]
+        n_train = splits.count("train")
+        print(f"[{species_name}] total={len(imgs)}  "
+              f"train={n_train}  test={len(imgs) - n_train}")
+        if len(imgs) > 1 and n_train in (0, len(imgs)):
+            print(f"[WARN] {species_name}: all images fell into one split")
+        rows.extend((species_dir / name, species_name, split) for name, split in zip(imgs, splits))
+    return rows
+
+
+def write_manifest(rows, path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["path", "label", "split"])
+        for src, label, split in rows:
+            writer.writerow([src.as_posix(), label, split])
 
-def process_species_dir(species_dir: Path, out_root: Path,
-                        train_ratio: float, move: bool):
-    species_name = species_dir.name
-    imgs = [p for p in species_dir.iterdir() if p.suffix.lower() in IMG_EXTS]
-
-    if not imgs:
-        print(f"[WARN] No images in {species_dir}")
-        return
-
-    train_files, test_files = split_files(imgs, train_ratio)
-    print(f"[{species_name}] total={len(imgs)}  "
-          f"train={len(train_files)}  test={len(test_files)}")
-
-    for f in train_files:
-        dst = out_root / "train" / species_name / f.name
-        copy_or_move(f, dst, move)
-
-    for f in test_files:
-        dst = out_root / "test" / species_name / f.name
-        copy_or_move(f, dst, move)
 
 def main():
-    if SEED is not None:
-        random.seed(SEED)
+    if MODE not in MODES:
+        print(f"[ERR] Unknown MODE {MODE!r}, expected one of {MODES}")
+        sys.exit(1)
+    seed = SEED if SEED is not None else os.urandom(8).hex()
 
     in_root  = Path(INPUT_DIR).expanduser().resolve()
     out_root = Path(OUTPUT_DIR).expanduser().resolve()
 
-    species_dirs = [d for d in in_root.iterdir() if d.is_dir()]
-    if not species_dirs:
-        print(f"[ERR] No sub-folders found in {in_root}")
+    rows = scan(in_root, TRAIN_RATIO, seed)
+    if not rows:
+        print(f"[ERR] No images found in sub-folders of {in_root}")
         return
 
-    for sd in species_dirs:
-        process_species_dir(sd, out_root,
-                            train_ratio=TRAIN_RATIO, move=MOVE_FILES)
-
+    if MODE != "manifest":
+        jobs = [(src, out_root / split / label / src.name) for src, label, split in rows]
+        with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+            used = list(pool.map(lambda job: materialize(*job, MODE), jobs))
+        if MODE == "move":  # 清单记录移动后的位置
+            rows = [(dst, label, split) for (_, dst), (_, label, split) in zip(jobs, rows)]
+        done = {m: used.count(m) for m in sorted(set(used))}
+        print(f"Files: {done}")
+        if MODE == "reflink" and "copy" in done:
+            print("[WARN] reflink not supported here for some files, copied them instead")
+
+    manifest = out_root / "manifest.csv"
+    write_manifest(rows, manifest)
+    print(f"Manifest written to {manifest} ({len(rows)} images)")
     print("✅ Dataset split completed.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,215 @@
+"""A persistent prediction cache keyed by image content, model and top-k.
+
+Re-submitted photos skip decoding and the forward pass: the result is found
+by the hash of the image bytes. Entries are stored in a small SQLite file
+next to pests.db and evicted least-recently-used once ``max_entries`` is
+exceeded. The model key is a hash of the checkpoint (plus the engine), so a
+new or retrained model never sees stale predictions; entries of any other
+model are dropped automatically when the cache is opened.
+
+Only predictions are cached. The species information is still read from
+pests.db on every request, so database updates show up immediately.
+
+Importing this module does not import torch, so a cache hit in workwork.py
+never loads the model.
+
+Example:
+    >>> cache = PredictionCache(CACHE_PATH, MODEL_PATH, topk=3)
+    >>> key = cache.key(image_bytes)
+    >>> label_confs = cache.get(key)
+    >>> if label_confs is None:
+    ...     label_confs = predict.predict_one(...)
+    ...     cache.put(key, label_confs)
+    >>> cache.stats()
+    {'hits': 1, 'misses': 0, ...}
+
+Classes:
+    PredictionCache
+
+Functions:
+    hash_bytes(): content hash used for image keys.
+    hash_file(): content hash of a file, read in chunks.
+
+Author: 3dr-zzZ
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import instrument
+
+
+# ------ configuration ------
+RECOUNT_EVERY = 1000  # puts between re-reading the entry count from the file
+# ---------------------------
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    image_hash TEXT NOT NULL,
+    model_hash TEXT NOT NULL,
+    topk       INTEGER NOT NULL,
+    result     TEXT NOT NULL,
+    last_used  REAL NOT NULL,
+    PRIMARY KEY (image_hash, model_hash, topk)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS predictions_last_used ON predictions(last_used);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def hash_file(path: str | Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class PredictionCache:
+    """SQLite-backed, size-bounded LRU cache of top-k predictions.
+
+    The checkpoint hash is itself remembered by (size, mtime), so the model
+    file is only read again after it changed. The cache may be shared
+    between threads.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        model_path: str | Path,
+        topk: int,
+        engine: str = "eager",
+        max_entries: int = 10_000,
+    ):
+        self.path = Path(path)
+        self.topk = topk
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._con.execute("PRAGMA journal_mode=WAL;")
+        self._con.execute("PRAGMA synchronous=NORMAL;")
+        self._con.executescript(SCHEMA)
+        self.model_hash = f"{engine}:{self._model_hash(Path(model_path))}"
+        self._drop_other_models()
+        self._puts = 0
+        self._entries = self._count()
+
+    # ------ model key ------
+    def _meta(self, key: str) -> str | None:
+        row = self._con.execute("SELECT value FROM meta WHERE key = ?;", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str) -> None:
+        self._con.execute("INSERT INTO meta (key, value) VALUES (?, ?) "
+                          "ON CONFLICT(key) DO UPDATE SET value = excluded.value;", (key, value))
+
+    def _model_hash(self, model_path: Path) -> str:
+        st = os.stat(model_path)
+        stamp = json.dumps([str(model_path.resolve()), st.st_size, st.st_mtime_ns])
+        known = self._meta("model_stamp")
+        if known == stamp:
+            return self._meta("model_hash")
+        digest = hash_file(model_path)
+        self._set_meta("model_stamp", stamp)
+        self._set_meta("model_hash", digest)
+        return digest
+
+    def _drop_other_models(self) -> None:
+        with self._lock:
+            deleted = self._con.execute("DELETE FROM predictions WHERE model_hash != ?;",
+                                        (self.model_hash,)).rowcount
+        if deleted:
+            print(f"Prediction cache: model changed, dropped {deleted} entries")
+
+    # ------ entries ------
+    def _count(self) -> int:
+        return self._con.execute("SELECT COUNT(*) FROM predictions;").fetchone()[0]
+
+    def key(self, image_bytes: bytes) -> str:
+        return hash_bytes(image_bytes)
+
+    def get(self, image_hash: str) -> list[tuple[str, float]] | None:
+        """The cached *(label, confidence)* list, or None on a miss."""
+        with self._lock:
+            row = self._con.execute(
+                "SELECT result FROM predictions WHERE image_hash = ? AND model_hash = ? AND topk = ?;",
+                (image_hash, self.model_hash, self.topk),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                instrument.count("prediction_cache_misses")
+                return None
+            self.hits += 1
+            instrument.count("prediction_cache_hits")
+            self._con.execute(
+                "UPDATE predictions SET last_used = ? WHERE image_hash = ? AND model_hash = ? AND topk = ?;",
+                (time.time(), image_hash, self.model_hash, self.topk),
+            )
+        return [(label, conf) for label, conf in json.loads(row[0])]
+
+    def put(self, image_hash: str, label_confs: list[tuple[str, float]]) -> None:
+        """Store a result, then evict the least recently used entries beyond ``max_entries``.
+
+        The entry count is kept in memory, so a put does not scan the table;
+        it is re-read every RECOUNT_EVERY puts to pick up rows written by
+        other processes sharing the file.
+        """
+        row = (json.dumps(label_confs), time.time(), image_hash, self.model_hash, self.topk)
+        with self._lock:
+            entries = self._count() if (self._puts + 1) % RECOUNT_EVERY == 0 else self._entries
+            self._con.execute("BEGIN;")
+            try:
+                updated = self._con.execute(
+                    "UPDATE predictions SET result = ?, last_used = ? "
+                    "WHERE image_hash = ? AND model_hash = ? AND topk = ?;", row).rowcount
+                if not updated:
+                    self._con.execute(
+                        "INSERT INTO predictions (result, last_used, image_hash, model_hash, topk) "
+                        "VALUES (?, ?, ?, ?, ?);", row)
+                    entries += 1
+                excess = entries - self.max_entries
+                if excess > 0:
+                    entries -= self._con.execute(
+                        "DELETE FROM predictions WHERE (image_hash, model_hash, topk) IN "
+                        "(SELECT image_hash, model_hash, topk FROM predictions ORDER BY last_used LIMIT ?);",
+                        (excess,)).rowcount
+                self._con.execute("COMMIT;")
+            except BaseException:
+                self._con.execute("ROLLBACK;")  # e.g. SQLITE_BUSY: don't leave the transaction open
+                raise
+            self._entries = entries
+            self._puts += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._con.execute("DELETE FROM predictions;")
+            self._entries = 0
+
+    def stats(self) -> dict:
+        """Hit/miss counts of this process plus the number of stored entries."""
+        with self._lock:
+            entries = self._con.execute("SELECT COUNT(*) FROM predictions;").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries, "max_entries": self.max_entries}
+
+    def __len__(self) -> int:
+        return self.stats()["entries"]
+
+    def close(self) -> None:
+        self._con.close()
@@ -0,0 +1,214 @@
+"""A pool of read-only SQLite connections for concurrent look-ups.
+
+A sqlite3 connection must not be used by two threads at once, so a
+threaded front end sharing one cursor either serializes on a lock or
+crashes. ConnectionPool opens ``size`` connections to pests.db with a
+``mode=ro`` URI (``immutable=1`` on request) and the read pragmas below,
+and hands each one to a single caller at a time:
+
+- ``with pool.connection() as con:`` checks one out and back in (blocking
+  while all are busy), for request handlers and thread pools;
+- ``pool.local()`` pins one connection to the calling thread, for
+  long-lived worker threads that query in a loop (it goes back to the pool
+  when the thread exits);
+- ``await pool.run(fn, *args)`` runs ``fn(cursor, *args)`` on a checked-out
+  connection in a worker thread, for asyncio code.
+
+sqlite3 releases the GIL while a statement runs, so look-ups from several
+threads overlap on a multi-core host (see benchmarks/bench_db_pool.py).
+
+``immutable=1`` skips all locking and change detection, so it is only valid
+while nothing writes the file (e.g. a deployed, read-only copy): a
+concurrent csv_to_db.py load would be read half-written. WAL is a property
+of the database file and cannot be enabled from a read-only connection;
+the pool switches the file to WAL once, through a short writable
+connection, unless it is opened immutable or ``wal=False``.
+
+Example:
+    >>> pool = ConnectionPool(DB_PATH, size=8)
+    >>> with pool.connection() as con:
+    ...     look_up.look_up("Aedes albopictus", con.cursor())
+    >>> matches = await pool.run(search.search, "白纹伊蚊")  # search.search(cur, "白纹伊蚊")
+    >>> pool.close()
+
+Classes:
+    ConnectionPool
+
+Functions:
+    connect_ro(): one read-only connection with the pool's pragmas.
+    enable_wal(): switch a database file to WAL journaling.
+
+Author: 3dr-zzZ
+"""
+
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+
+
+# ------ configuration ------
+MMAP_SIZE = 256 << 20      # bytes of the file read through mmap instead of read()
+CACHE_SIZE = -16 << 10     # page cache per connection; negative = KiB (16 MiB)
+TIMEOUT = 30.0             # seconds to wait for a free connection
+# ---------------------------
+
+
+def enable_wal(path: str | Path) -> str:
+    """Switch ``path`` to WAL journaling (persistent); returns the resulting journal mode."""
+    con = sqlite3.connect(path)
+    try:
+        return con.execute("PRAGMA journal_mode=WAL;").fetchone()[0]
+    finally:
+        con.close()
+
+
+def connect_ro(path: str | Path, immutable: bool = False, mmap_size: int = MMAP_SIZE,
+               cache_size: int = CACHE_SIZE) -> sqlite3.Connection:
+    """A read-only connection to ``path`` that any one thread at a time may use."""
+    uri = Path(path).resolve().as_uri() + "?mode=ro" + ("&immutable=1" if immutable else "")
+    con = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    con.execute(f"PRAGMA mmap_size={int(mmap_size)};")
+    con.execute(f"PRAGMA cache_size={int(cache_size)};")
+    con.execute("PRAGMA temp_store=MEMORY;")
+    return con
+
+
+class _Pin:
+    """Holds a thread's local() connection; collected, with the thread's locals, when the thread exits."""
+
+    __slots__ = ("con", "__weakref__")
+
+    def __init__(self, con: sqlite3.Connection):
+        self.con = con
+
+
+class ConnectionPool:
+    """A fixed set of read-only connections, checked out one caller at a time.
+
+    Connections are opened lazily, up to ``size`` (default: one per core,
+    at least 4). Thread-pinned connections from local() count towards
+    ``size`` as well.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        size: int | None = None,
+        immutable: bool = False,
+        wal: bool = True,
+        mmap_size: int = MMAP_SIZE,
+        cache_size: int = CACHE_SIZE,
+        timeout: float = TIMEOUT,
+    ):
+        self.path = Path(path)
+        if not self.path.exists():  # mode=ro would fail later with a less helpful message
+            raise FileNotFoundError(self.path)
+        self.size = size or max(4, os.cpu_count() or 1)
+        self.immutable = immutable
+        self.timeout = timeout
+        self._connect_args = (immutable, mmap_size, cache_size)
+        if wal and not immutable and os.access(self.path, os.W_OK):
+            enable_wal(self.path)
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._all: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pinned: list[sqlite3.Connection] = []
+        self._closed = False
+
+    # ------ checkout ------
+    def _acquire(self) -> sqlite3.Connection:
+        if self._closed:
+            raise RuntimeError("connection pool is closed")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._all) < self.size:
+                con = connect_ro(self.path, *self._connect_args)
+                self._all.append(con)
+                return con
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"no free connection to {self.path} after {self.timeout}s") from None
+
+    def _release(self, con: sqlite3.Connection) -> None:
+        if self._closed:
+            con.close()
+        else:
+            self._idle.put(con)
+
+    @contextmanager
+    def connection(self):
+        """Check a connection out for the ``with`` block."""
+        con = self._acquire()
+        try:
+            yield con
+        finally:
+            self._release(con)
+
+    @contextmanager
+    def cursor(self):
+        """Like connection(), but yields a cursor (what look_up.py's functions take)."""
+        with self.connection() as con:
+            cur = con.cursor()
+            try:
+                yield cur
+            finally:
+                cur.close()
+
+    def local(self) -> sqlite3.Connection:
+        """The calling thread's own connection, checked out on first use and kept until the thread exits."""
+        pin = getattr(self._local, "pin", None)
+        if pin is None:
+            con = self._acquire()
+            with self._lock:
+                self._pinned.append(con)
+            pin = self._local.pin = _Pin(con)
+            # thread-per-request servers would otherwise run the pool dry after ``size`` threads
+            weakref.finalize(pin, self._unpin, con)
+        return pin.con
+
+    def _unpin(self, con: sqlite3.Connection) -> None:
+        with self._lock:
+            if con not in self._pinned:  # already closed by close()
+                return
+            self._pinned.remove(con)
+        self._release(con)
+
+    async def run(self, fn, *args):
+        """``fn(cursor, *args)`` on a checked-out connection, in a worker thread."""
+        def call():
+            with self.cursor() as cur:
+                return fn(cur, *args)
+        return await asyncio.to_thread(call)
+
+    # ------ lifetime ------
+    def stats(self) -> dict:
+        return {"size": self.size, "open": len(self._all), "idle": self._idle.qsize()}
+
+    def close(self) -> None:
+        """Close every connection; ones still checked out close when they are returned."""
+        self._closed = True
+        with self._lock:
+            for con in self._pinned:
+                con.close()
+            self._pinned.clear()
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+
+    def __enter__(self) -> "ConnectionPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,348 @@
+"""Embedding index over reference images: nearest neighbours, species vote and an unknown-species score.
+
+The classifier always answers with one of its trained classes. This module
+keeps the model's penultimate (pre-logits) features of the reference images
+in a compact on-disk index and compares queries against them: a query whose
+nearest references are all far away is probably a species the model was
+never trained on, whatever the softmax says.
+
+Index layout (a directory)::
+
+    index.json      # dim, classes, paths, OOD calibration, PQ settings
+    vectors.npy     # float16 (N, D), L2-normalized; memory-mapped, scanned in blocks
+    labels.npy      # int32 (N,)
+    pq_codes.npy    # optional uint8 (N, M): product-quantized vectors, D*2/M times smaller
+    pq_codebooks.npy  # optional float32 (M, 256, D/M)
+
+Similarity is the dot product of normalized vectors (cosine). The OOD score is
+1 - similarity of the k-th nearest reference (k-NN OOD detection); the build
+step calibrates a threshold as the 95th percentile of that score over the
+references themselves (leave-one-out), so about 5% of known-species images
+would be flagged.
+
+Example:
+    $ python embeddings.py build ../dataset/split/train ../embeddings --pq 48
+    $ python embeddings.py query ../embeddings pest.jpg other.jpg -k 5
+
+Classes:
+    EmbeddingIndex: open an index and run batched queries.
+
+Functions:
+    embed(): pre-logits features (and logits) of a batch in one forward pass.
+    build_index(): embed a folder / manifest / shards pack into an index.
+    train_pq(): k-means codebooks for product quantization.
+    main()
+
+Author: 3dr-zzZ
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+import predict
+import shards
+
+
+# ------ configuration ------
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+MODEL_PATH = PROJECT_ROOT/"best_convnext_tiny.pth"
+CLASS_MAP_PATH = PROJECT_ROOT/"class_mapping.json"
+BLOCK_ROWS = 65536   # reference vectors scored per matmul block
+OOD_K = 5            # neighbour used for the OOD score
+OOD_QUANTILE = 0.95  # share of reference images below the threshold
+PQ_TRAIN_SAMPLE = 16384  # ~64 training vectors per centroid
+PQ_ITERS = 10
+# ---------------------------
+
+
+@torch.inference_mode()
+def embed(model: torch.nn.Module, batch: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+    """L2-normalized pre-logits features and logits of ``batch`` from a single forward pass.
+
+    Needs the eager timm model (TorchScript/ONNX artifacts only expose logits).
+    """
+    if not hasattr(model, "forward_features"):
+        raise ValueError("embeddings need the eager model (load_model(engine='eager', cache=False))")
+    feats = model.forward_head(model.forward_features(batch), pre_logits=True)
+    logits = model.get_classifier()(feats)
+    return F.normalize(feats.float(), dim=1), logits
+
+
+def _source_batches(source, class_map, args):
+    """*(batches, count, classes, paths)* of the references; batches yields *(labels, batch)*."""
+    if args.shards:
+        dataset = shards.ShardDataset(source)
+        batches = ((labels, batch) for _, labels, batch in shards.iter_batches(dataset, args.batch_size))
+        return batches, len(dataset), dataset.classes, dataset.paths
+    paths, labels, classes = shards.list_sources(source, class_map, args.split)
+    labels = torch.tensor(labels, dtype=torch.long)
+
+    def gen():
+        start = 0
+        for chunk, batch in predict.prefetch_batches(paths, predict.get_transforms(), args.batch_size,
+                                                     args.workers, args.prefetch):
+            yield labels[start:start + len(chunk)], batch
+            start += len(chunk)
+    return gen(), len(paths), classes, [str(p) for p in paths]
+
+
+def _nearest(x: torch.Tensor, centroids: torch.Tensor) -> torch.Tensor:
+    """Index of the closest centroid: argmin |x - c|^2 = argmax (2 x.c - |c|^2), one matmul."""
+    return (2 * x @ centroids.T - centroids.square().sum(dim=1)).argmax(dim=1)
+
+
+def _kmeans(x: torch.Tensor, k: int, iters: int, generator: torch.Generator) -> torch.Tensor:
+    centroids = x[torch.randperm(len(x), generator=generator)[:k]].clone()
+    if len(centroids) < k:  # fewer samples than centroids: repeat some
+        centroids = centroids[torch.arange(k) % len(centroids)]
+    for _ in range(iters):
+        assign = _nearest(x, centroids)
+        sums = torch.zeros_like(centroids).index_add_(0, assign, x)
+        counts = torch.bincount(assign, minlength=k).unsqueeze(1)
+        centroids = torch.where(counts > 0, sums / counts.clamp(min=1), centroids)
+    return centroids
+
+
+def train_pq(vectors: np.ndarray, m: int, iters: int = PQ_ITERS, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """Product quantization: split D into ``m`` sub-spaces, 256 k-means centroids each.
+
+    Returns (codebooks float32 (m, 256, D/m), codes uint8 (N, m)).
+    """
+    n, dim = vectors.shape
+    if dim % m:
+        raise ValueError(f"--pq {m} must divide the embedding size {dim}")
+    sub = dim // m
+    generator = torch.Generator().manual_seed(seed)
+    sample = torch.randperm(n, generator=generator)[:PQ_TRAIN_SAMPLE].sort().values
+    train = torch.from_numpy(np.asarray(vectors[sample.numpy()], dtype=np.float32)).view(-1, m, sub)
+    codebooks = torch.stack([_kmeans(train[:, j], 256, iters, generator) for j in range(m)])
+
+    codes = np.empty((n, m), dtype=np.uint8)
+    for start in range(0, n, BLOCK_ROWS):
+        block = torch.from_numpy(np.asarray(vectors[start:start + BLOCK_ROWS], dtype=np.float32))
+        block = block.view(len(block), m, sub)
+        for j in range(m):
+            codes[start:start + len(block), j] = _nearest(block[:, j], codebooks[j]).numpy()
+    return codebooks.numpy(), codes
+
+
+@torch.inference_mode()
+def build_index(model, batches, count: int, classes: list[str], paths: list[str], out_dir: str | Path,
+                device: str = "cpu", pq: int | None = None, pq_only: bool = False,
+                ood_k: int = OOD_K) -> "EmbeddingIndex":
+    """Embed every reference image into ``out_dir`` (streamed straight into a memmap)."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    vectors = labels = None
+    start = 0
+    for batch_labels, batch in batches:
+        feats, _ = embed(model, batch.to(device))
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(out_dir/"vectors.npy", mode="w+",
+                                                dtype=np.float16, shape=(count, feats.shape[1]))
+            labels = np.empty(count, dtype=np.int32)
+        vectors[start:start + len(feats)] = feats.cpu().numpy().astype(np.float16)
+        labels[start:start + len(feats)] = batch_labels.numpy()
+        start += len(feats)
+        print(f"embedded {start}/{count}", end="\r")
+    print()
+    if vectors is None:
+        raise ValueError("no reference images to index")
+    vectors.flush()
+    np.save(out_dir/"labels.npy", labels)
+
+    meta = {"dim": int(vectors.shape[1]), "count": count, "classes": classes, "paths": paths,
+            "ood_k": ood_k, "ood_threshold": None, "pq": None}
+    if pq:
+        codebooks, codes = train_pq(vectors, pq)
+        np.save(out_dir/"pq_codebooks.npy", codebooks)
+        np.save(out_dir/"pq_codes.npy", codes)
+        meta["pq"] = pq
+    with open(out_dir/"index.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    index = EmbeddingIndex(out_dir)
+    meta["ood_threshold"] = index.calibrate(ood_k)
+    with open(out_dir/"index.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    if pq and pq_only:
+        del vectors, index
+        (out_dir/"vectors.npy").unlink()
+        meta["pq_only"] = True
+        with open(out_dir/"index.json", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+    return EmbeddingIndex(out_dir)
+
+
+class EmbeddingIndex:
+    """Batched nearest-neighbour search over an index written by build_index().
+
+    References are scanned in blocks of BLOCK_ROWS with one matmul per block
+    (or, with PQ, one lookup-table gather per sub-space) and a running top-k,
+    so memory stays bounded however many references there are.
+    """
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+        with open(self.root/"index.json", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.classes = self.meta["classes"]
+        self.paths = self.meta["paths"]
+        self.labels = torch.from_numpy(np.load(self.root/"labels.npy").astype(np.int64))
+        vectors_path = self.root/"vectors.npy"
+        self.vectors = np.load(vectors_path, mmap_mode="r") if vectors_path.exists() else None
+        self.codebooks = self.codes = None
+        if self.meta.get("pq"):
+            self.codebooks = torch.from_numpy(np.load(self.root/"pq_codebooks.npy"))
+            self.codes = np.load(self.root/"pq_codes.npy", mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def _exact_scores(self, queries: torch.Tensor, start: int, stop: int) -> torch.Tensor:
+        block = torch.from_numpy(np.asarray(self.vectors[start:stop], dtype=np.float32))
+        return queries @ block.T
+
+    def _pq_scores(self, lut: torch.Tensor, start: int, stop: int) -> torch.Tensor:
+        codes = torch.from_numpy(np.asarray(self.codes[start:stop], dtype=np.int64))
+        scores = torch.zeros(lut.shape[0], len(codes))
+        for j in range(codes.shape[1]):
+            scores += lut[:, j].index_select(1, codes[:, j])
+        return scores
+
+    @torch.inference_mode()
+    def search(self, queries: torch.Tensor, k: int = 5, use_pq: bool | None = None,
+               rerank: int = 10) -> tuple[torch.Tensor, torch.Tensor]:
+        """Top-``k`` (similarities, reference indices) for each row of ``queries`` (Q, D).
+
+        By default the float16 vectors are scanned exactly. With PQ (the default
+        only for --pq-only indexes) candidates are scored from the codes, which
+        are 2*D/M times smaller and stay in RAM when the vectors would not; if
+        the vectors exist, the best ``k * rerank`` candidates are then re-scored
+        exactly, reading only those rows.
+        """
+        queries = F.normalize(queries.float().cpu(), dim=1)
+        use_pq = self.vectors is None if use_pq is None else use_pq
+        n = len(self)
+        keep = min(k * rerank if use_pq and self.vectors is not None else k, n)
+
+        if use_pq:
+            m = self.codebooks.shape[0]
+            lut = torch.einsum("qmd,mcd->qmc", queries.view(len(queries), m, -1), self.codebooks)
+        best_s = torch.full((len(queries), 0), -torch.inf)
+        best_i = torch.zeros((len(queries), 0), dtype=torch.long)
+        for start in range(0, n, BLOCK_ROWS):
+            stop = min(start + BLOCK_ROWS, n)
+            scores = self._pq_scores(lut, start, stop) if use_pq else self._exact_scores(queries, start, stop)
+            s, i = scores.topk(min(keep, stop - start), dim=1)
+            best_s, order = torch.cat([best_s, s], dim=1).topk(min(keep, best_s.shape[1] + s.shape[1]), dim=1)
+            best_i = torch.cat([best_i, i + start], dim=1).gather(1, order)
+
+        if use_pq and self.vectors is not None:
+            flat = best_i.flatten().numpy()
+            unique = np.unique(flat)  # sorted, so the memmap is read in file order
+            rows = torch.from_numpy(np.asarray(self.vectors[unique], dtype=np.float32))
+            cand = rows[torch.from_numpy(np.searchsorted(unique, flat))].view(*best_i.shape, -1)
+            exact = torch.einsum("qd,qcd->qc", queries, cand)
+            best_s, order = exact.topk(min(k, exact.shape[1]), dim=1)
+            best_i = best_i.gather(1, order)
+        return best_s[:, :k], best_i[:, :k]
+
+    def calibrate(self, k: int = OOD_K, sample: int = 2048, quantile: float = OOD_QUANTILE) -> float:
+        """OOD threshold: ``quantile`` of the leave-one-out k-NN score over sampled references."""
+        generator = torch.Generator().manual_seed(0)
+        rows = torch.randperm(len(self), generator=generator)[:sample].sort().values
+        if self.vectors is not None:
+            queries = torch.from_numpy(np.asarray(self.vectors[rows.numpy()], dtype=np.float32))
+        else:  # PQ only: reconstruct the sampled vectors from their codes
+            codes = torch.from_numpy(np.asarray(self.codes[rows.numpy()], dtype=np.int64))
+            queries = torch.cat([self.codebooks[j][codes[:, j]] for j in range(codes.shape[1])], dim=1)
+        sims, idx = self.search(queries, k + 1)
+        not_self = idx != rows.unsqueeze(1)
+        # drop the self match (or the last column if the self match was not found)
+        sims = torch.stack([row[mask][:k] if mask.sum() >= k else row[:k] for row, mask in zip(sims, not_self)])
+        scores = 1 - sims[:, -1]
+        return float(torch.quantile(scores, quantile))
+
+    def query(self, feats: torch.Tensor, k: int = 5) -> list[dict]:
+        """Neighbours, similarity-weighted species vote and OOD score for each query feature."""
+        sims, idx = self.search(feats, max(k, self.meta["ood_k"]))
+        threshold = self.meta.get("ood_threshold")
+        results = []
+        for row_s, row_i in zip(sims.tolist(), idx.tolist()):
+            votes = {}
+            for s, i in zip(row_s[:k], row_i[:k]):
+                label = int(self.labels[i])
+                votes[label] = votes.get(label, 0.0) + max(s, 0.0)
+            species = max(votes, key=votes.get) if votes else -1
+            ood = 1 - row_s[min(self.meta["ood_k"], len(row_s)) - 1]
+            results.append({
+                "neighbors": [(self.paths[i], self._name(int(self.labels[i])), s)
+                              for s, i in zip(row_s[:k], row_i[:k])],
+                "species": self._name(species),
+                "ood_score": ood,
+                "unknown": threshold is not None and ood > threshold,
+            })
+        return results
+
+    def _name(self, label: int) -> str | None:
+        return self.classes[label] if 0 <= label < len(self.classes) else None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Reference-image embedding index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="Embed reference images into an index")
+    b.add_argument("data", help="ImageFolder tree, split.py manifest.csv, or shards.py pack (--shards)")
+    b.add_argument("out", help="Index directory")
+    b.add_argument("--split", help="Only this split of a manifest")
+    b.add_argument("--shards", action="store_true")
+    b.add_argument("--pq", type=int, help="Also store product-quantized codes with this many sub-spaces")
+    b.add_argument("--pq-only", action="store_true", help="Drop the float16 vectors, keep only PQ codes")
+    b.add_argument("--ood-k", type=int, default=OOD_K)
+    b.add_argument("--batch-size", "-b", type=int, default=32)
+    b.add_argument("--workers", "-j", type=int, default=4)
+    b.add_argument("--prefetch", type=int, default=2)
+    q = sub.add_parser("query", help="Nearest references and OOD score for images")
+    q.add_argument("index", help="Index directory")
+    q.add_argument("image", nargs="+")
+    q.add_argument("-k", type=int, default=5)
+    for p in (b, q):
+        p.add_argument("--model", default=MODEL_PATH)
+        p.add_argument("--classes", default=CLASS_MAP_PATH)
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    with open(args.classes, "r", encoding="utf-8") as f:
+        class_map = json.load(f)
+    model = predict.load_model(args.model, num_classes=len(class_map), device=device)
+
+    if args.command == "build":
+        batches, count, classes, paths = _source_batches(args.data, class_map, args)
+        index = build_index(model, batches, count, classes, paths, args.out, device,
+                            args.pq, args.pq_only, args.ood_k)
+        print(f"Indexed {len(index)} images ({index.meta['dim']}-d) in {args.out}; "
+              f"OOD threshold {index.meta['ood_threshold']:.4f}")
+        return
+
+    index = EmbeddingIndex(args.index)
+    transform = predict.get_transforms()
+    for chunk, batch in predict.prefetch_batches(args.image, transform, 32):
+        feats, logits = embed(model, batch.to(device))
+        probs = torch.softmax(logits.float(), dim=1)
+        for img, conf_idx, rslt in zip(chunk, zip(*probs.max(dim=1)), index.query(feats, args.k)):
+            conf, idx = conf_idx
+            verdict = "possibly unknown species" if rslt["unknown"] else "known species"
+            print(f"{Path(img).name}: classifier={class_map[str(int(idx))]} ({float(conf):.2%}), "
+                  f"neighbours vote={rslt['species']}, OOD score={rslt['ood_score']:.4f} -> {verdict}")
+            for path, name, sim in rslt["neighbors"]:
+                print(f"    {sim:.4f}  {name}  {path}")
+
+
+if __name__ == "__main__":
+    main()
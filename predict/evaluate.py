@@ -0,0 +1,233 @@
+"""Score a trained model on a held-out split: accuracy, per-class precision/recall, confusion matrix, speed.
+
+The split is streamed through the batched inference path (a thread pool
+decodes upcoming batches while the model runs, or shards.py packs are read
+without decoding), and all metrics are accumulated as tensors per batch:
+the confusion matrix is one bincount over ``true * K + pred``.
+
+Inputs:
+    an ImageFolder tree (e.g. split.py's test/), split.py's manifest.csv
+    (with --split), or a directory packed by shards.py (with --shards).
+
+Example:
+    $ python evaluate.py ../dataset/split/test -b 64 -j 8 --topk 3
+    $ python evaluate.py ../dataset/split/manifest.csv --split test --json report.json --confusion cm.csv
+    $ python evaluate.py ../shards/test --shards --model ../convnext_tiny_int8.pt --engine int8
+
+Functions:
+    class_names(): model classes followed by classes.txt species the model does not know.
+    evaluate(): run the model over the data and return the report.
+    per_class_table(): precision / recall / F1 / support from a confusion matrix.
+    main()
+
+Author: 3dr-zzZ
+"""
+
+import argparse
+import csv
+import json
+import statistics
+import time
+from pathlib import Path
+
+import torch
+
+import predict
+import shards
+
+
+# ------ configuration ------
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+MODEL_PATH = PROJECT_ROOT/"best_convnext_tiny.pth"
+CLASS_MAP_PATH = PROJECT_ROOT/"class_mapping.json"
+CLASSES_TXT_PATH = PROJECT_ROOT/"dataset"/"classes.txt"
+PERCENTILES = (50, 90, 99)
+# ---------------------------
+
+
+def class_names(class_map: dict[str, str], classes_txt: str | Path | None = None) -> list[str]:
+    """Model classes in index order, then the classes.txt species missing from the model.
+
+    The extra rows let the report show images of species the model was never
+    trained on (they can only be misclassified).
+    """
+    names = [class_map[str(i)].replace(" ", "_") for i in range(len(class_map))]
+    if classes_txt and Path(classes_txt).exists():
+        known = set(names)
+        with open(classes_txt, "r", encoding="utf-8") as f:
+            for line in f:
+                name = "_".join(line.strip().lstrip("/").split())
+                if name and not name.startswith("#") and name not in known:
+                    names.append(name)
+                    known.add(name)
+    return names
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {}
+    if len(values) == 1:
+        return {f"p{p}": values[0] for p in PERCENTILES}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {f"p{p}": cuts[p - 1] for p in PERCENTILES}
+
+
+def _batches(source, names, args):
+    """Yield *(labels, batch)* for a folder, manifest or shards pack."""
+    if args.shards:
+        dataset = shards.ShardDataset(source)
+        remap = torch.tensor([names.index(c.replace(" ", "_")) if c.replace(" ", "_") in names else -1
+                              for c in dataset.classes] + [-1])
+        for _, labels, batch in shards.iter_batches(dataset, args.batch_size):
+            yield remap[labels], batch  # label -1 indexes the trailing -1
+        return
+    class_map = {str(i): name for i, name in enumerate(names)}
+    paths, labels = shards.list_sources(source, class_map, args.split)[:2]
+    labels = torch.tensor(labels, dtype=torch.long)
+    transform = predict.get_transforms()
+    start = 0
+    for chunk, batch in predict.prefetch_batches(paths, transform, args.batch_size, args.workers, args.prefetch):
+        yield labels[start:start + len(chunk)], batch
+        start += len(chunk)
+
+
+@torch.inference_mode()
+def evaluate(model: torch.nn.Module, batches, num_model_classes: int, num_classes: int,
+             device: str = "cpu", topk: int = 5) -> dict:
+    """Accumulate top-1/top-k hits, the confusion matrix and timings over ``batches``.
+
+    ``batches`` yields *(labels, batch)*; labels index the full class list
+    (``num_classes`` >= ``num_model_classes``) and -1 marks unlabeled images,
+    which are timed but not scored.
+    """
+    k = min(topk, num_model_classes)
+    confusion = torch.zeros(num_classes * num_classes, dtype=torch.long)
+    top1 = topk_hits = scored = images = 0
+    batch_ms, image_ms = [], []
+    model_time = 0.0
+    warm = False
+
+    t_start = time.perf_counter()
+    for labels, batch in batches:
+        batch = batch.to(device)
+        if not warm:  # first call compiles/allocates; keep it out of the numbers
+            model(batch)
+            warm = True
+            t_start = time.perf_counter()
+        t0 = time.perf_counter()
+        logits = model(batch)
+        _, pred_k = logits.topk(k, dim=1)
+        pred_k = pred_k.cpu()  # synchronizes, so the timing covers the forward pass
+        elapsed = time.perf_counter() - t0
+
+        model_time += elapsed
+        batch_ms.append(elapsed * 1000)
+        image_ms.append(elapsed * 1000 / len(labels))
+        images += len(labels)
+
+        known = labels >= 0
+        if known.any():
+            y, p = labels[known], pred_k[known]
+            top1 += int((p[:, 0] == y).sum())
+            topk_hits += int((p == y[:, None]).any(dim=1).sum())
+            scored += int(known.sum())
+            confusion += torch.bincount(y * num_classes + p[:, 0], minlength=num_classes * num_classes)
+    wall = time.perf_counter() - t_start
+
+    return {
+        "images": images,
+        "scored_images": scored,
+        "top1_accuracy": top1 / scored if scored else None,
+        f"top{k}_accuracy": topk_hits / scored if scored else None,
+        "confusion": confusion.view(num_classes, num_classes),
+        "speed": {
+            "images_per_sec": images / wall if wall else 0.0,  # end to end, incl. decode
+            "model_images_per_sec": images / model_time if model_time else 0.0,
+            "batch_latency_ms": percentiles(batch_ms),
+            "image_latency_ms": percentiles(image_ms),
+        },
+    }
+
+
+def per_class_table(confusion: torch.Tensor, names: list[str]) -> list[dict]:
+    """Precision, recall, F1 and support per class, all from the confusion matrix."""
+    cm = confusion.double()
+    tp = cm.diag()
+    support = cm.sum(dim=1)
+    predicted = cm.sum(dim=0)
+    precision = torch.where(predicted > 0, tp / predicted.clamp(min=1), torch.nan)
+    recall = torch.where(support > 0, tp / support.clamp(min=1), torch.nan)
+    f1 = torch.where(precision + recall > 0, 2 * precision * recall / (precision + recall), torch.nan)
+    rows = []
+    for i, name in enumerate(names):
+        rows.append({"class": name, "precision": _num(precision[i]), "recall": _num(recall[i]),
+                     "f1": _num(f1[i]), "support": int(support[i]), "predicted": int(predicted[i])})
+    return rows
+
+
+def _num(x: torch.Tensor) -> float | None:
+    return None if torch.isnan(x) else float(x)
+
+
+def _fmt(x: float | None) -> str:
+    return "   -  " if x is None else f"{x:6.1%}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Evaluate a classifier on a held-out split")
+    parser.add_argument("data", help="ImageFolder tree, split.py manifest.csv, or shards.py pack (--shards)")
+    parser.add_argument("--model", default=MODEL_PATH, help="Weights (.pth) or an export.py artifact")
+    parser.add_argument("--classes", default=CLASS_MAP_PATH, help="Class mapping JSON")
+    parser.add_argument("--classes-txt", default=CLASSES_TXT_PATH,
+                        help="Species list; ones missing from the model get their own rows")
+    parser.add_argument("--engine", choices=predict.ENGINES, default="eager")
+    parser.add_argument("--split", help="Only this split of a manifest (default: all rows)")
+    parser.add_argument("--shards", action="store_true", help="data is a directory packed by shards.py")
+    parser.add_argument("--topk", "-k", type=int, default=5)
+    parser.add_argument("--batch-size", "-b", type=int, default=32)
+    parser.add_argument("--workers", "-j", type=int, default=4)
+    parser.add_argument("--prefetch", type=int, default=2)
+    parser.add_argument("--json", help="Write the full report (incl. confusion matrix) to this file")
+    parser.add_argument("--confusion", help="Write the confusion matrix as CSV (rows = true class)")
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() and args.engine == "eager" else "cpu"
+    with open(args.classes, "r", encoding="utf-8") as f:
+        class_map = json.load(f)
+    names = class_names(class_map, args.classes_txt)
+    model = predict.load_model(args.model, num_classes=len(class_map), device=device, engine=args.engine)
+
+    rslt = evaluate(model, _batches(args.data, names, args), len(class_map), len(names), device, args.topk)
+    table = per_class_table(rslt["confusion"], names)
+
+    k = min(args.topk, len(class_map))
+    print(f"images: {rslt['images']} ({rslt['scored_images']} with a known class)")
+    if rslt["scored_images"]:
+        print(f"top-1 acc: {rslt['top1_accuracy']:.2%}   top-{k} acc: {rslt[f'top{k}_accuracy']:.2%}")
+    print(f"\n{'class':<40} {'prec':>6} {'recall':>6} {'f1':>6} {'support':>8}")
+    for row in sorted(table, key=lambda r: (r["support"] == 0, r["f1"] if r["f1"] is not None else -1)):
+        if row["support"] or row["predicted"]:
+            print(f"{row['class']:<40} {_fmt(row['precision'])} {_fmt(row['recall'])} "
+                  f"{_fmt(row['f1'])} {row['support']:>8}")
+    speed = rslt["speed"]
+    print(f"\nthroughput: {speed['images_per_sec']:.1f} img/s end to end, "
+          f"{speed['model_images_per_sec']:.1f} img/s model only")
+    print("batch latency ms: " + "  ".join(f"{p}={v:.1f}" for p, v in speed["batch_latency_ms"].items()))
+    print("image latency ms: " + "  ".join(f"{p}={v:.2f}" for p, v in speed["image_latency_ms"].items()))
+
+    if args.confusion:
+        with open(args.confusion, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["true\\pred"] + names)
+            for name, row in zip(names, rslt["confusion"].tolist()):
+                writer.writerow([name] + row)
+    if args.json:
+        report = {**rslt, "confusion": rslt["confusion"].tolist(), "classes": names,
+                  "per_class": table, "model": str(args.model), "engine": args.engine,
+                  "batch_size": args.batch_size}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""Export the trained classifier to an optimized CPU inference artifact and compare it to fp32.
+
+Engines (see predict.load_model for how each one is run):
+    torchscript: traced and frozen fp32 graph.
+    int8:        dynamic int8 quantization of all Linear layers (the MLPs in
+                 every ConvNeXt block), then traced and frozen. CPU only.
+    onnx:        fp32 ONNX graph with a dynamic batch axis, run by onnxruntime.
+
+Example:
+    $ python export.py export --engine int8 --out ../convnext_tiny_int8.pt
+    $ python export.py report --engine int8 --artifact ../convnext_tiny_int8.pt --data path/to/split/test
+
+Functions:
+    export_model(): write the artifact for an engine.
+    compare(): accuracy delta and latency/throughput of an artifact vs. the fp32 model.
+    main()
+
+Author: 3dr-zzZ
+"""
+
+import argparse
+import json
+import statistics
+import time
+from pathlib import Path
+
+import torch
+
+import predict
+
+
+# ------ configuration ------
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+MODEL_PATH = PROJECT_ROOT/"best_convnext_tiny.pth"
+CLASS_MAP_PATH = PROJECT_ROOT/"class_mapping.json"
+EXPORT_ENGINES = ("torchscript", "int8", "onnx")
+# ---------------------------
+
+
+@torch.inference_mode()
+def export_model(model: torch.nn.Module, engine: str, out_path: str | Path) -> Path:
+    """Write ``model`` (fp32, eval mode, on CPU) as an artifact for ``engine``."""
+    out_path = Path(out_path)
+    example = torch.randn(1, 3, 224, 224)
+
+    if engine == "onnx":
+        torch.onnx.export(
+            model, example, str(out_path),
+            input_names=["input"], output_names=["logits"],
+            dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+            dynamo=False,
+        )
+        return out_path
+
+    if engine == "int8":
+        model = torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    elif engine != "torchscript":
+        raise ValueError(f"unknown engine {engine!r}, expected one of {EXPORT_ENGINES}")
+
+    # frozen: weights become constants and the graph is specialized for inference.
+    # (optimize_for_inference() output cannot be saved and reloaded, so stop here.)
+    scripted = torch.jit.freeze(torch.jit.trace(model, example).eval())
+    torch.jit.save(scripted, str(out_path))
+    return out_path
+
+
+def _timed_forward(model: torch.nn.Module, batch: torch.Tensor) -> tuple[torch.Tensor, float]:
+    with torch.inference_mode():
+        t0 = time.perf_counter()
+        probs = torch.softmax(model(batch), dim=1)
+        return probs, time.perf_counter() - t0
+
+
+def compare(
+    reference: torch.nn.Module,
+    candidate: torch.nn.Module,
+    image_paths: list[Path],
+    labels: list[int],
+    batch_size: int = 32,
+    workers: int = 4,
+) -> dict:
+    """Run both models over the same batches and summarize accuracy and speed.
+
+    The first batch is run once untimed to warm up both models (TorchScript
+    optimizes on its first calls). Accuracy only counts images whose folder is
+    a known class.
+    """
+    transform = predict.get_transforms()
+    labels_t = torch.tensor(labels)
+    ref_top1, cand_top1, max_prob_delta = [], [], 0.0
+    times = {"reference": [], "candidate": []}
+    warm = False
+
+    for chunk, batch in predict.prefetch_batches(image_paths, transform, batch_size, workers):
+        if not warm:
+            _timed_forward(reference, batch)
+            _timed_forward(candidate, batch)
+            warm = True
+        ref_probs, ref_time = _timed_forward(reference, batch)
+        cand_probs, cand_time = _timed_forward(candidate, batch)
+        times["reference"].append((ref_time, len(chunk)))
+        times["candidate"].append((cand_time, len(chunk)))
+        ref_top1.append(ref_probs.argmax(dim=1))
+        cand_top1.append(cand_probs.argmax(dim=1))
+        max_prob_delta = max(max_prob_delta, (ref_probs - cand_probs).abs().max().item())
+
+    ref_top1 = torch.cat(ref_top1)
+    cand_top1 = torch.cat(cand_top1)
+    known = labels_t >= 0
+    n_known = int(known.sum())
+
+    def speed(entries):
+        per_image = [t / n * 1000 for t, n in entries]
+        total_time = sum(t for t, _ in entries)
+        return {
+            "batch_latency_ms_median": statistics.median(t * 1000 for t, _ in entries),
+            "image_latency_ms_median": statistics.median(per_image),
+            "images_per_sec": sum(n for _, n in entries) / total_time,
+        }
+
+    rslt = {
+        "images": len(ref_top1),
+        "labeled_images": n_known,
+        "top1_agreement": (ref_top1 == cand_top1).float().mean().item(),
+        "max_abs_prob_delta": max_prob_delta,
+        "reference": speed(times["reference"]),
+        "candidate": speed(times["candidate"]),
+    }
+    if n_known:
+        rslt["reference"]["top1_accuracy"] = (ref_top1[known] == labels_t[known]).float().mean().item()
+        rslt["candidate"]["top1_accuracy"] = (cand_top1[known] == labels_t[known]).float().mean().item()
+        rslt["top1_accuracy_delta"] = rslt["candidate"]["top1_accuracy"] - rslt["reference"]["top1_accuracy"]
+    rslt["speedup"] = rslt["candidate"]["images_per_sec"] / rslt["reference"]["images_per_sec"]
+    return rslt
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export / evaluate optimized inference artifacts")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("export", "report"):
+        p = sub.add_parser(name)
+        p.add_argument("--model", default=MODEL_PATH, help="Trained fp32 weights (.pth)")
+        p.add_argument("--classes", default=CLASS_MAP_PATH, help="Class mapping JSON")
+        p.add_argument("--engine", choices=EXPORT_ENGINES, required=True)
+    sub.choices["export"].add_argument("--out", required=True, help="Where to write the artifact")
+    report = sub.choices["report"]
+    report.add_argument("--artifact", required=True, help="Artifact written by 'export'")
+    report.add_argument("--data", required=True, help="Held-out ImageFolder tree, e.g. split.py's test/")
+    report.add_argument("--batch-size", "-b", type=int, default=32)
+    report.add_argument("--workers", "-j", type=int, default=4)
+    report.add_argument("--json", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    with open(args.classes, "r", encoding="utf-8") as f:
+        class_map = json.load(f)
+    reference = predict.load_model(args.model, num_classes=len(class_map), device="cpu")
+
+    if args.command == "export":
+        out = export_model(reference, args.engine, args.out)
+        print(f"Saved {args.engine} artifact to {out} ({out.stat().st_size / 2**20:.1f} MiB)")
+        return
+
+    candidate = predict.load_model(args.artifact, num_classes=len(class_map), device="cpu", engine=args.engine)
+    image_paths, labels = predict.list_image_folder(args.data, class_map)
+    if not image_paths:
+        print(f"[ERR] No images found under {args.data}")
+        return
+    rslt = compare(reference, candidate, image_paths, labels, args.batch_size, args.workers)
+
+    print(f"images: {rslt['images']} ({rslt['labeled_images']} labeled)")
+    for name in ("reference", "candidate"):
+        r = rslt[name]
+        acc = f"top-1 acc={r['top1_accuracy']:.2%}  " if "top1_accuracy" in r else ""
+        print(f"{name:>9} ({'fp32 eager' if name == 'reference' else args.engine}): {acc}"
+              f"{r['images_per_sec']:.1f} img/s  "
+              f"batch median={r['batch_latency_ms_median']:.1f}ms  "
+              f"per image={r['image_latency_ms_median']:.2f}ms")
+    if "top1_accuracy_delta" in rslt:
+        print(f"accuracy delta: {rslt['top1_accuracy_delta']:+.2%}")
+    print(f"top-1 agreement: {rslt['top1_agreement']:.2%}   max |Δprob|: {rslt['max_abs_prob_delta']:.4f}")
+    print(f"speedup: {rslt['speedup']:.2f}x")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rslt, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""Lightweight instrumentation for the inference and look-up hot paths.
+
+Stages are timed with ``timer()`` (or the ``timed()`` decorator) into
+histograms, and events are tallied with ``count()``. Everything lands in one
+process-wide Registry, which can be dumped as JSON or as Prometheus text.
+Recording a sample is two perf_counter() calls and a short locked update,
+so the timers stay on in production; ``disable()`` turns them into no-ops.
+
+Stages recorded by this repo:
+    decode, transform         load_image() / predict_one(), per image
+    forward, topk             predict_one() / predict_tensors(), per batch
+    sql.<query>               every query in queries.py and the bulk reads of
+                              look_up.SpeciesProfileCache
+    search                    search.search(), per query
+    (counters) images, batches, views (TTA), prediction_cache_hits/misses
+
+On CUDA the forward pass is asynchronous, so its time is only fully
+accounted once the results are copied to the host, i.e. in ``topk``.
+
+``set_quiet()`` silences the per-call progress prints routed through
+``info()`` (e.g. predict_one()'s "running on ..."). ``profile()`` wraps any
+block in cProfile or torch.profiler.
+
+Example:
+    >>> import instrument
+    >>> instrument.set_quiet()
+    >>> with instrument.profile("cprofile", "predict.prof"):
+    ...     predict.predict_one(...)
+    >>> print(instrument.to_prometheus())
+    >>> instrument.dump("metrics.json")
+
+Classes:
+    Histogram: bucketed latency distribution with count/sum/min/max.
+    Registry: named counters and histograms.
+
+Functions:
+    timer(), timed(), observe(): time a block / a function / a given duration into a stage histogram.
+    count(): add to a counter.
+    info(): print unless quiet.
+    to_json(), to_prometheus(), dump(), reset(): read out the default registry.
+    profile(): opt-in cProfile / torch.profiler hook.
+
+Author: 3dr-zzZ
+"""
+
+import bisect
+import cProfile
+import functools
+import json
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+
+# ------ configuration ------
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+PREFIX = "pest"  # Prometheus metric name prefix
+# ---------------------------
+
+
+class Histogram:
+    """Cumulative-bucket histogram of durations in seconds, Prometheus style."""
+
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Estimate of the ``q`` quantile: the upper bound of the bucket it falls in."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "min": self.min if self.count else 0.0,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": {str(b): n for b, n in zip(self.buckets + ("+Inf",), self.counts)},
+        }
+
+
+class Registry:
+    """Named counters and stage histograms, safe to update from several threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: dict[str, float] = {}
+        self.histograms: dict[str, Histogram] = {}
+        self.enabled = True
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            hist = self.histograms.get(stage)
+            if hist is None:
+                hist = self.histograms[stage] = Histogram()
+            hist.observe(seconds)
+
+    def count(self, name: str, n: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def to_json(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "stages": {stage: hist.to_dict() for stage, hist in sorted(self.histograms.items())},
+            }
+
+    def to_prometheus(self) -> str:
+        """The text exposition format: ``<prefix>_<counter>_total`` and ``<prefix>_stage_seconds``."""
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                metric = f"{PREFIX}_{_metric_name(name)}_total"
+                lines += [f"# TYPE {metric} counter", f"{metric} {value:g}"]
+            if self.histograms:
+                metric = f"{PREFIX}_stage_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+            for stage, hist in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, n in zip(hist.buckets + (float("inf"),), hist.counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f'{metric}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{stage="{stage}"}} {hist.sum:.9g}')
+                lines.append(f'{metric}_count{{stage="{stage}"}} {hist.count}')
+        return "\n".join(lines) + "\n"
+
+
+def _metric_name(name: str) -> str:
+    return "".join(c if c.isalnum() else "_" for c in name)
+
+
+REGISTRY = Registry()
+_quiet = False
+
+
+# ------ recording ------
+@contextmanager
+def timer(stage: str, registry: Registry = REGISTRY):
+    """Time the ``with`` block into the histogram of ``stage``."""
+    if not registry.enabled:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(stage, time.perf_counter() - t0)
+
+
+def timed(stage: str, registry: Registry = REGISTRY):
+    """Decorator version of :func:`timer`."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not registry.enabled:
+                return func(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.observe(stage, time.perf_counter() - t0)
+        return wrapper
+    return decorate
+
+
+def observe(stage: str, seconds: float, registry: Registry = REGISTRY) -> None:
+    """Record a duration measured elsewhere."""
+    if registry.enabled:
+        registry.observe(stage, seconds)
+
+
+def count(name: str, n: float = 1, registry: Registry = REGISTRY) -> None:
+    if registry.enabled:
+        registry.count(name, n)
+
+
+def enable() -> None:
+    REGISTRY.enabled = True
+
+
+def disable() -> None:
+    REGISTRY.enabled = False
+
+
+# ------ quiet mode ------
+def set_quiet(quiet: bool = True) -> None:
+    """Silence (or restore) the per-call prints that go through :func:`info`."""
+    global _quiet
+    _quiet = quiet
+
+
+def is_quiet() -> bool:
+    return _quiet
+
+
+def info(*args, **kwargs) -> None:
+    if not _quiet:
+        print(*args, **kwargs)
+
+
+# ------ export ------
+def to_json() -> dict:
+    return REGISTRY.to_json()
+
+
+def to_prometheus() -> str:
+    return REGISTRY.to_prometheus()
+
+
+def reset() -> None:
+    REGISTRY.reset()
+
+
+def dump(path: str | Path) -> None:
+    """Write the default registry to ``path``: Prometheus text for ``.prom``/``.txt``, JSON otherwise."""
+    path = Path(path)
+    if path.suffix in (".prom", ".txt"):
+        path.write_text(to_prometheus(), encoding="utf-8")
+    else:
+        path.write_text(json.dumps(to_json(), indent=2), encoding="utf-8")
+
+
+def summary() -> str:
+    """One line per stage: count, mean and p90 in milliseconds."""
+    stages = to_json()["stages"]
+    return "\n".join(f"{stage:<24} n={s['count']:<6} mean={s['mean'] * 1000:8.3f}ms "
+                     f"p90<={s['p90'] * 1000:8.3f}ms" for stage, s in stages.items())
+
+
+# ------ profiling ------
+@contextmanager
+def profile(kind: str | None = "cprofile", out: str | Path | None = None, top: int = 25):
+    """Profile the ``with`` block; ``kind`` is "cprofile", "torch" or None (off).
+
+    cprofile writes pstats data to ``out`` (view with snakeviz or pstats) and
+    prints the ``top`` functions by cumulative time. torch uses
+    torch.profiler on CPU (and CUDA if available), writes a Chrome trace to
+    ``out`` and prints the ``top`` operators by total time.
+    """
+    if kind is None:
+        yield
+        return
+    if kind == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            if out:
+                profiler.dump_stats(out)
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(top)
+    elif kind == "torch":
+        import torch
+        from torch.profiler import ProfilerActivity
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        with torch.profiler.profile(activities=activities, record_shapes=True) as prof:
+            yield
+        if out:
+            prof.export_chrome_trace(str(out))
+        sort_by = "cuda_time_total" if torch.cuda.is_available() else "cpu_time_total"
+        print(prof.key_averages().table(sort_by=sort_by, row_limit=top))
+    else:
+        raise ValueError(f"unknown profiler {kind!r}, expected 'cprofile' or 'torch'")
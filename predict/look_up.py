@@ -3,8 +3,14 @@
 Functions:
     load_database(): load the database.
     look_up(): look up species with scientific name in database.
+    look_up_many(): look up several species with a fixed number of queries.
+    build_profile(): assemble the look_up() result dict from raw query rows.
+    group_by_species(): group (species_id, ...) rows into a dict by species id.
     format_db_output(): format output from look_up() to make it more readable.
 
+Classes:
+    SpeciesProfileCache: every species' look_up() result, built in one bulk pass.
+
 Example usage in other files:
     >>> PROJECT_ROOT = Path(__file__).resolve().parents[1]
     >>> DB_PATH = PROJECT_ROOT/"database"/"pests.db"
@@ -13,22 +19,39 @@ Example usage in other files:
     >>> cur = con.cursor()
     >>> format_db_output(look_up(scientific_name = scientific_name, cur = cur))
     # result will display here
+    >>> cache = SpeciesProfileCache(DB_PATH)  # for repeated look-ups
+    >>> format_db_output(cache.look_up(scientific_name))
 
 Author: 3dr-zzZ
 """
 
+import os
 import sqlite3
+import threading
+import time
 from pathlib import Path
 from sys import argv
 
+import instrument
+import queries
+
 
 # ------ configuration ------
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 DB_PATH = PROJECT_ROOT/"database"/"pests.db"
 scientific_name = "Aedes albopictus"
+STALE_CHECK_MS = 1000  # how often SpeciesProfileCache looks for database changes
 
 # ------ load database ------
-def load_database(path: str|Path) -> sqlite3.Cursor:
+def load_database(path: str|Path, read_only: bool = False) -> sqlite3.Cursor:
+    """Cursor on a new connection; ``read_only`` opens it like db_pool.ConnectionPool does.
+
+    The connection belongs to the calling thread. Concurrent callers should
+    check connections out of a db_pool.ConnectionPool instead.
+    """
+    if read_only:
+        from db_pool import connect_ro
+        return connect_ro(path).cursor()
     con = sqlite3.connect(path)
     return con.cursor()
 
@@ -41,66 +64,196 @@ def look_up(scientific_name: str, cur: sqlite3.Cursor) -> dict|None:
     instead of the complete scientific name (e.g. Culex (Culex) pipiens Linnaeus, 1758)
     """
     # first check if the species is in the database
-    species_list = cur.execute("SELECT scientific_name FROM species;")
-    species_list = species_list.fetchall()
-    if (scientific_name,) not in species_list:
-        print("数据库尚未收录该物种")
+    species_rslt = queries.find_species(cur, scientific_name)
+    if species_rslt is None:
+        instrument.info("数据库尚未收录该物种")
         return
 
     # look for information about the species
+    species_id, basics_rslt = species_rslt[0], species_rslt[1:]
+    tax_rslt = queries.fetch_taxonomy(cur, species_id)
+    loc_rslt = queries.fetch_locations(cur, species_id)
+    dis_rslt = queries.fetch_diseases(cur, species_id)
+    return build_profile(basics_rslt, tax_rslt, loc_rslt, dis_rslt)
+
+
+def look_up_many(scientific_names: list[str], cur: sqlite3.Cursor) -> dict[str, dict|None]:
+    """Look up several species at once, e.g. the top-k labels of one image.
+
+    Runs four queries in total however many names are given, instead of
+    look_up()'s four per name. Returns a dict mapping each requested name to
+    the same result dict look_up() would give, or None if it is not in the
+    database. Keys keep the order of ``scientific_names``.
+    """
+    rslt = dict.fromkeys(scientific_names)
+    found = {}
+    for species_id, name, *basics in queries.find_species_many(cur, scientific_names):
+        found.setdefault(name, (species_id, tuple(basics)))  # first row per name, like look_up()
+    if not found:
+        return rslt
+
+    species_ids = [species_id for species_id, _ in found.values()]
+    tax_groups = group_by_species(queries.fetch_taxonomy_many(cur, species_ids))
+    loc_groups = group_by_species(queries.fetch_locations_many(cur, species_ids))
+    dis_groups = group_by_species(queries.fetch_diseases_many(cur, species_ids))
+    for name, (species_id, basics) in found.items():
+        rslt[name] = build_profile(
+            basics,
+            tax_groups.get(species_id, []),
+            loc_groups.get(species_id, []),
+            dis_groups.get(species_id, []),
+        )
+    return rslt
+
+
+def group_by_species(rows) -> dict[int, list[tuple]]:
+    """Group rows whose first column is a species id into ``{species_id: [rest, ...]}``."""
+    groups = {}
+    for row in rows:
+        groups.setdefault(row[0], []).append(row[1:])
+    return groups
+
+
+def build_profile(basics_rslt: tuple, tax_rslt: list[tuple], loc_rslt: list[tuple],
+                  dis_rslt: list[tuple]) -> dict:
+    """Assemble the look_up() result dict from the raw query rows.
+
+    basics_rslt: (chinese_name, other_name, traits)
+    tax_rslt:    [(name, chinese_name, ...), ...] from phylum down to genus
+    loc_rslt:    [(name, type), ...]
+    dis_rslt:    [(name,), ...]
+    """
     rslt_dict = {}
-    basics_rslt = cur.execute(f"SELECT chinese_name, other_name, traits FROM species\
-                            WHERE scientific_name = '{scientific_name}';")
-    basics_rslt = basics_rslt.fetchall()[0]  # index = 0 because there's only one row per species
     rslt_dict["物种中文名"] = basics_rslt[0]
     rslt_dict["物种别名"] = basics_rslt[1]
     rslt_dict["鉴别特征"] = basics_rslt[2]
 
-    tax_rslt = cur.execute(f"SELECT taxonomies.name, taxonomies.chinese_name, taxonomies.type FROM species\
-                            JOIN belongs ON species.id = belongs.species_id\
-                            JOIN taxonomies ON belongs.taxonomy_id = taxonomies.id\
-                            WHERE scientific_name = '{scientific_name}';")
-    tax_rslt = tax_rslt.fetchall()
     tax_list = []
-    for i in range(5):
-        tax_list.append(f"{tax_rslt[i][0]} ({tax_rslt[i][1]})")
-        tax_organized = " - ".join(tax_list)
-    rslt_dict["生物学分类"] = tax_organized
-
-    loc_rslt = cur.execute(f"SELECT locations.name, locations.type FROM species\
-                            JOIN distributed ON species.id = distributed.species_id\
-                            JOIN locations ON distributed.location_id = locations.id\
-                            WHERE scientific_name = '{scientific_name}';")
-    loc_rslt = loc_rslt.fetchall()
+    for tax in tax_rslt[:5]:
+        tax_list.append(f"{tax[0]} ({tax[1]})")
+    rslt_dict["生物学分类"] = " - ".join(tax_list)
+
     province_list = []
     country_list = []
     region_list = []
-    for i in range(len(loc_rslt)):
-        place = loc_rslt[i]
+    for place in loc_rslt:
         if place[1] == 'province':
             province_list.append(place[0])
         elif place[1] == 'country':
             country_list.append(place[0])
         else:
             region_list.append(place[0])
-    province_organized = "、".join(province_list)
-    country_organized = "、".join(country_list)
-    region_organized = "、".join(region_list)
-    rslt_dict["国内分布"] = province_organized
-    rslt_dict["国际分布"] = country_organized
-    rslt_dict["区域分布"] = region_organized
-
-    dis_rslt = cur.execute(f"SELECT diseases.name FROM species\
-                            JOIN carries ON species.id = carries.species_id\
-                            JOIN diseases ON carries.disease_id = diseases.id\
-                            WHERE scientific_name = '{scientific_name}';")
-    dis_rslt = dis_rslt.fetchall()
+    rslt_dict["国内分布"] = "、".join(province_list)
+    rslt_dict["国际分布"] = "、".join(country_list)
+    rslt_dict["区域分布"] = "、".join(region_list)
+
     diseases_list = []
     for disease in dis_rslt:
         diseases_list.append(disease[0])
-    disease_organized = "、".join(diseases_list)
-    rslt_dict["携带疾病/病毒"] = disease_organized
+    rslt_dict["携带疾病/病毒"] = "、".join(diseases_list)
     return rslt_dict
+
+
+# ------ profile cache ------
+class SpeciesProfileCache:
+    """Every species' look_up() result, materialized in one bulk pass.
+
+    Instead of five queries per call, the species table and the three bridge
+    tables (belongs, distributed, carries) are each read once and grouped by
+    species id, so a look-up is a dict hit. At most every ``check_interval_ms``
+    a look-up also compares the database file's mtime and ``PRAGMA
+    data_version`` with the last build and rebuilds when either changed, i.e.
+    after another connection (e.g. csv_to_db.py) commits. With
+    ``check_interval_ms=None`` the cache never checks; call refresh() after
+    loading new data instead.
+
+    The cache may be shared between threads.
+    """
+
+    def __init__(self, path: str | Path, check_interval_ms: float | None = STALE_CHECK_MS):
+        self.path = Path(path)
+        self.check_interval = None if check_interval_ms is None else check_interval_ms / 1000
+        self._con = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._profiles: dict[str, dict] = {}
+        self._stamp = None
+        self._next_check = 0.0  # time.monotonic() of the next staleness check
+        self.refresh()
+
+    def _current_stamp(self) -> tuple[int, int]:
+        data_version = self._con.execute("PRAGMA data_version;").fetchone()[0]
+        return os.stat(self.path).st_mtime_ns, data_version
+
+    def refresh(self) -> None:
+        """Rebuild all profiles from the database."""
+        with self._lock:
+            self._rebuild()
+
+    def _rebuild(self) -> None:  # caller holds self._lock
+        self._stamp = self._current_stamp()
+        self._profiles = self._build()
+        if self.check_interval is not None:
+            self._next_check = time.monotonic() + self.check_interval
+
+    def _check(self) -> None:
+        with self._lock:
+            if time.monotonic() < self._next_check:  # another thread just checked
+                return
+            self._next_check = time.monotonic() + self.check_interval
+            if self._current_stamp() != self._stamp:
+                self._rebuild()
+
+    def _build(self) -> dict[str, dict]:
+        cur = self._con.cursor()
+        with instrument.timer("sql.bulk_species"):
+            species = cur.execute("SELECT id, scientific_name, chinese_name, other_name, traits\
+                                   FROM species ORDER BY id;").fetchall()
+        bulk_queries = {
+            "tax": "SELECT belongs.species_id, taxonomies.name, taxonomies.chinese_name FROM belongs\
+                    JOIN taxonomies ON belongs.taxonomy_id = taxonomies.id\
+                    ORDER BY belongs.species_id, belongs.taxonomy_id;",
+            "loc": "SELECT distributed.species_id, locations.name, locations.type FROM distributed\
+                    JOIN locations ON distributed.location_id = locations.id\
+                    ORDER BY distributed.species_id, distributed.location_id;",
+            "dis": "SELECT carries.species_id, diseases.name FROM carries\
+                    JOIN diseases ON carries.disease_id = diseases.id\
+                    ORDER BY carries.species_id, carries.disease_id;",
+        }
+        grouped = {}
+        for key, query in bulk_queries.items():
+            with instrument.timer(f"sql.bulk_{key}"):
+                grouped[key] = group_by_species(cur.execute(query))
+
+        profiles = {}
+        for species_id, name, *basics in species:
+            if name in profiles:  # keep the first row, like look_up()
+                continue
+            profiles[name] = build_profile(
+                tuple(basics),
+                grouped["tax"].get(species_id, []),
+                grouped["loc"].get(species_id, []),
+                grouped["dis"].get(species_id, []),
+            )
+        return profiles
+
+    def get(self, scientific_name: str) -> dict | None:
+        """Return the profile of ``scientific_name``, or None if it is not in the database."""
+        if self.check_interval is not None and time.monotonic() >= self._next_check:
+            self._check()
+        return self._profiles.get(scientific_name)
+
+    def look_up(self, scientific_name: str) -> dict | None:
+        """Drop-in replacement for the module-level look_up()."""
+        rslt = self.get(scientific_name)
+        if rslt is None:
+            instrument.info("数据库尚未收录该物种")
+        return rslt
+
+    def __contains__(self, scientific_name: str) -> bool:
+        return self.get(scientific_name) is not None
+
+    def __len__(self) -> int:
+        return len(self._profiles)
     
 
 # ------ format result ------
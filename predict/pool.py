@@ -0,0 +1,245 @@
+"""Multi-process CPU inference: N worker processes, each with its own thread budget and cores.
+
+One eager PyTorch process uses at most one intra-op thread pool, which on a
+many-core host either leaves cores idle (small batches parallelize badly)
+or oversubscribes them when several processes each start a pool as large
+as the machine. InferencePool instead starts ``workers`` processes, gives
+each ``torch.set_num_threads(threads)`` and pins it to its own ``threads``
+cores (Linux ``sched_setaffinity``), and feeds them batches of image paths
+from one queue. Each worker decodes, preprocesses and predicts its batch,
+so decoding scales with the workers too.
+
+Every worker loads the model itself, but predict.load_model memory-maps the
+checkpoint, so the weights live once in the page cache and are shared by
+all workers. Workers are forked where the platform allows it (no
+re-import of torch), and spawned elsewhere.
+
+Results come back in submission order: map() yields them in input order,
+submit() returns a Future per batch (e.g. for a request queue). If a worker
+dies (OOM kill, crash in a native op), every pending future fails with a
+RuntimeError naming its exit code and the pool refuses new batches.
+
+Example:
+    >>> with InferencePool(MODEL_PATH, class_map, workers=4, threads=4, topk=3) as pool:
+    ...     for path, label_confs in zip(paths, pool.map(paths, batch_size=16)):
+    ...         print(path, label_confs)
+    $ python predict.py traps/*.jpg -b 16 --procs 4 --threads 4
+
+Classes:
+    InferencePool
+
+Functions:
+    available_cores(): the cores this process may run on.
+    core_sets(): the cores each worker is pinned to.
+
+Author: 3dr-zzZ
+"""
+
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from pathlib import Path
+
+import torch
+
+import predict
+
+
+# ------ configuration ------
+LIVENESS_INTERVAL = 1.0  # seconds between worker liveness checks while no result arrives
+# ---------------------------
+
+
+def available_cores() -> list[int]:
+    """The cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def core_sets(workers: int, threads: int) -> list[list[int]]:
+    """Split the available cores into ``workers`` sets of ``threads``.
+
+    Sets wrap around when ``workers * threads`` exceeds the cores available,
+    so an oversubscribed layout is still spread evenly.
+    """
+    cores = available_cores()
+    return [[cores[(w * threads + t) % len(cores)] for t in range(threads)] for w in range(workers)]
+
+
+def _worker(wid: int, tasks, results, model_path, num_classes, class_map, engine, topk,
+            threads, cores, transform) -> None:
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:  # already fixed in a forked child; intra-op is what matters
+        pass
+    try:
+        model = predict.load_model(model_path, num_classes, "cpu", engine=engine)
+    except Exception as exc:
+        results.put(("failed", wid, repr(exc)))
+        return
+    results.put(("ready", wid, None))
+
+    while (task := tasks.get()) is not None:
+        task_id, paths = task
+        try:
+            batch = torch.stack([predict.load_image(p, transform) for p in paths])
+            results.put((task_id, wid, predict.predict_tensors(batch, model, class_map, "cpu", topk)))
+        except Exception as exc:  # sent as text: not every exception pickles
+            results.put((task_id, wid, RuntimeError(f"{type(exc).__name__}: {exc}")))
+
+
+class InferencePool:
+    """A pool of pinned, single-model CPU inference processes.
+
+    ``workers * threads`` should normally equal the cores you want to use;
+    a few workers with several threads each usually beat both one big
+    process and one single-threaded process per core (see
+    benchmarks/bench_pool.py to pick the split for a host).
+    """
+
+    def __init__(
+        self,
+        model_path: str | Path,
+        class_map: dict[str, str],
+        workers: int = 2,
+        threads: int = 1,
+        topk: int = 1,
+        engine: str = "eager",
+        transform: predict.Transform | None = None,
+        pin: bool = True,
+    ):
+        self.class_map = class_map
+        self.workers = workers
+        self.threads = threads
+        method = "fork" if "fork" in mp.get_all_start_methods() else "spawn"
+        ctx = mp.get_context(method)
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        self._futures: dict[int, Future] = {}
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._closing = False
+        self._broken: str | None = None  # why the pool stopped accepting work
+        self.cores = core_sets(workers, threads) if pin else [None] * workers
+        transform = transform if transform is not None else predict.get_transforms()
+        self._procs = [
+            ctx.Process(target=_worker, daemon=True,
+                        args=(wid, self._tasks, self._results, str(model_path), len(class_map), class_map,
+                              engine, topk, threads, self.cores[wid], transform))
+            for wid in range(workers)
+        ]
+        for proc in self._procs:
+            proc.start()
+        self._wait_ready()
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def _wait_ready(self) -> None:
+        ready = 0
+        while ready < self.workers:
+            try:
+                status, wid, err = self._results.get(timeout=1.0)
+            except queue.Empty:
+                dead = [p.exitcode for p in self._procs if not p.is_alive()]
+                if dead:
+                    self.close()
+                    raise RuntimeError(f"an inference worker exited during start-up (exit code {dead[0]})")
+                continue
+            if status == "failed":
+                self.close()
+                raise RuntimeError(f"inference worker {wid} could not load the model: {err}")
+            ready += 1
+
+    def _collect(self) -> None:
+        next_check = time.monotonic() + LIVENESS_INTERVAL
+        while True:
+            try:
+                item, idle = self._results.get(timeout=LIVENESS_INTERVAL), False
+            except queue.Empty:
+                item, idle = None, True
+            if time.monotonic() >= next_check:  # also while the other workers keep delivering
+                next_check = time.monotonic() + LIVENESS_INTERVAL
+                dead = [(wid, p.exitcode) for wid, p in enumerate(self._procs) if not p.is_alive()]
+                if dead and not self._closing:
+                    wid, code = dead[0]
+                    self._fail(f"inference worker {wid} exited unexpectedly (exit code {code})")
+                    return
+            if idle:
+                continue
+            if item is None:
+                return
+            task_id, _, rslt = item
+            with self._lock:
+                future = self._futures.pop(task_id)
+            if isinstance(rslt, Exception):
+                future.set_exception(rslt)
+            else:
+                future.set_result(rslt)
+
+    def _fail(self, reason: str) -> None:
+        """Fail every pending future and refuse new work: a lost task can't be told apart."""
+        with self._lock:
+            self._broken = reason
+            pending = list(self._futures.values())
+            self._futures.clear()
+        for future in pending:
+            future.set_exception(RuntimeError(reason))
+
+    def submit(self, paths: list[str | Path]) -> Future:
+        """Queue one batch of image paths; the future resolves to its list of top-k lists.
+
+        Raises RuntimeError once a worker died (see ``_fail``).
+        """
+        future = Future()
+        with self._lock:
+            if self._broken is not None:
+                raise RuntimeError(f"inference pool is broken: {self._broken}")
+            task_id = self._next_id
+            self._next_id += 1
+            self._futures[task_id] = future
+        self._tasks.put((task_id, [str(p) for p in paths]))
+        return future
+
+    def map(self, paths: list[str | Path], batch_size: int = 16, depth: int | None = None):
+        """Yield one top-k list per path, in input order.
+
+        At most ``depth`` batches (default: two per worker) are in flight, so
+        memory stays bounded however long ``paths`` is.
+        """
+        depth = depth or 2 * self.workers
+        pending = deque()
+        for chunk in predict.batched(list(paths), batch_size):
+            pending.append(self.submit(chunk))
+            if len(pending) >= depth:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+    def close(self) -> None:
+        """Stop the workers once they finished the queued batches."""
+        self._closing = True
+        for proc in self._procs:
+            if proc.is_alive():
+                self._tasks.put(None)
+        for proc in self._procs:
+            proc.join(timeout=30)
+            if proc.is_alive():
+                proc.terminate()
+        if getattr(self, "_collector", None) is not None:
+            self._results.put(None)
+            self._collector.join()
+            self._collector = None
+
+    def __enter__(self) -> "InferencePool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
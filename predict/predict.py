@@ -3,24 +3,63 @@ A library including functions to load image classification model and make predic
 
 Example:
     $ python predict.py path/to/image.jpg --model path/to/model.pth --classes classes.json --topk 3
+    $ python predict.py traps/*.jpg --batch-size 32 --workers 4 --topk 3
+    $ python predict.py pest_img.jpg --cache  # 1st run builds a model cache, later runs start fast
+    $ python predict.py --shards ../shards/test -b 64  # pre-resized images packed by shards.py
+    $ python predict.py traps/*.jpg --quiet --metrics metrics.json --profile cprofile
+    $ python predict.py traps/*.jpg -b 16 --tta --tiles 3  # multi-crop + flips (+ tiles of big photos)
+    $ python predict.py traps/*.jpg -b 16 --procs 4 --threads 4  # 4 pinned processes (pool.py)
+
+Decode, transform, forward and top-k are timed into instrument.py's
+registry; --metrics writes the stage histograms at the end.
+
+Only torch and PIL are imported with this module. timm is imported when a
+model has to be built from a state-dict, and torchvision is not needed at
+all, so a cached model starts without paying for either.
+
+Classes:
+    OnnxModel: run an exported ONNX model like the torch one.
+    Preprocess: the training preprocessing, without importing torchvision.
+    MultiCrop: full, center/corner crops and tiles of an image for test-time augmentation.
 
 Functions:
     load_model(): function to load image classification model.
+    list_image_folder(): list the images and labels of an ImageFolder tree.
     get_transforms(): function to get transforms.
     predict_one(): make prediction on an image.
-    main()
+    load_image(): open an image and apply the transforms.
+    prefetch_batches(): decode/transform upcoming batches on a thread pool.
+    predict_tensors(): make predictions on an already preprocessed batch.
+    predict_views(): average the predictions over all MultiCrop views of each image.
+    predict_batch(): make predictions on several images with one forward pass.
+    main(), run(): command line interface.
 
 Author: 3dr-zzZ
 """
 
 import argparse
 import json
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from pathlib import Path
+from typing import Callable
 
 import torch
 from PIL import Image
-from torchvision import transforms
-import timm
+
+import instrument
+
+Transform = Callable[[Image.Image], torch.Tensor]
+
+
+ENGINES = ("eager", "torchscript", "int8", "onnx")
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tif", ".tiff"}
+MEAN = (0.485, 0.456, 0.406)  # ImageNet statistics used in training
+STD = (0.229, 0.224, 0.225)
+CROPS = ("full", "center", "corners")
 
 
 def load_model(
@@ -28,12 +67,54 @@ def load_model(
     num_classes: int,
     device: str = "cpu",
     arch: str = "convnext_tiny.in12k",
+    engine: str = "eager",
+    cache: bool = False,
 ) -> torch.nn.Module:
     """
     Rebuild the network architecture with timm, then load either a full
     serialized model *or* a plain state‑dict saved via ``model.state_dict()``.
+
+    ``engine`` selects how the model runs:
+      - ``eager``: the .pth checkpoint in fp32 PyTorch (default)
+      - ``torchscript`` / ``int8``: a frozen TorchScript artifact written by
+        ``export.py`` (``int8`` is dynamically quantized and CPU only)
+      - ``onnx``: an ONNX file written by ``export.py``, run with onnxruntime
+
+    With ``cache=True`` (eager only) the built model is also saved as a frozen
+    TorchScript file next to the checkpoint (``<name>.<device>.cache.pt``).
+    Later calls load that file directly, skipping timm and the model rebuild;
+    it is rebuilt whenever the checkpoint, ``arch`` or ``num_classes`` change.
+    If the cache cannot be written (read-only directory, a model that does
+    not trace), the eager model is returned instead.
     """
-    checkpoint = torch.load(model_path, map_location=device)
+    if engine in ("torchscript", "int8"):
+        model = torch.jit.load(model_path, map_location=device)
+        model.eval()
+        return model
+    if engine == "onnx":
+        return OnnxModel(model_path, device)
+    if engine != "eager":
+        raise ValueError(f"unknown engine {engine!r}, expected one of {ENGINES}")
+
+    if cache:
+        cache_path = Path(model_path).with_suffix(f".{device}.cache.pt")
+        stamp = _checkpoint_stamp(model_path, arch, num_classes)
+        model = _load_cached_model(cache_path, stamp, device)
+        if model is None:
+            model = _build_model(model_path, num_classes, device, arch)
+            model = _save_cached_model(model, cache_path, stamp, device)
+        return model
+
+    return _build_model(model_path, num_classes, device, arch)
+
+
+def _build_model(model_path: str | Path, num_classes: int, device: str, arch: str) -> torch.nn.Module:
+    # mmap: tensors are paged in from the file instead of being read and copied up front
+    try:
+        checkpoint = torch.load(model_path, map_location=device, mmap=True, weights_only=True)
+    except Exception:
+        # a full pickled nn.Module (Case 1 below) is not loadable with weights_only
+        checkpoint = torch.load(model_path, map_location=device, weights_only=False)
 
     # Case 1 ‑ the file already contains a full nn.Module object
     if isinstance(checkpoint, torch.nn.Module):
@@ -41,57 +122,407 @@ def load_model(
 
     # Case 2 ‑ the file is a state‑dict (what we saved during training)
     else:
-        model = timm.create_model(
-            arch, pretrained=False, num_classes=num_classes
-        )
-        model.load_state_dict(checkpoint, strict=True)
+        import timm  # heavy (pulls in torchvision); only needed here
+
+        # build on the meta device so no time is spent on random init,
+        # then adopt the checkpoint tensors as the parameters
+        with torch.device("meta"):
+            model = timm.create_model(
+                arch, pretrained=False, num_classes=num_classes
+            )
+        model.load_state_dict(checkpoint, strict=True, assign=True)
 
     model.to(device)
     model.eval()
     return model
 
 
-def get_transforms() -> transforms.Compose:
-    """Return the same preprocessing pipeline used during training."""
-    return transforms.Compose(
-        [
-            transforms.Resize((224, 224)),
+def _checkpoint_stamp(model_path: str | Path, arch: str, num_classes: int) -> str:
+    st = os.stat(model_path)
+    return json.dumps({"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                       "arch": arch, "num_classes": num_classes})
+
+
+def _load_cached_model(cache_path: Path, stamp: str, device: str) -> torch.nn.Module | None:
+    if not cache_path.exists():
+        return None
+    extra = {"stamp": ""}
+    try:
+        model = torch.jit.load(cache_path, map_location=device, _extra_files=extra)
+    except RuntimeError:
+        return None
+    if extra["stamp"] != stamp.encode():
+        return None
+    model.eval()
+    return model
+
+
+@torch.inference_mode()
+def _save_cached_model(model: torch.nn.Module, cache_path: Path, stamp: str,
+                       device: str) -> torch.nn.Module:
+    example = torch.randn(1, 3, 224, 224, device=device)
+    tmp_path = None
+    try:
+        scripted = torch.jit.freeze(torch.jit.trace(model, example).eval())
+        # unique name: concurrent cold starts must not write the same temp file
+        fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent, prefix=cache_path.name + ".", suffix=".tmp")
+        os.close(fd)
+        torch.jit.save(scripted, tmp_path, _extra_files={"stamp": stamp})
+        os.replace(tmp_path, cache_path)  # never leave a half-written cache behind
+    except (OSError, RuntimeError) as exc:
+        if tmp_path is not None:
+            Path(tmp_path).unlink(missing_ok=True)
+        instrument.info(f"model cache not written ({exc}); running the eager model")
+        return model
+    return scripted
+
+
+class OnnxModel(torch.nn.Module):
+    """Wrap an onnxruntime session so it can be called like the torch model."""
+
+    def __init__(self, model_path: str | Path, device: str = "cpu"):
+        super().__init__()
+        try:
+            import onnxruntime as ort
+        except ImportError as exc:
+            raise ImportError("engine='onnx' needs onnxruntime: pip install onnxruntime") from exc
+        providers = ["CPUExecutionProvider"]
+        if device.startswith("cuda"):
+            providers.insert(0, "CUDAExecutionProvider")
+        self.session = ort.InferenceSession(str(model_path), providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        logits = self.session.run(None, {self.input_name: x.cpu().numpy()})[0]
+        return torch.from_numpy(logits)
+
+
+def list_image_folder(root: str | Path, class_map: dict[str, str]) -> tuple[list[Path], list[int]]:
+    """List the images of an ImageFolder tree (``root/<class name>/<image>``).
+
+    Returns the image paths and their class indices according to
+    ``class_map``; folders that are not a known class get label -1.
+    """
+    name_to_idx = {name.replace(" ", "_"): int(idx) for idx, name in class_map.items()}
+    paths, labels = [], []
+    for class_dir in sorted(Path(root).iterdir()):
+        if not class_dir.is_dir():
+            continue
+        label = name_to_idx.get(class_dir.name.replace(" ", "_"), -1)
+        for p in sorted(class_dir.iterdir()):
+            if p.suffix.lower() in IMG_EXTS:
+                paths.append(p)
+                labels.append(label)
+    return paths, labels
+
+
+class Preprocess:
+    """Resize -> ToTensor -> Normalize, computed exactly as torchvision does.
+
+    Equivalent (bit for bit) to::
+
+        transforms.Compose([
+            transforms.Resize(size),  # bilinear, PIL input
             transforms.ToTensor(),
-            transforms.Normalize(
-                mean=[0.485, 0.456, 0.406],
-                std=[0.229, 0.224, 0.225],
-            ),
-        ]
-    )
+            transforms.Normalize(mean, std),
+        ])
+
+    but only needs torch and PIL, so inference does not pay for importing
+    torchvision.
+    """
+
+    def __init__(
+        self,
+        size: tuple[int, int] = (224, 224),
+        mean: tuple[float, ...] = MEAN,
+        std: tuple[float, ...] = STD,
+    ):
+        self.size = size  # (height, width)
+        self.mean = torch.tensor(mean).view(-1, 1, 1)
+        self.std = torch.tensor(std).view(-1, 1, 1)
+
+    def __call__(self, image: Image.Image) -> torch.Tensor:
+        return self.normalize(self.resize(image))
+
+    def resize(self, image: Image.Image) -> torch.Tensor:
+        """Resize only: a (C, H, W) uint8 tensor, as stored by shards.py."""
+        height, width = self.size
+        return to_uint8(image.resize((width, height), Image.BILINEAR))
+
+    def normalize(self, tensor: torch.Tensor) -> torch.Tensor:
+        """ToTensor + Normalize of a uint8 (C, H, W) or (N, C, H, W) tensor."""
+        tensor = tensor.to(torch.float32).div(255)
+        return tensor.sub_(self.mean).div_(self.std)
+
+    def __repr__(self) -> str:
+        return f"Preprocess(size={self.size})"
+
+
+def to_uint8(image: Image.Image) -> torch.Tensor:
+    """A PIL image as a (C, H, W) uint8 tensor."""
+    tensor = torch.frombuffer(bytearray(image.tobytes()), dtype=torch.uint8)
+    return tensor.view(image.height, image.width, len(image.getbands())).permute(2, 0, 1).contiguous()
+
+
+class MultiCrop:
+    """Several normalized views of one image, as a (V, C, H, W) tensor.
+
+    Views, in order:
+      - ``full``: the whole image squashed to ``size``, exactly as Preprocess
+        (what the model was trained on);
+      - ``center`` / ``corners``: crops of ``size`` from the image rescaled,
+        aspect ratio kept, so that its shorter side is ``scale`` times the crop;
+      - ``tiles``: for photos whose shorter side is at least ``tile_min_side``
+        pixels, an n x n grid of overlapping tiles, so small insects in a large
+        trap photo are seen close to their native resolution.
+
+    Every crop is resampled straight from the source region (PIL's ``box``), so
+    a view costs one small resize, not a resize of the whole photo. The number
+    of views can differ between images (tiles only apply to large photos);
+    predict_views() handles that. Flips are added there, on the whole batch.
+    """
+
+    def __init__(
+        self,
+        size: tuple[int, int] = (224, 224),
+        crops: tuple[str, ...] = CROPS,
+        scale: float = 256 / 224,
+        tiles: int = 0,
+        tile_min_side: int | None = None,
+        tile_overlap: float = 0.25,
+    ):
+        unknown = set(crops) - set(CROPS)
+        if unknown:
+            raise ValueError(f"unknown crops {sorted(unknown)}, expected a subset of {CROPS}")
+        self.preprocess = Preprocess(size)
+        self.size = size
+        self.crops = crops
+        self.scale = scale
+        self.tiles = tiles
+        self.tile_min_side = tile_min_side if tile_min_side is not None else 2 * max(size)
+        self.tile_overlap = tile_overlap
+
+    def boxes(self, width: int, height: int) -> list[tuple[float, float, float, float]]:
+        """Source regions *(left, top, right, bottom)* of the crop and tile views."""
+        out_h, out_w = self.size
+        boxes = []
+        # a crop of ``size`` from the image rescaled so its shorter side is ``scale`` * crop
+        src = min(width / out_w, height / out_h) / self.scale  # source pixels per output pixel
+        crop_w, crop_h = out_w * src, out_h * src
+        if "center" in self.crops:
+            left, top = (width - crop_w) / 2, (height - crop_h) / 2
+            boxes.append((left, top, left + crop_w, top + crop_h))
+        if "corners" in self.crops:
+            for left in (0, width - crop_w):
+                for top in (0, height - crop_h):
+                    boxes.append((left, top, left + crop_w, top + crop_h))
+        n = self.tiles
+        if n > 1 and min(width, height) >= self.tile_min_side:
+            tile_w = min(width, width / n * (1 + self.tile_overlap))
+            tile_h = min(height, height / n * (1 + self.tile_overlap))
+            for i in range(n):
+                top = (height - tile_h) * i / (n - 1)
+                for j in range(n):
+                    left = (width - tile_w) * j / (n - 1)
+                    boxes.append((left, top, left + tile_w, top + tile_h))
+        return boxes
+
+    def __call__(self, image: Image.Image) -> torch.Tensor:
+        out_h, out_w = self.size
+        views = [self.preprocess.resize(image)] if "full" in self.crops else []
+        for box in self.boxes(*image.size):
+            views.append(to_uint8(image.resize((out_w, out_h), Image.BILINEAR, box=box)))
+        return self.preprocess.normalize(torch.stack(views))
+
+    def __repr__(self) -> str:
+        return f"MultiCrop(size={self.size}, crops={self.crops}, tiles={self.tiles})"
+
+
+def get_transforms(size: int = 224) -> Preprocess:
+    """Return the same preprocessing pipeline used during training (and for validation in train.py)."""
+    return Preprocess((size, size))
 
 
 @torch.inference_mode()
 def predict_one(
     image_path: str | Path,
     model: torch.nn.Module,
-    transform: transforms.Compose,
+    transform: Transform,
     class_map: dict[str, str],
     device: str = "cpu",
     topk: int = 1,
 ) -> list[tuple[str, float]]:
     """Return a list of *(label, confidence)* tuples for the top‑``k`` predictions."""
-    image = Image.open(image_path).convert("RGB")
-    tensor = transform(image).unsqueeze(0).to(device)
-    print("running on", device)
-    logits = model(tensor)
-    probs = torch.softmax(logits, dim=1).squeeze(0)
+    with instrument.timer("decode"):
+        image = Image.open(image_path).convert("RGB")
+    with instrument.timer("transform"):
+        tensor = transform(image).unsqueeze(0).to(device)
+    instrument.info("running on", device)
+    with instrument.timer("forward"):
+        logits = model(tensor)
+    with instrument.timer("topk"):
+        probs = torch.softmax(logits, dim=1).squeeze(0)
+
+        # pick the top‑k predictions
+        confs, indices = probs.topk(topk)
+        rslt = [
+            (class_map[str(idx.item())], conf.item())
+            for conf, idx in zip(confs, indices)
+        ]
+    instrument.count("images")
+    return rslt
+
+
+def load_image(image_path: str | Path, transform: Transform) -> torch.Tensor:
+    """Open ``image_path`` as RGB and return the transformed (C, H, W) tensor."""
+    with Image.open(image_path) as image:
+        with instrument.timer("decode"):
+            image = image.convert("RGB")
+        with instrument.timer("transform"):
+            return transform(image)
+
+
+def prefetch_batches(
+    image_paths: list[str | Path],
+    transform: Transform,
+    batch_size: int,
+    workers: int = 4,
+    depth: int = 2,
+    collate: Callable[[list[torch.Tensor]], object] = torch.stack,
+):
+    """Yield *(paths, batch_tensor)* pairs while later batches are being prepared.
+
+    JPEG decode and resize run on a pool of ``workers`` threads (PIL releases
+    the GIL for both), so they overlap with the forward pass of the batch
+    that was yielded last. At most ``depth`` batches are queued ahead of the
+    consumer, which bounds memory, and batches come out in input order.
+    ``collate`` combines the per-image tensors (e.g. ``list`` for MultiCrop
+    views, whose count differs between images).
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        chunks = batched(image_paths, batch_size)
+
+        def submit_next() -> bool:
+            chunk = next(chunks, None)
+            if chunk is None:
+                return False
+            futures = [pool.submit(load_image, p, transform) for p in chunk]
+            pending.append((chunk, futures))
+            return True
+
+        for _ in range(depth + 1):
+            if not submit_next():
+                break
+        while pending:
+            chunk, futures = pending.popleft()
+            batch = collate([f.result() for f in futures])
+            submit_next()
+            yield chunk, batch
+
+
+@torch.inference_mode()
+def predict_tensors(
+    batch: torch.Tensor,
+    model: torch.nn.Module,
+    class_map: dict[str, str],
+    device: str = "cpu",
+    topk: int = 1,
+) -> list[list[tuple[str, float]]]:
+    """Run one forward pass on a preprocessed (N, C, H, W) batch.
+
+    Softmax and top‑k run over the whole batch at once and the results are
+    copied to the host in one go. Returns one list of *(label, confidence)*
+    tuples per row of ``batch``.
+    """
+    with instrument.timer("forward"):
+        logits = model(batch.to(device))
+    with instrument.timer("topk"):
+        probs = torch.softmax(logits, dim=1)
+
+        # top‑k for every row, then a single device -> host copy
+        confs, indices = probs.topk(topk, dim=1)
+        rslt = [
+            [(class_map[str(idx)], conf) for conf, idx in zip(row_confs, row_idx)]
+            for row_confs, row_idx in zip(confs.tolist(), indices.tolist())
+        ]
+    instrument.count("batches")
+    instrument.count("images", len(rslt))
+    return rslt
 
-    # pick the top‑k predictions
-    confs, indices = probs.topk(topk)
-    return [
-        (class_map[str(idx.item())], conf.item())
-        for conf, idx in zip(confs, indices)
-    ]
+
+@torch.inference_mode()
+def predict_views(
+    views: list[torch.Tensor],
+    model: torch.nn.Module,
+    class_map: dict[str, str],
+    device: str = "cpu",
+    topk: int = 1,
+    flip: bool = True,
+) -> list[list[tuple[str, float]]]:
+    """Test-time augmentation: one forward pass over every view of every image.
+
+    ``views`` holds one (V_i, C, H, W) tensor per image (see MultiCrop). All
+    views, plus their horizontal mirrors with ``flip``, are concatenated into
+    a single batch; the logits are then summed per image with one
+    ``index_add_`` and divided by the view counts, and softmax/top-k run on
+    the averaged logits. Returns the same format as predict_tensors().
+    """
+    counts = torch.tensor([v.shape[0] for v in views])
+    owner = torch.repeat_interleave(torch.arange(len(views)), counts)
+    batch = torch.cat(views)
+    if flip:
+        batch = torch.cat([batch, batch.flip(-1)])
+        owner = torch.cat([owner, owner])
+        counts = counts * 2
+
+    with instrument.timer("forward"):
+        logits = model(batch.to(device)).float()
+    with instrument.timer("topk"):
+        summed = logits.new_zeros(len(views), logits.shape[1]).index_add_(0, owner.to(logits.device), logits)
+        probs = torch.softmax(summed / counts.to(logits.device).unsqueeze(1), dim=1)
+        confs, indices = probs.topk(topk, dim=1)
+        rslt = [
+            [(class_map[str(idx)], conf) for conf, idx in zip(row_confs, row_idx)]
+            for row_confs, row_idx in zip(confs.tolist(), indices.tolist())
+        ]
+    instrument.count("batches")
+    instrument.count("images", len(rslt))
+    instrument.count("views", len(batch))
+    return rslt
+
+
+def predict_batch(
+    image_paths: list[str | Path],
+    model: torch.nn.Module,
+    transform: Transform,
+    class_map: dict[str, str],
+    device: str = "cpu",
+    topk: int = 1,
+) -> list[list[tuple[str, float]]]:
+    """Batched version of :func:`predict_one`.
+
+    All images are stacked into a single tensor and sent through the model in
+    one forward pass; softmax and top‑k run over the whole batch at once.
+    Returns one list of *(label, confidence)* tuples per input image, in the
+    same order as ``image_paths``. Labels are identical to ``predict_one``;
+    confidences may differ in the last float bit because batched kernels
+    accumulate in a different order.
+    """
+    batch = torch.stack([load_image(p, transform) for p in image_paths])
+    return predict_tensors(batch, model, class_map, device, topk)
+
+
+def batched(items: list, size: int):
+    """Yield successive chunks of at most ``size`` items."""
+    it = iter(items)
+    while chunk := list(islice(it, size)):
+        yield chunk
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Single‑image classifier")
-    parser.add_argument("image", nargs="+", help="Path(s) to image file(s)")
+    parser.add_argument("image", nargs="*", help="Path(s) to image file(s)")
     parser.add_argument(
         "--model", default="..\\best_convnext_tiny.pth", help="Path to trained model weights (.pth)"
     )
@@ -104,22 +535,154 @@ def main() -> None:
         "--topk", "-k", type=int, default=1,
         help="Number of top predictions to return (default: 1)",
     )
+    parser.add_argument(
+        "--engine", choices=ENGINES, default="eager",
+        help="How to run the model; non-eager engines take an artifact from export.py (default: eager)",
+    )
+    parser.add_argument(
+        "--cache", action="store_true",
+        help="Keep a pre-built copy of the model next to the weights for fast start-up (eager only)",
+    )
+    parser.add_argument(
+        "--batch-size", "-b", type=int, default=1,
+        help="Number of images per forward pass (default: 1, i.e. one by one)",
+    )
+    parser.add_argument(
+        "--workers", "-j", type=int, default=4,
+        help="Threads decoding/resizing upcoming batches (default: 4)",
+    )
+    parser.add_argument(
+        "--prefetch", type=int, default=2,
+        help="Max number of batches prepared ahead of the model (default: 2)",
+    )
+    parser.add_argument(
+        "--shards",
+        help="Predict every image of a directory packed by shards.py instead of image files",
+    )
+    parser.add_argument(
+        "--procs", type=int, default=1,
+        help="Worker processes on CPU, each with --threads threads pinned to its own cores (default: 1)",
+    )
+    parser.add_argument(
+        "--threads", type=int, default=None,
+        help="torch threads per worker process with --procs (default: cores / procs)",
+    )
+    parser.add_argument(
+        "--tta", action="store_true",
+        help="Average the predictions over several views of each image (see --crops/--tiles/--no-flip)",
+    )
+    parser.add_argument(
+        "--crops", nargs="+", choices=CROPS, default=list(CROPS),
+        help="TTA views: full (the training resize), center and/or the 4 corner crops (default: all)",
+    )
+    parser.add_argument(
+        "--tiles", type=int, default=0,
+        help="TTA: also cut photos at least twice the input size into an N x N grid of tiles (default: off)",
+    )
+    parser.add_argument("--no-flip", action="store_true", help="TTA: without the mirrored copy of every view")
+    parser.add_argument(
+        "--quiet", "-q", action="store_true",
+        help="Only print predictions, no per-call progress messages",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="Write per-stage timings here at the end (.prom/.txt: Prometheus text, else JSON)",
+    )
+    parser.add_argument(
+        "--profile", choices=("cprofile", "torch"),
+        help="Profile the prediction loop and print the hottest functions/operators",
+    )
+    parser.add_argument("--profile-out", help="Save the profile (pstats file or Chrome trace)")
     args = parser.parse_args()
+    if not args.image and not args.shards:
+        parser.error("give image file(s) or --shards")
+    if args.tta and args.shards:
+        parser.error("--tta crops the original photos, it cannot run on --shards")
+    if args.procs > 1 and (args.shards or args.tta or args.engine == "onnx"):
+        parser.error("--procs runs eager/TorchScript models on image files, without --shards or --tta")
+    instrument.set_quiet(args.quiet)
 
     device = "cuda" if torch.cuda.is_available() else "cpu"
 
     with open(args.classes, "r", encoding="utf-8") as f:
         class_map = json.load(f)
 
-    model = load_model(args.model, num_classes=len(class_map), device=device)
-    transform = get_transforms()
+    if args.procs > 1:
+        run_pool(args, class_map)
+        return
+
+    model = load_model(
+        args.model, num_classes=len(class_map), device=device, engine=args.engine, cache=args.cache
+    )
+    transform = MultiCrop(crops=tuple(args.crops), tiles=args.tiles) if args.tta else get_transforms()
+
+    with instrument.profile(args.profile, args.profile_out):
+        run(args, model, transform, class_map, device)
+    if args.metrics:
+        instrument.dump(args.metrics)
+        if not args.quiet:
+            print(instrument.summary())
+
 
-    for img in args.image:
-        label_confs = predict_one(
-            img, model, transform, class_map, device, args.topk
+def run_pool(args: argparse.Namespace, class_map: dict[str, str]) -> None:
+    """main() with --procs: the images are predicted by a pool.InferencePool on the CPU."""
+    import pool
+
+    threads = args.threads or max(1, len(pool.available_cores()) // args.procs)
+    with instrument.profile(args.profile, args.profile_out):
+        with pool.InferencePool(args.model, class_map, args.procs, threads, args.topk, args.engine) as workers:
+            instrument.info(f"running on {args.procs} processes x {threads} threads")
+            results = workers.map(args.image, max(args.batch_size, 1))
+            for img, label_confs in zip(args.image, results):
+                pairs = [f"{lbl} (confidence={conf:.2%})" for lbl, conf in label_confs]
+                print(f"{Path(img).name}: " + ", ".join(pairs))
+
+
+def run(args: argparse.Namespace, model: torch.nn.Module, transform: Transform,
+        class_map: dict[str, str], device: str) -> None:
+    """The prediction loop of main(), for images or --shards."""
+    if args.shards:
+        import shards
+
+        dataset = shards.ShardDataset(args.shards)
+        instrument.info("running on", device)
+        for paths, _, batch in shards.iter_batches(dataset, max(args.batch_size, 1)):
+            results = predict_tensors(batch, model, class_map, device, args.topk)
+            for img, label_confs in zip(paths, results):
+                pairs = [f"{lbl} (confidence={conf:.2%})" for lbl, conf in label_confs]
+                print(f"{Path(img).name}: " + ", ".join(pairs))
+        return
+
+    if args.tta:
+        instrument.info("running on", device)
+        batches = prefetch_batches(
+            args.image, transform, max(args.batch_size, 1), args.workers, args.prefetch, collate=list
         )
-        pairs = [f"{lbl} (confidence={conf:.2%})" for lbl, conf in label_confs]
-        print(f"{Path(img).name}: " + ", ".join(pairs))
+        for chunk, views in batches:
+            results = predict_views(views, model, class_map, device, args.topk, flip=not args.no_flip)
+            for img, label_confs in zip(chunk, results):
+                pairs = [f"{lbl} (confidence={conf:.2%})" for lbl, conf in label_confs]
+                print(f"{Path(img).name}: " + ", ".join(pairs))
+        return
+
+    if args.batch_size <= 1:
+        for img in args.image:
+            label_confs = predict_one(
+                img, model, transform, class_map, device, args.topk
+            )
+            pairs = [f"{lbl} (confidence={conf:.2%})" for lbl, conf in label_confs]
+            print(f"{Path(img).name}: " + ", ".join(pairs))
+        return
+
+    instrument.info("running on", device)
+    batches = prefetch_batches(
+        args.image, transform, args.batch_size, args.workers, args.prefetch
+    )
+    for chunk, batch in batches:
+        results = predict_tensors(batch, model, class_map, device, args.topk)
+        for img, label_confs in zip(chunk, results):
+            pairs = [f"{lbl} (confidence={conf:.2%})" for lbl, conf in label_confs]
+            print(f"{Path(img).name}: " + ", ".join(pairs))
 
 
 if __name__ == "__main__":  # pragma: no cover
@@ -0,0 +1,129 @@
+"""Parameterized queries against the pests database.
+
+Every statement is a module-level constant with ``?`` placeholders. sqlite3
+keeps a per-connection cache of prepared statements keyed by the SQL text,
+so each of them is parsed once per connection and reused afterwards, and
+names containing quotes are bound safely instead of breaking the SQL.
+
+The ``*_many`` variants take the whole list as a single JSON array parameter
+and expand it with ``json_each``, so the statement text stays the same no
+matter how many names are asked for and each list costs one round-trip.
+
+Every function is timed into instrument.py's ``sql.<function>`` stage.
+
+Functions:
+    find_species(): id and basic info of a species by scientific name.
+    fetch_taxonomy(): taxonomy rows of a species, phylum down to genus.
+    fetch_locations(): distribution rows of a species.
+    fetch_diseases(): diseases carried by a species.
+    find_species_many(), fetch_taxonomy_many(), fetch_locations_many(),
+    fetch_diseases_many(): the same for a list of species in one query each.
+
+Author: 3dr-zzZ
+"""
+
+import json
+import sqlite3
+
+import instrument
+
+
+FIND_SPECIES = """
+    SELECT id, chinese_name, other_name, traits FROM species
+    WHERE scientific_name = ?
+    ORDER BY id LIMIT 1;
+"""
+
+TAXONOMY = """
+    SELECT taxonomies.name, taxonomies.chinese_name, taxonomies.type FROM belongs
+    JOIN taxonomies ON belongs.taxonomy_id = taxonomies.id
+    WHERE belongs.species_id = ?
+    ORDER BY belongs.taxonomy_id;
+"""
+
+LOCATIONS = """
+    SELECT locations.name, locations.type FROM distributed
+    JOIN locations ON distributed.location_id = locations.id
+    WHERE distributed.species_id = ?
+    ORDER BY distributed.location_id;
+"""
+
+DISEASES = """
+    SELECT diseases.name FROM carries
+    JOIN diseases ON carries.disease_id = diseases.id
+    WHERE carries.species_id = ?
+    ORDER BY carries.disease_id;
+"""
+
+
+@instrument.timed("sql.find_species")
+def find_species(cur: sqlite3.Cursor, scientific_name: str) -> tuple | None:
+    """Return *(id, chinese_name, other_name, traits)*, or None if not in the database."""
+    return cur.execute(FIND_SPECIES, (scientific_name,)).fetchone()
+
+
+@instrument.timed("sql.fetch_taxonomy")
+def fetch_taxonomy(cur: sqlite3.Cursor, species_id: int) -> list[tuple]:
+    return cur.execute(TAXONOMY, (species_id,)).fetchall()
+
+
+@instrument.timed("sql.fetch_locations")
+def fetch_locations(cur: sqlite3.Cursor, species_id: int) -> list[tuple]:
+    return cur.execute(LOCATIONS, (species_id,)).fetchall()
+
+
+@instrument.timed("sql.fetch_diseases")
+def fetch_diseases(cur: sqlite3.Cursor, species_id: int) -> list[tuple]:
+    return cur.execute(DISEASES, (species_id,)).fetchall()
+
+
+FIND_SPECIES_MANY = """
+    SELECT id, scientific_name, chinese_name, other_name, traits FROM species
+    WHERE scientific_name IN (SELECT value FROM json_each(?))
+    ORDER BY id;
+"""
+
+TAXONOMY_MANY = """
+    SELECT belongs.species_id, taxonomies.name, taxonomies.chinese_name, taxonomies.type FROM belongs
+    JOIN taxonomies ON belongs.taxonomy_id = taxonomies.id
+    WHERE belongs.species_id IN (SELECT value FROM json_each(?))
+    ORDER BY belongs.species_id, belongs.taxonomy_id;
+"""
+
+LOCATIONS_MANY = """
+    SELECT distributed.species_id, locations.name, locations.type FROM distributed
+    JOIN locations ON distributed.location_id = locations.id
+    WHERE distributed.species_id IN (SELECT value FROM json_each(?))
+    ORDER BY distributed.species_id, distributed.location_id;
+"""
+
+DISEASES_MANY = """
+    SELECT carries.species_id, diseases.name FROM carries
+    JOIN diseases ON carries.disease_id = diseases.id
+    WHERE carries.species_id IN (SELECT value FROM json_each(?))
+    ORDER BY carries.species_id, carries.disease_id;
+"""
+
+
+@instrument.timed("sql.find_species_many")
+def find_species_many(cur: sqlite3.Cursor, scientific_names: list[str]) -> list[tuple]:
+    """Return *(id, scientific_name, chinese_name, other_name, traits)* rows for the names found."""
+    return cur.execute(FIND_SPECIES_MANY, (json.dumps(list(scientific_names)),)).fetchall()
+
+
+@instrument.timed("sql.fetch_taxonomy_many")
+def fetch_taxonomy_many(cur: sqlite3.Cursor, species_ids: list[int]) -> list[tuple]:
+    """Rows are *(species_id, name, chinese_name, type)*, grouped by species."""
+    return cur.execute(TAXONOMY_MANY, (json.dumps(list(species_ids)),)).fetchall()
+
+
+@instrument.timed("sql.fetch_locations_many")
+def fetch_locations_many(cur: sqlite3.Cursor, species_ids: list[int]) -> list[tuple]:
+    """Rows are *(species_id, name, type)*, grouped by species."""
+    return cur.execute(LOCATIONS_MANY, (json.dumps(list(species_ids)),)).fetchall()
+
+
+@instrument.timed("sql.fetch_diseases_many")
+def fetch_diseases_many(cur: sqlite3.Cursor, species_ids: list[int]) -> list[tuple]:
+    """Rows are *(species_id, name)*, grouped by species."""
+    return cur.execute(DISEASES_MANY, (json.dumps(list(species_ids)),)).fetchall()
@@ -0,0 +1,366 @@
+"""Full-text and fuzzy species search over pests.db.
+
+look_up() only finds an exact binomial ``scientific_name``. This module
+searches every name a species goes by (scientific name, its binomial,
+Chinese name, each alias of ``other_name``) plus the ``traits`` text, and
+tolerates typos:
+
+- ``species_names``: one normalized row per name or alias, with an index on
+  the normalized form for exact hits;
+- ``species_names_fts``: an FTS5 trigram index over those names, used to
+  find fuzzy candidates (the names sharing most of the query's rarest
+  trigrams, whose frequencies are kept in ``species_trigrams``), which are
+  then ranked by trigram overlap and edit distance;
+- ``species_fts``: an FTS5 trigram index over names and ``traits`` for
+  substring / full-text queries, ranked with bm25.
+
+The tables are built by database/csv_to_db.py after every load (or with
+``python search.py build``). Queries only touch the candidates an index
+returns, so they take milliseconds on 100k+ species.
+
+Example:
+    $ python search.py "Aedes albopictis"          # typo
+    $ python search.py 白纹伊蚊
+    $ python search.py "Culex (Culex) pipiens Linnaeus, 1758"
+    $ python search.py build --db ../database/pests.db
+    >>> matches = search(cur, "花斑蚊", limit=5)
+    >>> resolve(cur, "Aedes albopicta")  # best match above a threshold, or None
+    'Aedes albopictus'
+
+Classes:
+    Match: one ranked result.
+
+Functions:
+    normalize(): the form names are indexed and compared in.
+    binomial(): "Genus species" part of a longer scientific name.
+    build_index(): (re)build the search tables.
+    has_index(): whether a database has them.
+    search(): ranked matches for a query.
+    resolve(): the scientific name a query most likely means.
+    main()
+
+Author: 3dr-zzZ
+"""
+
+import argparse
+import re
+import sqlite3
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+
+import instrument
+
+
+# ------ configuration ------
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DB_PATH = PROJECT_ROOT/"database"/"pests.db"
+ALIAS_SEPARATORS = r"[、,，;；/|]"
+FUZZY_POSTINGS = 5_000     # trigram postings read per fuzzy query, rarest trigrams first
+FUZZY_CANDIDATES = 200
+TEXT_RANK_MAX = 1_000      # full-text hits ranked with bm25; more common phrases fall back to names
+RESOLVE_MIN_SCORE = 0.8
+# ---------------------------
+
+SCHEMA = """
+DROP TABLE IF EXISTS species_trigrams;
+DROP TABLE IF EXISTS species_names_fts;
+DROP TABLE IF EXISTS species_fts;
+DROP TABLE IF EXISTS species_names;
+CREATE TABLE species_names (
+    id          INTEGER PRIMARY KEY,
+    species_id  INTEGER NOT NULL,
+    name        TEXT NOT NULL,
+    norm        TEXT NOT NULL,
+    kind        TEXT NOT NULL CHECK (kind IN ('scientific', 'binomial', 'chinese', 'alias'))
+);
+CREATE INDEX species_names_norm ON species_names(norm);
+CREATE VIRTUAL TABLE species_names_fts USING fts5(
+    norm, content='species_names', content_rowid='id', tokenize='trigram'
+);
+CREATE TABLE species_trigrams (
+    term  TEXT PRIMARY KEY,
+    doc   INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE VIRTUAL TABLE species_fts USING fts5(
+    scientific_name, chinese_name, other_name, traits,
+    content='species', content_rowid='id', tokenize='trigram'
+);
+"""
+
+SCORE = {"exact": 1.0, "fuzzy": 0.95, "text": 0.6}  # upper bound of each kind of match
+
+
+@dataclass
+class Match:
+    species_id: int
+    scientific_name: str
+    chinese_name: str | None
+    score: float               # 0..1, 1 = exact name
+    matched: str               # the name, or the species_fts column (e.g. traits) that matched
+    how: str                   # exact / fuzzy / text
+
+
+# ------ names ------
+def normalize(text: str) -> str:
+    """NFKC, case-folded, punctuation removed, whitespace collapsed."""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def binomial(name: str) -> str | None:
+    """The "Genus species" of a trinomial or authored name, or None if ``name`` is already one.
+
+    >>> binomial("Culex (Culex) pipiens Linnaeus, 1758")
+    'Culex pipiens'
+    """
+    words = re.sub(r"\([^)]*\)", " ", name).replace(",", " ").split()
+    if len(words) < 2 or not words[0][:1].isupper() or not words[1].islower():
+        return None
+    short = f"{words[0]} {words[1]}"
+    return short if short != " ".join(name.split()) else None
+
+
+def _names(row: tuple) -> list[tuple[str, str]]:
+    """*(name, kind)* pairs a species row is known by."""
+    species_id, scientific_name, chinese_name, other_name = row
+    names = []
+    if scientific_name:
+        names.append((scientific_name, "scientific"))
+        short = binomial(scientific_name)
+        if short:
+            names.append((short, "binomial"))
+    if chinese_name:
+        names.append((chinese_name, "chinese"))
+    if other_name:
+        names += [(alias.strip(), "alias") for alias in re.split(ALIAS_SEPARATORS, other_name) if alias.strip()]
+    return names
+
+
+# ------ index ------
+def build_index(con: sqlite3.Connection) -> int:
+    """(Re)build the search tables from ``species``; returns the number of names indexed.
+
+    Runs inside the caller's transaction if there is one.
+    """
+    for stmt in SCHEMA.split(";"):
+        if stmt.strip():
+            con.execute(stmt)
+    rows = con.execute("SELECT id, scientific_name, chinese_name, other_name FROM species ORDER BY id;")
+    con.executemany(
+        "INSERT INTO species_names (species_id, name, norm, kind) VALUES (?, ?, ?, ?);",
+        ((row[0], name, normalize(name), kind) for row in rows for name, kind in _names(row)),
+    )
+    con.execute("INSERT INTO species_names_fts(species_names_fts) VALUES ('rebuild');")
+    # document frequency per trigram, copied out of fts5vocab (which is slow to probe per term)
+    con.execute("CREATE VIRTUAL TABLE temp.species_names_vocab USING fts5vocab(main, species_names_fts, 'row');")
+    con.execute("INSERT INTO species_trigrams SELECT term, doc FROM temp.species_names_vocab;")
+    con.execute("DROP TABLE temp.species_names_vocab;")
+    con.execute("INSERT INTO species_fts(species_fts) VALUES ('rebuild');")
+    return con.execute("SELECT COUNT(*) FROM species_names;").fetchone()[0]
+
+
+def has_index(cur: sqlite3.Cursor | sqlite3.Connection) -> bool:
+    return cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'species_names_fts';").fetchone() is not None
+
+
+# ------ scoring ------
+def trigrams(text: str) -> set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Levenshtein distance, two-row dynamic programming."""
+    if len(a) < len(b):
+        a, b = b, a
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+
+def similarity(query: str, name: str) -> float:
+    """1 - normalized edit distance, in 0..1."""
+    return 1 - edit_distance(query, name) / max(len(query), len(name), 1)
+
+
+def _fts_phrase(text: str) -> str:
+    return '"' + text.replace('"', '""') + '"'
+
+
+# ------ search ------
+def _exact(cur: sqlite3.Cursor, norm: str) -> list[tuple]:
+    return cur.execute("SELECT species_id, name FROM species_names WHERE norm = ?;", (norm,)).fetchall()
+
+
+def _fuzzy(cur: sqlite3.Cursor, norm: str) -> list[tuple[int, str, float]]:
+    """*(species_id, name, similarity)* of names close to ``norm``."""
+    grams = trigrams(norm)
+    if grams:
+        # a typo breaks at most three trigrams, so names sharing several of the query's rarest
+        # trigrams are the candidates; their postings are counted (instead of a ranked FTS
+        # query), rarest first, and at most FUZZY_POSTINGS of them are read in total
+        placeholders = ", ".join("?" * len(grams))
+        hits = Counter()
+        budget = FUZZY_POSTINGS
+        for term, doc in cur.execute(
+                f"SELECT term, doc FROM species_trigrams WHERE term IN ({placeholders}) ORDER BY doc;",
+                tuple(grams)).fetchall():
+            if budget <= 0:
+                break
+            hits.update(rowid for rowid, in cur.execute(
+                "SELECT rowid FROM species_names_fts WHERE species_names_fts MATCH ? LIMIT ?;",
+                (_fts_phrase(term), budget)))
+            budget -= doc
+        ids = [rowid for rowid, _ in hits.most_common(FUZZY_CANDIDATES)]
+        candidates = cur.execute(
+            f"SELECT species_id, name, norm FROM species_names WHERE id IN ({', '.join('?' * len(ids))});", ids,
+        ).fetchall() if ids else []
+        # cheap trigram overlap first, edit distance only for the best few
+        candidates.sort(key=lambda c: -len(grams & trigrams(c[2])) / len(grams | trigrams(c[2])))
+        candidates = candidates[:20]
+    else:  # one or two characters (e.g. a short Chinese name): substring scan
+        candidates = cur.execute(
+            "SELECT species_id, name, norm FROM species_names WHERE instr(norm, ?) > 0 LIMIT ?;",
+            (norm, FUZZY_CANDIDATES),
+        ).fetchall()
+    out = []
+    for species_id, name, cand in candidates:
+        score = similarity(norm, cand)
+        if norm in cand:  # a part of a longer name (e.g. only the epithet) still ranks high
+            score = max(score, 0.5 + 0.4 * len(norm) / len(cand))
+        out.append((species_id, name, score))
+    return out
+
+
+def _matched_columns(cur: sqlite3.Cursor, phrase: str, ids: list[int]) -> dict[int, str]:
+    """The species_fts column ``phrase`` was found in for each of ``ids`` (names before traits)."""
+    matched = {}
+    marks = ", ".join("?" * len(ids))
+    for column in ("traits", "other_name", "chinese_name", "scientific_name"):  # later ones win
+        for species_id, in cur.execute(
+                f"SELECT rowid FROM species_fts WHERE species_fts MATCH ? AND rowid IN ({marks});",
+                (f"{column} : {phrase}", *ids)):
+            matched[species_id] = column
+    return matched
+
+
+def _text(cur: sqlite3.Cursor, query: str, limit: int) -> list[tuple[int, str, float]]:
+    """Substring matches in names and traits, bm25-ranked (names weigh more).
+
+    bm25 scores every matching row before LIMIT applies, so a phrase found in
+    more than TEXT_RANK_MAX rows (e.g. "species") is not ranked: the names
+    containing it are returned instead, shortest (closest) first, then
+    unranked hits in the other fields.
+    """
+    if len(query) < 3:
+        return []
+    phrase = _fts_phrase(query)
+    hits = cur.execute("SELECT COUNT(*) FROM (SELECT rowid FROM species_fts WHERE species_fts MATCH ? LIMIT ?);",
+                       (phrase, TEXT_RANK_MAX + 1)).fetchone()[0]
+    if hits > TEXT_RANK_MAX:
+        norm = normalize(query)
+        rows = cur.execute(
+            "SELECT species_names.species_id, species_names.name, species_names.norm FROM species_names_fts "
+            "JOIN species_names ON species_names.id = species_names_fts.rowid "
+            "WHERE species_names_fts MATCH ? LIMIT ?;",
+            (_fts_phrase(norm), TEXT_RANK_MAX),
+        ).fetchall() if len(norm) >= 3 else []
+        rows.sort(key=lambda r: len(r[2]))
+        out = [(species_id, name, len(norm) / len(cand)) for species_id, name, cand in rows[:limit]]
+        if len(out) < limit:  # only (or mostly) in traits: unranked hits, all equally good
+            ids = [species_id for species_id, in cur.execute(
+                "SELECT rowid FROM species_fts WHERE species_fts MATCH ? LIMIT ?;", (phrase, limit - len(out)))]
+            matched = _matched_columns(cur, phrase, ids) if ids else {}
+            out += [(species_id, matched.get(species_id, "traits"), 0.5) for species_id in ids]
+        return out
+    rows = cur.execute(
+        "SELECT rowid, bm25(species_fts, 10.0, 10.0, 5.0, 1.0) AS score FROM species_fts "
+        "WHERE species_fts MATCH ? ORDER BY score LIMIT ?;",
+        (phrase, limit),
+    ).fetchall()
+    # bm25 is negative, more negative = better; map the best to 1 and the rest relative to it
+    best = min((score for _, score in rows), default=-1.0) or -1.0
+    matched = _matched_columns(cur, phrase, [species_id for species_id, _ in rows]) if rows else {}
+    return [(species_id, matched.get(species_id, "traits"), score / best) for species_id, score in rows]
+
+
+@instrument.timed("search")
+def search(cur: sqlite3.Cursor, query: str, limit: int = 10, fuzzy: bool = True) -> list[Match]:
+    """Species matching ``query``, best first.
+
+    Exact names (after normalization, also the binomial of a longer
+    scientific name) score 1; fuzzy name matches up to 0.95; hits only in the
+    full-text index (e.g. in ``traits``) up to 0.6. Each species appears once.
+    Fuzzy matching only runs when no name matched exactly.
+    """
+    norm = normalize(query)
+    if not norm:
+        return []
+    best: dict[int, tuple[float, str, str]] = {}
+
+    def offer(species_id: int, score: float, matched: str, how: str) -> None:
+        if score > best.get(species_id, (-1.0,))[0]:
+            best[species_id] = (score, matched, how)
+
+    short = binomial(query)
+    for target in filter(None, (norm, short and normalize(short))):
+        for species_id, name in _exact(cur, target):
+            offer(species_id, SCORE["exact"], name, "exact")
+    if fuzzy and not best:  # a query that is a name needs no typo tolerance
+        for species_id, name, score in _fuzzy(cur, norm):
+            offer(species_id, SCORE["fuzzy"] * score, name, "fuzzy")
+    if len(best) < limit:
+        for species_id, matched, score in _text(cur, query.strip(), limit):
+            offer(species_id, SCORE["text"] * score, matched, "text")
+
+    ranked = sorted(best.items(), key=lambda item: -item[1][0])[:limit]
+    if not ranked:
+        return []
+    ids = [species_id for species_id, _ in ranked]
+    info = {row[0]: row[1:] for row in cur.execute(
+        f"SELECT id, scientific_name, chinese_name FROM species WHERE id IN ({', '.join('?' * len(ids))});", ids)}
+    return [Match(species_id, *info[species_id], score, matched, how)
+            for species_id, (score, matched, how) in ranked if species_id in info]
+
+
+def resolve(cur: sqlite3.Cursor, query: str, min_score: float = RESOLVE_MIN_SCORE) -> str | None:
+    """The scientific name ``query`` most likely refers to, or None.
+
+    Returns None as well when the database has no search index yet.
+    """
+    if not has_index(cur):
+        return None
+    matches = search(cur, query, limit=1)
+    if matches and matches[0].score >= min_score:
+        return matches[0].scientific_name
+    return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Search species by any name, alias or trait")
+    parser.add_argument("query", nargs="+", help="Search text, or 'build' to (re)build the index")
+    parser.add_argument("--db", default=DB_PATH, help="Path to pests.db")
+    parser.add_argument("--limit", "-n", type=int, default=10)
+    parser.add_argument("--no-fuzzy", action="store_true", help="Exact and full-text matches only")
+    args = parser.parse_args()
+
+    con = sqlite3.connect(args.db)
+    if args.query == ["build"]:
+        with con:
+            n = build_index(con)
+        print(f"Indexed {n} names")
+        return
+    if not has_index(con):
+        parser.error(f"{args.db} has no search index; run csv_to_db.py or 'search.py build' first")
+    for m in search(con.cursor(), " ".join(args.query), args.limit, fuzzy=not args.no_fuzzy):
+        print(f"{m.score:5.2f}  {m.scientific_name:<32} {m.chinese_name or '':<12} [{m.how}: {m.matched}]")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""Long-running classification + database lookup service.
+
+The model and the database are loaded once at start-up; every request then
+only pays for decoding its image and a share of one batched forward pass.
+Concurrent requests are collected into micro-batches of up to
+``--max-batch`` images, waiting at most ``--max-wait-ms`` for a batch to fill.
+With ``--prediction-cache`` a re-submitted image is answered from the cache
+(keyed by its bytes) without decoding it; GET /stats shows the hit rate.
+GET /metrics serves instrument.py's stage timings and counters as Prometheus
+text (GET /metrics.json for JSON). GET /search?q=...&limit=... runs search.py
+over a pool of read-only connections (db_pool.py), which also resolves
+labels that are not an exact scientific name in the database.
+
+Example:
+    $ python server.py --port 8000 --max-batch 16 --max-wait-ms 10
+    $ curl --data-binary @pest_img.jpg http://127.0.0.1:8000/identify
+    $ python server.py --prediction-cache ../database/prediction_cache.db
+    $ curl "http://127.0.0.1:8000/search?q=Aedes%20albopictis&limit=5"
+
+Classes/Functions:
+    MicroBatcher: collect concurrent requests into one forward pass.
+    make_handler(): build the HTTP request handler.
+    main()
+
+Author: 3dr-zzZ
+"""
+
+import argparse
+import io
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import torch
+from PIL import Image, UnidentifiedImageError
+
+import instrument, predict, look_up, search
+from cache import PredictionCache
+from db_pool import ConnectionPool
+
+
+# ------ configuration ------
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DB_PATH = PROJECT_ROOT/"database"/"pests.db"
+MODEL_PATH = PROJECT_ROOT/"best_convnext_tiny.pth"
+CLASS_MAP_PATH = PROJECT_ROOT/"class_mapping.json"
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+TOPK = 3
+MAX_BODY_BYTES = 32 << 20  # largest accepted upload (413 above)
+# ---------------------------
+
+
+class MicroBatcher:
+    """Run the model on batches assembled from concurrently submitted tensors.
+
+    A single worker thread owns the model. It blocks for the first request,
+    then keeps collecting until ``max_batch_size`` tensors are queued or
+    ``max_wait`` seconds have passed, and runs them in one forward pass.
+    """
+
+    def __init__(
+        self,
+        model: torch.nn.Module,
+        class_map: dict[str, str],
+        device: str = "cpu",
+        topk: int = 1,
+        max_batch_size: int = 16,
+        max_wait: float = 0.01,
+    ):
+        self.model = model
+        self.class_map = class_map
+        self.device = device
+        self.topk = topk
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue: queue.Queue[tuple[torch.Tensor, Future]] = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, tensor: torch.Tensor) -> Future:
+        """Queue one preprocessed (C, H, W) tensor; the future resolves to its top-k list."""
+        future = Future()
+        self._queue.put((tensor, future))
+        return future
+
+    def _collect(self) -> list[tuple[torch.Tensor, Future]]:
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self) -> None:
+        while True:
+            items = self._collect()
+            try:  # a failed stack must reach the futures too, or this thread dies and /identify hangs
+                batch = torch.stack([tensor for tensor, _ in items])
+                results = predict.predict_tensors(
+                    batch, self.model, self.class_map, self.device, self.topk
+                )
+            except Exception as exc:
+                for _, future in items:
+                    future.set_exception(exc)
+                continue
+            for (_, future), label_confs in zip(items, results):
+                future.set_result(label_confs)
+
+
+def make_handler(
+    batcher: MicroBatcher,
+    transform,
+    profiles: look_up.SpeciesProfileCache,
+    cache: PredictionCache | None = None,
+    db_pool: ConnectionPool | None = None,
+) -> type[BaseHTTPRequestHandler]:
+    """Build a request handler bound to ``batcher``, the species ``profiles``, an optional ``cache``
+    and an optional ``db_pool`` (for /search and resolving unknown labels).
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, payload: dict) -> None:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self) -> None:
+            if self.path == "/health":
+                self._send_json(200, {"status": "ok"})
+            elif self.path == "/metrics":
+                body = instrument.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            elif self.path == "/metrics.json":
+                self._send_json(200, instrument.to_json())
+            elif self.path == "/stats":
+                self._send_json(200, {"prediction_cache": cache.stats() if cache else None,
+                                      "db_pool": db_pool.stats() if db_pool else None})
+            elif self.path.startswith("/search?"):
+                self._search(parse_qs(urlsplit(self.path).query))
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def _search(self, params: dict[str, list[str]]) -> None:
+            query = params.get("q", [""])[0].strip()
+            if not query:
+                self._send_json(400, {"error": "missing query, use /search?q=..."})
+                return
+            if db_pool is None:
+                self._send_json(503, {"error": "search index not built, run csv_to_db.py"})
+                return
+            try:
+                limit = min(int(params.get("limit", ["10"])[0]), 100)
+            except ValueError:
+                self._send_json(400, {"error": "limit must be an integer"})
+                return
+            with db_pool.cursor() as cur:
+                matches = search.search(cur, query, limit)
+            self._send_json(200, {"query": query, "matches": [asdict(m) for m in matches]})
+
+        def _profile(self, scientific_name: str) -> dict | None:
+            info = profiles.get(scientific_name)
+            if info is None and db_pool is not None:
+                with db_pool.cursor() as cur:
+                    resolved = search.resolve(cur, scientific_name)
+                if resolved is not None:
+                    info = profiles.get(resolved)
+            if info is None:
+                instrument.info("数据库尚未收录该物种")
+            return info
+
+        def do_POST(self) -> None:
+            if self.path != "/identify":
+                self._send_json(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+            except ValueError:
+                self.close_connection = True  # body length unknown, so it cannot be skipped
+                self._send_json(400, {"error": "Content-Length must be an integer"})
+                return
+            if length <= 0:
+                self._send_json(400, {"error": "empty body, send the image bytes"})
+                return
+            if length > MAX_BODY_BYTES:
+                self.close_connection = True  # the unread body would be parsed as the next request
+                self._send_json(413, {"error": f"image larger than {MAX_BODY_BYTES} bytes"})
+                return
+            data = self.rfile.read(length)
+            label_confs = None
+            if cache is not None:
+                image_key = cache.key(data)
+                label_confs = cache.get(image_key)
+            if label_confs is None:
+                try:
+                    with Image.open(io.BytesIO(data)) as image:
+                        with instrument.timer("decode"):
+                            image = image.convert("RGB")
+                        with instrument.timer("transform"):
+                            tensor = transform(image)
+                except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as exc:
+                    self._send_json(400, {"error": f"cannot decode image: {exc}"})
+                    return
+                except Exception as exc:
+                    self._send_json(500, {"error": f"cannot preprocess image: {exc}"})
+                    return
+                try:
+                    with instrument.timer("server.wait"):  # queueing + the batched forward pass
+                        label_confs = batcher.submit(tensor).result()
+                except Exception as exc:
+                    self._send_json(500, {"error": f"prediction failed: {exc}"})
+                    return
+                if cache is not None:
+                    cache.put(image_key, label_confs)
+
+            predictions = []
+            for lbl, conf in label_confs:
+                scientific_name = " ".join(lbl.replace("_", " ").split()[-2:])
+                predictions.append({
+                    "label": lbl,
+                    "scientific_name": scientific_name,
+                    "confidence": conf,
+                    "info": self._profile(scientific_name),
+                })
+            self._send_json(200, {"predictions": predictions})
+
+        def log_message(self, format: str, *args) -> None:
+            if not instrument.is_quiet():  # one line per request otherwise
+                super().log_message(format, *args)
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pest identification service")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to bind (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on (default: 8000)")
+    parser.add_argument("--model", default=MODEL_PATH, help="Path to trained model weights (.pth)")
+    parser.add_argument("--classes", default=CLASS_MAP_PATH, help="Path to class mapping JSON")
+    parser.add_argument(
+        "--engine", choices=predict.ENGINES, default="eager",
+        help="How to run the model; non-eager engines take an artifact from export.py (default: eager)",
+    )
+    parser.add_argument("--db", default=DB_PATH, help="Path to pests.db")
+    parser.add_argument("--topk", "-k", type=int, default=TOPK, help=f"Predictions per image (default: {TOPK})")
+    parser.add_argument(
+        "--max-batch", type=int, default=16,
+        help="Max images per forward pass (default: 16)",
+    )
+    parser.add_argument(
+        "--max-wait-ms", type=float, default=10.0,
+        help="Max time to wait for a batch to fill, in ms (default: 10)",
+    )
+    parser.add_argument(
+        "--prediction-cache", metavar="PATH",
+        help="SQLite file for cached predictions of re-submitted images (default: no cache)",
+    )
+    parser.add_argument(
+        "--prediction-cache-size", type=int, default=10_000,
+        help="Max cached predictions; least recently used are evicted (default: 10000)",
+    )
+    parser.add_argument(
+        "--db-pool-size", type=int, default=8,
+        help="Read-only database connections for /search (default: 8)",
+    )
+    parser.add_argument(
+        "--immutable-db", action="store_true",
+        help="Open the database with immutable=1 (no locking); only if nothing writes it while serving",
+    )
+    parser.add_argument(
+        "--quiet", "-q", action="store_true",
+        help="No per-request log lines or messages (use GET /metrics instead)",
+    )
+    args = parser.parse_args()
+    instrument.set_quiet(args.quiet)
+
+    print(f"Loading model: {args.model}")
+    with open(args.classes, "r", encoding="utf-8") as f:
+        class_map = json.load(f)
+    model = predict.load_model(args.model, num_classes=len(class_map), device=DEVICE, engine=args.engine)
+    transform = predict.get_transforms()
+    print("Successfully loaded model.")
+
+    print(f"Loading database: {args.db}")
+    profiles = look_up.SpeciesProfileCache(args.db)
+    print(f"Successfully loaded {len(profiles)} species profiles.")
+
+    db_pool = ConnectionPool(args.db, size=args.db_pool_size, immutable=args.immutable_db)
+    with db_pool.cursor() as cur:
+        if not search.has_index(cur):
+            print("No search index in the database; /search is disabled (run csv_to_db.py)")
+            db_pool.close()
+            db_pool = None
+
+    cache = None
+    if args.prediction_cache:
+        cache = PredictionCache(args.prediction_cache, args.model, args.topk, args.engine,
+                                max_entries=args.prediction_cache_size)
+        print(f"Prediction cache: {args.prediction_cache} ({len(cache)} entries)")
+
+    batcher = MicroBatcher(
+        model, class_map, DEVICE, args.topk,
+        max_batch_size=args.max_batch, max_wait=args.max_wait_ms / 1000,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(batcher, transform, profiles, cache, db_pool))
+    print(f"Serving on http://{args.host}:{args.port} (POST an image to /identify)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if db_pool is not None:
+            db_pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""Pack an image dataset into pre-resized uint8 shards and read them back without decoding.
+
+Decoding and resizing JPEGs dominates every epoch and every evaluation run
+on CPU. ``pack`` does that work once: each image is resized exactly like
+predict.Preprocess and stored as raw (C, H, W) uint8 pixels in NumPy
+``.npy`` shards. ShardDataset memory-maps the shards, so a sample is a view
+into the page cache; the only per-sample work left is the float conversion
+and normalization (or whatever augmentation the training transform does).
+
+Layout of a packed directory::
+
+    out/
+    ├─ index.json           # size, classes, per-shard counts, source paths
+    ├─ labels.npy           # int64 (N,)
+    ├─ images-00000.npy     # uint8 (n, 3, H, W)
+    └─ images-00001.npy ...
+
+Example:
+    $ python shards.py pack ../dataset/split/test ../shards/test
+    $ python shards.py pack ../dataset/split/manifest.csv ../shards/train --split train --size 256
+    $ python predict.py --shards ../shards/test -b 64 --topk 3
+
+Classes:
+    ShardDataset: torch Dataset over a packed directory.
+
+Functions:
+    pack(): write the shards for an ImageFolder tree or a split.py manifest.
+    iter_batches(): contiguous, normalized batches for evaluation.
+    main()
+
+Author: 3dr-zzZ
+"""
+
+import argparse
+import csv
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import torch
+from PIL import Image
+
+import predict
+
+
+# ------ configuration ------
+SHARD_SIZE = 1024  # images per shard (224x224: ~150 MiB)
+INDEX_NAME = "index.json"
+# ---------------------------
+
+
+def list_sources(
+    source: str | Path, class_map: dict[str, str] | None = None, split: str | None = None
+) -> tuple[list[Path], list[int], list[str]]:
+    """Image paths, labels and class names of an ImageFolder tree or a split.py manifest.csv.
+
+    With ``class_map`` the labels follow it (unknown folders get -1, as in
+    predict.list_image_folder); without it classes are the sorted folder
+    names, like torchvision's ImageFolder.
+    """
+    source = Path(source)
+    if source.suffix == ".csv":
+        with source.open(encoding="utf-8", newline="") as f:
+            rows = [r for r in csv.DictReader(f) if split is None or r["split"] == split]
+        pairs = [(Path(r["path"]), r["label"]) for r in rows]
+    else:
+        pairs = [(p, p.parent.name) for p in sorted(source.glob("*/*"))
+                 if p.suffix.lower() in predict.IMG_EXTS]
+
+    if class_map is not None:
+        classes = [class_map[str(i)] for i in range(len(class_map))]
+    else:
+        classes = sorted({name for _, name in pairs})
+    name_to_idx = {name.replace(" ", "_"): i for i, name in enumerate(classes)}
+    labels = [name_to_idx.get(name.replace(" ", "_"), -1) for _, name in pairs]
+    return [p for p, _ in pairs], labels, classes
+
+
+def _load_uint8(path: Path, preprocess: predict.Preprocess) -> np.ndarray | None:
+    try:
+        with Image.open(path) as img:
+            return preprocess.resize(img.convert("RGB")).numpy()
+    except Exception as exc:
+        print(f"[WARN] Skipping {path}: {exc}")
+        return None
+
+
+def pack(
+    source: str | Path,
+    out_dir: str | Path,
+    size: tuple[int, int] = (224, 224),
+    class_map: dict[str, str] | None = None,
+    split: str | None = None,
+    shard_size: int = SHARD_SIZE,
+    workers: int = 8,
+) -> dict:
+    """Decode, resize and write every image under ``source`` to shards in ``out_dir``.
+
+    Images are decoded on ``workers`` threads one shard at a time, so memory
+    stays at about one shard. Unreadable images are skipped. Returns the index.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths, labels, classes = list_sources(source, class_map, split)
+    preprocess = predict.Preprocess(size)
+
+    shards, kept_paths, kept_labels = [], [], []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(paths), shard_size):
+            chunk = paths[start:start + shard_size]
+            arrays = list(pool.map(lambda p: _load_uint8(p, preprocess), chunk))
+            keep = [i for i, a in enumerate(arrays) if a is not None]
+            if not keep:
+                continue
+            name = f"images-{len(shards):05d}.npy"
+            np.save(out_dir/name, np.stack([arrays[i] for i in keep]))
+            shards.append({"file": name, "count": len(keep)})
+            kept_paths += [str(chunk[i]) for i in keep]
+            kept_labels += [labels[start + i] for i in keep]
+            print(f"{name}: {len(keep)} images ({start + len(chunk)}/{len(paths)})")
+
+    np.save(out_dir/"labels.npy", np.asarray(kept_labels, dtype=np.int64))
+    index = {"size": list(size), "classes": classes, "shards": shards, "paths": kept_paths}
+    with open(out_dir/INDEX_NAME, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    return index
+
+
+class ShardDataset(torch.utils.data.Dataset):
+    """Samples of a packed directory as *(image, label)*.
+
+    ``image`` is the stored (3, H, W) uint8 tensor passed through
+    ``transform``; the default normalizes it exactly like predict.Preprocess,
+    so a 224x224 pack gives the same tensors as decoding the JPEGs. Training
+    can pass uint8 tensor augmentations instead (e.g. torchvision.transforms.v2
+    on a larger pack).
+
+    Shards are opened lazily with copy-on-write mmap in each process, so
+    DataLoader workers share the page cache instead of pickling pixels.
+    """
+
+    def __init__(self, root: str | Path, transform: Callable[[torch.Tensor], torch.Tensor] | None = None):
+        self.root = Path(root)
+        with open(self.root/INDEX_NAME, encoding="utf-8") as f:
+            self.index = json.load(f)
+        self.size = tuple(self.index["size"])
+        self.classes = self.index["classes"]
+        self.paths = self.index["paths"]
+        self.labels = torch.from_numpy(np.load(self.root/"labels.npy"))
+        self.offsets = np.cumsum([0] + [s["count"] for s in self.index["shards"]])
+        self.transform = transform if transform is not None else predict.Preprocess(self.size).normalize
+        self._shards = None
+
+    def shards(self) -> list[np.ndarray]:
+        if self._shards is None:
+            self._shards = [np.load(self.root/s["file"], mmap_mode="c") for s in self.index["shards"]]
+        return self._shards
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_shards"] = None  # re-mapped in the worker process
+        return state
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def locate(self, idx: int) -> tuple[int, int]:
+        """Shard number and row within it of sample ``idx``."""
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        shard = int(np.searchsorted(self.offsets, idx, side="right")) - 1
+        return shard, idx - int(self.offsets[shard])
+
+    def __getitem__(self, idx: int) -> tuple[torch.Tensor, int]:
+        shard, row = self.locate(idx)
+        image = torch.from_numpy(self.shards()[shard][row])
+        return self.transform(image), int(self.labels[idx])
+
+
+def iter_batches(dataset: ShardDataset, batch_size: int):
+    """Yield *(paths, labels, batch)* in stored order, slicing each shard directly.
+
+    A batch never spans two shards, so slicing is one contiguous read and
+    normalization runs on the whole batch at once.
+    """
+    normalize = predict.Preprocess(dataset.size).normalize
+    for shard, array in enumerate(dataset.shards()):
+        base = int(dataset.offsets[shard])
+        for start in range(0, len(array), batch_size):
+            stop = min(start + batch_size, len(array))
+            batch = normalize(torch.from_numpy(array[start:stop]))
+            yield (dataset.paths[base + start:base + stop],
+                   dataset.labels[base + start:base + stop], batch)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pack images into pre-resized uint8 shards")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("pack")
+    p.add_argument("source", help="ImageFolder tree (root/<class>/<image>) or split.py manifest.csv")
+    p.add_argument("out", help="Output directory")
+    p.add_argument("--split", help="Only this split of a manifest (train/test)")
+    p.add_argument("--classes", help="Class mapping JSON; labels follow it instead of sorted folder names")
+    p.add_argument("--size", type=int, nargs="+", default=[224],
+                   help="Stored size: one value for square, or H W (default: 224)")
+    p.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    p.add_argument("--workers", "-j", type=int, default=8)
+    args = parser.parse_args()
+
+    class_map = None
+    if args.classes:
+        with open(args.classes, "r", encoding="utf-8") as f:
+            class_map = json.load(f)
+    size = (args.size[0], args.size[-1])
+    index = pack(args.source, args.out, size, class_map, args.split, args.shard_size, args.workers)
+    n = sum(s["count"] for s in index["shards"])
+    print(f"Packed {n} images of {len(index['classes'])} classes into {len(index['shards'])} shards at {args.out}")
+
+
+if __name__ == "__main__":
+    main()
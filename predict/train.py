@@ -0,0 +1,344 @@
+"""Fine-tune ConvNeXt-Tiny on the pest dataset; the scripted version of train_model.ipynb.
+
+Produces the two files predict.py / workwork.py / server.py load:
+best_convnext_tiny.pth (state-dict of the best epoch on the validation set)
+and class_mapping.json ({"index": "class name"}).
+
+Recipe (same as the notebook): timm convnext_tiny.in12k backbone, MixUp/CutMix
+with label smoothing, AdamW + cosine schedule, head-only warm-up epochs with
+the backbone frozen, then full fine-tuning, early stopping on val accuracy.
+
+On top of that:
+    - multi-worker, pinned-memory DataLoaders (persistent workers, prefetch)
+    - images can come from ImageFolder trees or from shards.py packs
+    - autocast: bf16 on CPU, fp16 + GradScaler on CUDA (--amp)
+    - gradient accumulation (--accum) for large effective batches
+    - a resumable checkpoint after every epoch (--resume)
+    - per-epoch images/s and data-wait vs compute time, also written to train_log.jsonl
+    - validation uses predict.get_transforms(), i.e. exactly the inference preprocessing
+
+Example:
+    $ python train.py --train ../dataset/split/train --val ../dataset/split/test \\
+          --pretrained ../models/convnext_tiny_in12k.pth --workers 8
+    $ python train.py --train ../shards/train --val ../shards/test --shards --accum 4
+    $ python train.py ... --resume ../checkpoints/last.pt
+
+Functions:
+    get_train_transforms(): augmentation pipeline (PIL images or uint8 tensors).
+    build_loaders(): train / val DataLoaders and the class names.
+    build_model(): timm model with the pretrained backbone loaded.
+    train_one_epoch(), evaluate()
+    main()
+
+Author: 3dr-zzZ
+"""
+
+import argparse
+import json
+import re
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+import torch
+import torch.nn.functional as F
+
+import predict
+
+
+# ------ configuration ------
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+ARCH = "convnext_tiny.in12k"
+EPOCHS = 15
+FREEZE_BACKBONE_EPOCH = 7  # train only the head until this epoch
+LR_HEAD = 1e-3
+LR_FULL = 1e-4
+WEIGHT_DECAY = 1e-2
+PATIENCE = 6  # early stop after this many epochs without val improvement
+# ---------------------------
+
+
+def get_train_transforms(size: int = 224):
+    """Training augmentation; accepts PIL images (ImageFolder) and uint8 tensors (shards)."""
+    from torchvision.transforms import v2
+
+    return v2.Compose([
+        v2.ToImage(),
+        v2.RandomResizedCrop(size, scale=(0.7, 1), antialias=True),
+        v2.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.1),
+        v2.RandomHorizontalFlip(),
+        v2.RandomRotation(degrees=10),
+        v2.ToDtype(torch.float32, scale=True),
+        v2.Normalize(mean=predict.MEAN, std=predict.STD),
+        v2.RandomErasing(p=0.25),
+    ])
+
+
+def build_loaders(args) -> tuple[torch.utils.data.DataLoader, torch.utils.data.DataLoader, list[str]]:
+    """Train / val loaders and the class names (index order = label order)."""
+    if args.shards:
+        import shards
+
+        train_ds = shards.ShardDataset(args.train, transform=get_train_transforms(args.img_size))
+        val_ds = shards.ShardDataset(args.val)  # default transform = inference normalization
+        if train_ds.classes != val_ds.classes:
+            raise ValueError(f"{args.train} and {args.val} were packed with different classes")
+        if val_ds.size != (args.img_size, args.img_size):
+            raise ValueError(f"{args.val} is packed at {val_ds.size}, expected {args.img_size}")
+        classes = train_ds.classes
+    else:
+        from torchvision import datasets
+
+        train_ds = datasets.ImageFolder(args.train, transform=get_train_transforms(args.img_size))
+        val_ds = datasets.ImageFolder(args.val, transform=predict.get_transforms(args.img_size))
+        if train_ds.classes != val_ds.classes:
+            raise ValueError(f"{args.train} and {args.val} have different class folders")
+        classes = train_ds.classes
+
+    pin = args.device.startswith("cuda")
+    loader_kwargs = dict(batch_size=args.batch_size, num_workers=args.workers, pin_memory=pin)
+    if args.workers > 0:
+        loader_kwargs.update(persistent_workers=True, prefetch_factor=args.prefetch)
+    train_dl = torch.utils.data.DataLoader(train_ds, shuffle=True, drop_last=True, **loader_kwargs)
+    val_dl = torch.utils.data.DataLoader(val_ds, shuffle=False, **loader_kwargs)
+    return train_dl, val_dl, classes
+
+
+def build_model(num_classes: int, pretrained: str | Path | None, device: str) -> torch.nn.Module:
+    """timm ConvNeXt-Tiny with a fresh head; backbone weights from ``pretrained`` if given."""
+    import timm
+
+    model = timm.create_model(ARCH, pretrained=False, num_classes=num_classes, drop_path_rate=0.1)
+    if pretrained:
+        raw = torch.load(pretrained, map_location="cpu", weights_only=True)
+        state_dict = raw["model"] if isinstance(raw, dict) and "model" in raw else raw
+        # strip 'module.' (DDP) and drop the old classifier
+        state_dict = {re.sub(r"^module\.", "", k): v for k, v in state_dict.items()
+                      if not re.sub(r"^module\.", "", k).startswith("head.fc.")}
+        missing, unexpected = model.load_state_dict(state_dict, strict=False)
+        missing = [k for k in missing if not k.startswith("head.fc.")]
+        if missing or unexpected:
+            raise ValueError(f"{pretrained} does not match {ARCH}: missing={missing} unexpected={unexpected}")
+        print(f"Loaded backbone weights from {pretrained}")
+    return model.to(device)
+
+
+def set_backbone_trainable(model: torch.nn.Module, flag: bool) -> None:
+    for name, p in model.named_parameters():
+        if not name.startswith("head."):
+            p.requires_grad = flag
+
+
+def make_optimizer(model: torch.nn.Module, frozen: bool, t_max: int):
+    """AdamW + cosine for the current stage (head only while frozen, else everything)."""
+    if frozen:
+        params, lr = [p for n, p in model.named_parameters() if n.startswith("head.")], LR_HEAD
+    else:
+        params, lr = model.parameters(), LR_FULL
+    optimizer = torch.optim.AdamW(params, lr=lr, weight_decay=WEIGHT_DECAY)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=max(t_max, 1))
+    return optimizer, scheduler
+
+
+def autocast_for(device: str, amp: str):
+    if amp == "off":
+        return nullcontext()
+    dtype = torch.bfloat16 if amp == "bf16" else torch.float16
+    return torch.autocast(device_type=device.split(":")[0], dtype=dtype)
+
+
+def train_one_epoch(model, loader, optimizer, scaler, mixup_fn, criterion, args) -> dict:
+    """One pass over ``loader``; optimizer steps every ``args.accum`` batches.
+
+    Loss/accuracy are accumulated on the device (no per-step host sync);
+    data-wait is the time spent blocked on the loader, compute everything else.
+    """
+    model.train()
+    device = args.device
+    loss_sum = torch.zeros((), device=device)
+    correct = torch.zeros((), device=device, dtype=torch.long)
+    seen = 0
+    data_wait = compute = 0.0
+    n_batches = len(loader)
+    optimizer.zero_grad(set_to_none=True)
+
+    t_ready = time.perf_counter()
+    for step, (imgs, labels) in enumerate(loader, start=1):
+        t_got = time.perf_counter()
+        data_wait += t_got - t_ready
+
+        imgs = imgs.to(device, non_blocking=True)
+        labels = labels.to(device, non_blocking=True)
+        hard_labels = labels
+        if mixup_fn is not None:
+            imgs, labels = mixup_fn(imgs, labels)
+        with autocast_for(device, args.amp):
+            logits = model(imgs)
+            loss = criterion(logits, labels)
+        scaler.scale(loss / args.accum).backward()
+        if step % args.accum == 0 or step == n_batches:
+            scaler.step(optimizer)
+            scaler.update()
+            optimizer.zero_grad(set_to_none=True)
+
+        loss_sum += loss.detach() * imgs.size(0)
+        correct += (logits.detach().argmax(1) == hard_labels).sum()
+        seen += imgs.size(0)
+        t_ready = time.perf_counter()
+        compute += t_ready - t_got
+
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    total = data_wait + compute
+    return {
+        "train_loss": loss_sum.item() / max(seen, 1),
+        "train_acc": correct.item() / max(seen, 1),
+        "images": seen,
+        "images_per_sec": seen / total if total else 0.0,
+        "data_wait_s": data_wait,
+        "compute_s": compute,
+    }
+
+
+@torch.inference_mode()
+def evaluate(model, loader, args) -> dict:
+    model.eval()
+    loss_sum, correct, seen = 0.0, 0, 0
+    t0 = time.perf_counter()
+    with autocast_for(args.device, args.amp):
+        for imgs, labels in loader:
+            imgs = imgs.to(args.device, non_blocking=True)
+            labels = labels.to(args.device, non_blocking=True)
+            logits = model(imgs).float()
+            loss_sum += F.cross_entropy(logits, labels, reduction="sum").item()
+            correct += (logits.argmax(1) == labels).sum().item()
+            seen += labels.size(0)
+    elapsed = time.perf_counter() - t0
+    return {"val_loss": loss_sum / max(seen, 1), "val_acc": correct / max(seen, 1),
+            "val_images_per_sec": seen / elapsed if elapsed else 0.0}
+
+
+def save_checkpoint(path: Path, **state) -> None:
+    tmp = path.with_name(path.name + ".part")
+    torch.save(state, tmp)
+    tmp.replace(path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Train the pest classifier")
+    parser.add_argument("--train", required=True, help="Training ImageFolder tree (or shards.py pack with --shards)")
+    parser.add_argument("--val", required=True, help="Validation ImageFolder tree (or shards.py pack with --shards)")
+    parser.add_argument("--shards", action="store_true", help="--train/--val are directories packed by shards.py")
+    parser.add_argument("--pretrained", help="Backbone weights, e.g. models/convnext_tiny_in12k.pth")
+    parser.add_argument("--out", default=PROJECT_ROOT, help="Where best_convnext_tiny.pth / class_mapping.json go")
+    parser.add_argument("--checkpoint", help="Resumable checkpoint path (default: <out>/checkpoints/last.pt)")
+    parser.add_argument("--resume", help="Continue from a checkpoint written by a previous run")
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--freeze-epochs", type=int, default=FREEZE_BACKBONE_EPOCH)
+    parser.add_argument("--batch-size", "-b", type=int, default=64)
+    parser.add_argument("--accum", type=int, default=1, help="Batches per optimizer step (default: 1)")
+    parser.add_argument("--workers", "-j", type=int, default=4, help="DataLoader worker processes (default: 4)")
+    parser.add_argument("--prefetch", type=int, default=2, help="Batches prefetched per worker (default: 2)")
+    parser.add_argument("--img-size", type=int, default=224)
+    parser.add_argument("--amp", choices=("auto", "off", "bf16", "fp16"), default="auto",
+                        help="Autocast dtype; auto = fp16 on CUDA, bf16 on CPU")
+    parser.add_argument("--no-mixup", action="store_true", help="Disable MixUp/CutMix (label smoothing stays)")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--threads", type=int, help="torch intra-op threads for CPU training")
+    args = parser.parse_args()
+
+    if args.amp == "auto":
+        args.amp = "fp16" if args.device.startswith("cuda") else "bf16"
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    ckpt_path = Path(args.checkpoint) if args.checkpoint else out_dir/"checkpoints"/"last.pt"
+    ckpt_path.parent.mkdir(parents=True, exist_ok=True)
+
+    train_dl, val_dl, classes = build_loaders(args)
+    num_classes = len(classes)
+    print(f"{num_classes} classes, {len(train_dl.dataset)} train / {len(val_dl.dataset)} val images, "
+          f"device={args.device}, amp={args.amp}, batch={args.batch_size}x{args.accum}, workers={args.workers}")
+
+    idx_to_class = {str(i): name for i, name in enumerate(classes)}
+    with open(out_dir/"class_mapping.json", "w", encoding="utf-8") as f:
+        json.dump(idx_to_class, f, indent=2, ensure_ascii=False)
+
+    from timm.data import Mixup
+    from timm.loss import LabelSmoothingCrossEntropy, SoftTargetCrossEntropy
+
+    if args.no_mixup:
+        mixup_fn, criterion = None, LabelSmoothingCrossEntropy(smoothing=0.1)
+    else:
+        mixup_fn = Mixup(num_classes=num_classes, mixup_alpha=0.1, cutmix_alpha=0.5,
+                         switch_prob=0.5, mode="batch", label_smoothing=0.1)
+        criterion = SoftTargetCrossEntropy()
+
+    model = build_model(num_classes, None if args.resume else args.pretrained, args.device)
+    start_epoch, best_val, bad_epochs, frozen = 1, 0.0, 0, args.freeze_epochs > 0
+    state = None
+    if args.resume:
+        state = torch.load(args.resume, map_location=args.device, weights_only=False)
+        if state["classes"] != classes:
+            raise ValueError(f"{args.resume} was trained on different classes")
+        model.load_state_dict(state["model"])
+        start_epoch, best_val = state["epoch"] + 1, state["best_val"]
+        bad_epochs, frozen = state["bad_epochs"], state["frozen"]
+        print(f"Resumed from {args.resume} at epoch {start_epoch} (best val acc {best_val:.2%})")
+
+    set_backbone_trainable(model, not frozen)
+    optimizer, scheduler = make_optimizer(model, frozen, args.epochs if frozen else args.epochs - args.freeze_epochs)
+    scaler = torch.amp.GradScaler(args.device.split(":")[0], enabled=args.amp == "fp16")
+    if state is not None:
+        optimizer.load_state_dict(state["optimizer"])
+        scheduler.load_state_dict(state["scheduler"])
+        scaler.load_state_dict(state["scaler"])
+
+    log_path = out_dir/"train_log.jsonl"
+    for epoch in range(start_epoch, args.epochs + 1):
+        t0 = time.perf_counter()
+        train = train_one_epoch(model, train_dl, optimizer, scaler, mixup_fn, criterion, args)
+        val = evaluate(model, val_dl, args)
+        scheduler.step()
+        record = {"epoch": epoch, **train, **val, "lr": optimizer.param_groups[0]["lr"],
+                  "frozen": frozen, "epoch_s": time.perf_counter() - t0}
+
+        busy = train["data_wait_s"] + train["compute_s"]
+        print(f"[{epoch:02}/{args.epochs}] "
+              f"train {train['train_loss']:.3f}/{train['train_acc']:.2%} │ "
+              f"val {val['val_loss']:.3f}/{val['val_acc']:.2%} │ "
+              f"{train['images_per_sec']:.1f} img/s, data-wait {train['data_wait_s']:.1f}s "
+              f"({train['data_wait_s'] / busy if busy else 0:.0%}) compute {train['compute_s']:.1f}s │ "
+              f"lr {record['lr']:.1e} │ {record['epoch_s']:.1f}s")
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+        stop = False
+        if val["val_acc"] > best_val:
+            best_val, bad_epochs = val["val_acc"], 0
+            torch.save(model.state_dict(), out_dir/"best_convnext_tiny.pth")
+        else:
+            bad_epochs += 1
+            stop = bad_epochs >= PATIENCE
+
+        if frozen and epoch >= args.freeze_epochs:
+            print("Unfreezing backbone.")
+            frozen = False
+            set_backbone_trainable(model, True)
+            optimizer, scheduler = make_optimizer(model, frozen, args.epochs - epoch)
+
+        save_checkpoint(ckpt_path, model=model.state_dict(), optimizer=optimizer.state_dict(),
+                        scheduler=scheduler.state_dict(), scaler=scaler.state_dict(),
+                        epoch=epoch, best_val=best_val, bad_epochs=bad_epochs,
+                        frozen=frozen, classes=classes)
+        if stop:
+            print("Early stopping: no val improvement.")
+            break
+
+    print(f"Best val acc {best_val:.2%}; weights in {out_dir/'best_convnext_tiny.pth'}, "
+          f"classes in {out_dir/'class_mapping.json'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,65 +3,133 @@
 Example:
     $ python workwork.py pest_img.jpg
 
+Importing this module is cheap: torch and the model are only loaded by
+load_classifier(), so DB-only users never pay for them. Predictions are
+kept in a prediction cache (see cache.py), so re-submitting a photo skips
+loading the model altogether. QUIET, METRICS_PATH and PROFILE below turn on
+instrument.py's quiet mode, per-stage metrics and profiling. Labels that
+are not an exact scientific name in the database are resolved through
+search.py (aliases, Chinese names, typos).
+
 Functions:
+    load_classifier(): load the class map and the model.
     main()
 
 Author: 3dr-zzZ
 """
 
-import torch, json
-import predict, look_up
-
+import json
+import time
 from pathlib import Path
 from sys import argv
 
+import instrument
+import look_up
+import search
+from cache import PredictionCache
+
 
 # ------ configuration ------
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 DB_PATH = PROJECT_ROOT/"database"/"pests.db"
 MODEL_PATH = PROJECT_ROOT/"best_convnext_tiny.pth"
 CLASS_MAP_PATH = PROJECT_ROOT/"class_mapping.json"
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 TOPK = 3
+MODEL_CACHE = True  # keep a pre-built model next to the weights for fast start-up
+PREDICTION_CACHE_PATH = PROJECT_ROOT/"database"/"prediction_cache.db"  # None disables it
+PREDICTION_CACHE_SIZE = 10_000  # entries
+QUIET = False  # drop per-call progress prints (e.g. predict_one's "running on")
+METRICS_PATH = None  # write per-stage timings here (.prom: Prometheus text, else JSON)
+PROFILE = None  # "cprofile" or "torch" to profile classification + look-up
 # ---------------------------
 
 
 # ------ load model ------
-print(f"Loading model: {MODEL_PATH}")
-with open(CLASS_MAP_PATH, "r", encoding="utf-8") as f:
+def load_classifier():
+    """Return *(model, transform, class_map, device)*; imports torch on first use."""
+    import torch
+    import predict
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    print(f"Loading model: {MODEL_PATH}")
+    with open(CLASS_MAP_PATH, "r", encoding="utf-8") as f:
         class_map = json.load(f)
-model = predict.load_model(MODEL_PATH, num_classes = len(class_map), device = DEVICE)
-transform = predict.get_transforms()
-print("Successfully loaded model.")
+    model = predict.load_model(MODEL_PATH, num_classes = len(class_map), device = device,
+                               cache = MODEL_CACHE)
+    transform = predict.get_transforms()
+    print("Successfully loaded model.")
+    return model, transform, class_map, device
 
-# ------ load database ------
-print(f"Loading database: {DB_PATH}")
-cur = look_up.load_database(DB_PATH)
-print("Successfully loaded database.\n")
 
+def main():
+    t_start = time.perf_counter()
+    instrument.set_quiet(QUIET)
+    IMG_PATH = argv[1]
+    image_bytes = Path(IMG_PATH).read_bytes()
+    label_confs = cache = None
+    if PREDICTION_CACHE_PATH is not None:
+        cache = PredictionCache(PREDICTION_CACHE_PATH, MODEL_PATH, TOPK, max_entries=PREDICTION_CACHE_SIZE)
+        image_key = cache.key(image_bytes)
+        label_confs = cache.get(image_key)
+    if label_confs is None:
+        model, transform, class_map, device = load_classifier()
 
-if __name__ == "__main__":
-    import time
+    # ------ load database ------
+    print(f"Loading database: {DB_PATH}")
+    cur = look_up.load_database(DB_PATH, read_only=True)
+    print("Successfully loaded database.\n")
     t0 = time.perf_counter()
+    print(f"Start-up took {t0 - t_start:.3f}s\n")
+    instrument.observe("workwork.startup", t0 - t_start)
 
-    IMG_PATH = argv[1]
-    print(f"Classifying: {IMG_PATH}")
-    label_confs = predict.predict_one(IMG_PATH, model, transform, class_map, DEVICE, TOPK)
-    lbls = []
-    confs = []
-    for lbl, conf in label_confs:
-        lbls.append(lbl.replace("_", " "))
-        confs.append(confs)
-        pairs = [f"{lbl} (confidence={conf:.2%})"]
-        print(f", ".join(pairs))
-    t1 = time.perf_counter()
-    print(f"Classifying took {t1 - t0:.3f}s\n")
-    
-    print(f"Searching in database: {DB_PATH}")
-    for i in range(len(lbls)):
-        scientific_name = " ".join(lbls[i].split()[-2:])
-        print(f"{scientific_name}:")
-        look_up.format_db_output(look_up.look_up(scientific_name, cur))  # look up and format the result
-        print("\n")
-    t2 = time.perf_counter()
-    print(f"Searching took {t2 - t1:.3f}s\n")
\ No newline at end of file
+    with instrument.profile(PROFILE):
+        print(f"Classifying: {IMG_PATH}")
+        if label_confs is None:
+            import predict
+            label_confs = predict.predict_one(IMG_PATH, model, transform, class_map, device, TOPK)
+            if cache is not None:
+                cache.put(image_key, label_confs)
+        else:
+            print("(cached result)")
+        lbls = []
+        confs = []
+        for lbl, conf in label_confs:
+            lbls.append(lbl.replace("_", " "))
+            confs.append(conf)
+            pairs = [f"{lbl} (confidence={conf:.2%})"]
+            print(f", ".join(pairs))
+        t1 = time.perf_counter()
+        print(f"Classifying took {t1 - t0:.3f}s\n")
+        instrument.observe("workwork.classify", t1 - t0)
+
+        print(f"Searching in database: {DB_PATH}")
+        scientific_names = [" ".join(lbl.split()[-2:]) for lbl in lbls]
+        db_rslts = look_up.look_up_many(scientific_names, cur)  # all top-k labels in one go
+        for scientific_name in scientific_names:
+            print(f"{scientific_name}:")
+            if db_rslts[scientific_name] is None:
+                # the label may be a synonym, a misspelling or an authored/trinomial form
+                resolved = search.resolve(cur, scientific_name)
+                if resolved is not None:
+                    print(f"(matched as {resolved})")
+                    db_rslts[scientific_name] = look_up.look_up(resolved, cur)
+            if db_rslts[scientific_name] is None:
+                instrument.info("数据库尚未收录该物种")
+            look_up.format_db_output(db_rslts[scientific_name])  # format the result
+            print("\n")
+        t2 = time.perf_counter()
+        print(f"Searching took {t2 - t1:.3f}s\n")
+        instrument.observe("workwork.search", t2 - t1)
+
+    if METRICS_PATH is not None:
+        instrument.dump(METRICS_PATH)
+        print(instrument.summary())
+    if cache is not None:
+        stats = cache.stats()
+        print(f"Prediction cache: {stats['hits']} hit(s), {stats['misses']} miss(es), "
+              f"{stats['entries']}/{stats['max_entries']} entries")
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()